@@ -0,0 +1,197 @@
+"""Pre-generated answers to the most popular opening questions.
+
+A question that opens a conversation gets the same kind of answer whoever
+asks it, so the top questions in the query log (query_log.py) are answered
+ahead of time and served from memory instead of the live API. Only opening
+questions are cached: a follow-up's answer depends on the conversation.
+
+A Warmer thread wakes every ``WARM_INTERVAL`` seconds. It takes each
+persona's top ``WARM_TOP_K`` questions that at least ``WARM_MIN_SESSIONS``
+sessions have asked, ``WARM_MIN_COUNT`` times in all, and answers the
+uncached ones, at most ``WARM_PER_CYCLE`` per wake-up. It then decays the
+counts, so the head follows current traffic. Preset questions are warmed
+like any other once they are clicked often enough.
+
+With ``SHARED_DB`` set (see serve.py) the answers live in the shared store,
+so every worker process serves them. Each worker warms from its own query
+log, and claims an answer before generating it so no other worker does too.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from shared_store import SharedStore, get_shared_store
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "500"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+
+# Seconds between warming passes; 0 turns warming (and so the cache) off
+WARM_INTERVAL = float(os.getenv("WARM_INTERVAL", "300"))
+WARM_TOP_K = int(os.getenv("WARM_TOP_K", "10"))
+WARM_MIN_COUNT = float(os.getenv("WARM_MIN_COUNT", "3"))
+WARM_MIN_SESSIONS = int(os.getenv("WARM_MIN_SESSIONS", "2"))
+WARM_PER_CYCLE = int(os.getenv("WARM_PER_CYCLE", "20"))
+
+# Counts are scaled by this after every pass (about a half-life of 7 passes)
+WARM_DECAY = 0.9
+
+class AnswerCache:
+    """Answers by (persona id, normalised question, route name), least recently used out"""
+
+    def __init__(self, capacity: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> str:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, text: str):
+        with self._lock:
+            self._entries[key] = (text, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def fresh(self, key, margin: float = 0.0) -> bool:
+        """Cached, and not expiring within ``margin`` seconds"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[1] - margin > time.monotonic()
+
+    def claim(self, key, ttl: float) -> bool:
+        """Whether to generate ``key`` now; only one process sharing the cache should"""
+        return True
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+class SharedAnswerCache:
+    """``AnswerCache`` kept in the shared store, for several worker processes"""
+
+    def __init__(self, store: SharedStore, capacity: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL):
+        self.store = store
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> str:
+        text = self.store.get_answer(key)
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return text
+
+    def put(self, key, text: str):
+        self.store.put_answer(key, text, self.ttl, self.capacity)
+
+    def fresh(self, key, margin: float = 0.0) -> bool:
+        return self.store.answer_expires(key) - margin > time.time()
+
+    def claim(self, key, ttl: float) -> bool:
+        return self.store.claim("warm:" + "\x1f".join(key), ttl)
+
+    def metrics(self) -> dict:
+        return {"entries": self.store.answer_count(), "hits": self.hits, "misses": self.misses}
+
+class Warmer:
+    """Answers the query log's top questions into the cache, in the background"""
+
+    def __init__(self, cache: AnswerCache, log, generate, interval: float = WARM_INTERVAL):
+        self.cache = cache
+        self.log = log
+        self.generate = generate
+        self.interval = interval
+        self.warmed = 0
+        self.failed = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def candidates(self) -> list:
+        """(count, key) of uncached top questions across personas, most asked first"""
+        found = []
+        for persona_id in self.log.personas():
+            for text, route_name, count in self.log.top(persona_id, WARM_TOP_K, WARM_MIN_COUNT, WARM_MIN_SESSIONS):
+                key = (persona_id, text, route_name)
+                # Refresh anything that would expire before the next pass
+                if not self.cache.fresh(key, 2 * self.interval):
+                    found.append((count, key))
+        found.sort(key=lambda pair: -pair[0])
+        return found[:WARM_PER_CYCLE]
+
+    def cycle(self) -> int:
+        """One warming pass; returns the number of answers cached"""
+        cached = 0
+        for _, key in self.candidates():
+            if self._stop.is_set():
+                break
+            if not self.cache.claim(key, self.interval):
+                continue  # another worker is answering it
+            try:
+                text = self.generate(*key)
+            except Exception:
+                text = None
+            if text:
+                self.cache.put(key, text)
+                cached += 1
+            else:
+                self.failed += 1
+        self.warmed += cached
+        self.log.decay(WARM_DECAY)
+        return cached
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="answer-warmer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.cycle()
+
+    def stop(self):
+        self._stop.set()
+
+_cache = None
+_cache_lock = threading.Lock()
+_warmer = None
+_warmer_lock = threading.Lock()
+
+def get_answer_cache() -> AnswerCache:
+    """The process-wide answer cache, in the shared store if there is one"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                store = get_shared_store()
+                _cache = SharedAnswerCache(store) if store is not None else AnswerCache()
+    return _cache
+
+def get_warmer(log, generate) -> Warmer:
+    """The process-wide warmer, started on first use; ``generate(persona_id, question, route_name)`` answers one question"""
+    global _warmer
+    if _warmer is None:
+        with _warmer_lock:
+            if _warmer is None:
+                _warmer = Warmer(get_answer_cache(), log, generate)
+                _warmer.start()
+    return _warmer
+
+def cache_metrics() -> dict:
+    metrics = get_answer_cache().metrics()
+    metrics["warmed"] = _warmer.warmed if _warmer is not None else 0
+    return metrics
@@ -0,0 +1,230 @@
+"""Headless HTTP API streaming the philosophers' answers as server-sent events.
+
+Runs alongside the Streamlit UI for clients that only need the answer (the LMS
+plugin, the mobile app), without script reruns or a websocket session:
+
+    uvicorn api:app --host 0.0.0.0 --port 8000
+
+Prompts are built by the same ``utils`` functions as the UI, so retrieval,
+debate summaries and quote checks behave identically. Completions go to each
+route's backends (see backends.py), with OpenAI requests over one shared API key
+pool (see key_pool.py), and at most
+``API_MAX_STREAMS`` completions are in flight upstream at once; the rest wait
+their turn.
+
+Endpoints:
+    GET  /health
+    GET  /personas
+    GET  /keys           per-key load, throughput and errors of the API key pool
+    POST /chat           {"persona", "question", "history": [{role, content}], "length"}
+    POST /debate/turn    {"topic", "speaker", "debaters": [names], "exchanges": [{speaker, content}]}
+
+Streaming responses send ``data: {"delta": "..."}`` events, then one
+``event: done`` with the full text and its quote checks (or ``event: error``).
+An opening question with a pre-generated answer (see answer_cache.py) is
+answered in one delta, and its ``done`` event has ``"cached": true``.
+"""
+import asyncio
+import json
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from backends import astream
+from key_pool import key_metrics
+from traces import StreamTimer
+from utils import (
+    DEFAULT_PERSONAS,
+    build_debate_messages,
+    build_prompt,
+    cached_answer,
+    debate_route,
+    estimate_tokens,
+    expected_tokens,
+    get_persona,
+    get_registry,
+    record_cancelled,
+    record_usage,
+    resolve,
+    aretrieve_context,
+    averify_quotes,
+)
+
+# Concurrent upstream completions per process
+API_MAX_STREAMS = int(os.getenv("API_MAX_STREAMS", "64"))
+
+# Optional shared secret; when set, requests need "Authorization: Bearer <token>"
+API_TOKEN = os.getenv("API_TOKEN")
+
+_limiter = None
+
+def get_limiter() -> asyncio.Semaphore:
+    global _limiter
+    if _limiter is None:
+        _limiter = asyncio.Semaphore(API_MAX_STREAMS)
+    return _limiter
+
+def sse(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_completion(messages: list, route):
+    """Yield SSE events for one completion, closing the upstream stream if the client leaves"""
+    timer = StreamTimer()
+    start = timer.start
+    parts = []
+    usage = None
+    async with get_limiter():
+        try:
+            stream, route = await astream(messages, route)
+            finished = False
+            try:
+                async for chunk in stream:
+                    usage = getattr(chunk, "usage", None) or usage
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        timer.tick()
+                        parts.append(chunk.choices[0].delta.content)
+                        yield sse({"delta": parts[-1]})
+                finished = True
+            finally:
+                await stream.close()
+                if not finished:
+                    # The client disconnected (or the stream broke) before the answer was complete
+                    text = "".join(parts)
+                    record_usage(route, start, messages, text, usage, completed=False, timer=timer)
+                    record_cancelled(estimate_tokens(text), expected_tokens(route))
+        except Exception as e:
+            yield sse({"error": str(e)}, "error")
+            return
+    text = "".join(parts).strip()
+    record_usage(route, start, messages, text, usage, timer=timer)
+    checks = await averify_quotes(text) or ()
+    yield sse({
+        "text": text,
+        "quotes": [{"status": c.status, "reference": c.reference, "quote": c.quote} for c in checks],
+        "model": route.model,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }, "done")
+
+async def replay(text: str, route):
+    """SSE events for a pre-generated answer from the answer cache"""
+    start = time.perf_counter()
+    yield sse({"delta": text})
+    checks = await averify_quotes(text) or ()
+    yield sse({
+        "text": text,
+        "quotes": [{"status": c.status, "reference": c.reference, "quote": c.quote} for c in checks],
+        "model": route.model,
+        "cached": True,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }, "done")
+
+def error(message: str, status: int = 400) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status)
+
+async def read_request(request):
+    """Parsed JSON body, or an error response"""
+    if API_TOKEN and request.headers.get("authorization") != f"Bearer {API_TOKEN}":
+        return None, error("unauthorized", 401)
+    try:
+        body = await request.json()
+    except ValueError:
+        return None, error("body must be JSON")
+    if not isinstance(body, dict):
+        return None, error("body must be a JSON object")
+    return body, None
+
+def lookup_persona(key):
+    try:
+        return get_persona(str(key))
+    except KeyError:
+        return None
+
+def speaker_name(key) -> str:
+    """Display name for a persona id or name, as the debate prompts use"""
+    persona = lookup_persona(key)
+    return persona.name if persona else str(key)
+
+def event_stream(events) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def health(request):
+    return JSONResponse({"status": "ok"})
+
+async def keys(request):
+    if API_TOKEN and request.headers.get("authorization") != f"Bearer {API_TOKEN}":
+        return error("unauthorized", 401)
+    return JSONResponse(key_metrics())
+
+async def personas(request):
+    return JSONResponse([
+        {"id": p.id, "name": p.name, "chinese_name": p.chinese_name, "title": p.title, "dates": p.dates, "focus": p.focus}
+        for p in get_registry().values()
+    ])
+
+async def chat(request):
+    body, failure = await read_request(request)
+    if failure:
+        return failure
+    persona = lookup_persona(body.get("persona", "confucius"))
+    question = body.get("question")
+    history = body.get("history") or []
+    if persona is None:
+        return error("unknown persona")
+    if not isinstance(question, str) or not question.strip():
+        return error("question is required")
+    if not isinstance(history, list) or not all(isinstance(m, dict) and "role" in m and "content" in m for m in history):
+        return error("history must be a list of {role, content}")
+
+    route = resolve("chat", body.get("length", "Medium"), persona)
+    if not history:
+        # Clients stand in for sessions when counting distinct askers; the
+        # lookup reads the shared SQLite store, so it runs off the event loop
+        cached = await run_in_threadpool(cached_answer, persona, question, route,
+                                         request.client.host if request.client else None)
+        if cached is not None:
+            return event_stream(replay(cached, route))
+    messages = build_prompt(persona.prompt, history, question, await aretrieve_context(persona, question))
+    return event_stream(stream_completion(messages, route))
+
+async def debate_turn(request):
+    body, failure = await read_request(request)
+    if failure:
+        return failure
+    topic = body.get("topic")
+    exchanges = body.get("exchanges") or []
+    speaker = lookup_persona(body.get("speaker", ""))
+    if speaker is None:
+        return error("unknown speaker")
+    debaters = []
+    for key in body.get("debaters") or DEFAULT_PERSONAS:
+        persona = lookup_persona(key)
+        if persona is None:
+            return error(f"unknown debater: {key}")
+        debaters.append(persona.name)
+    if speaker.name not in debaters or len(debaters) < 2:
+        return error("debaters must list at least two philosophers, including the speaker")
+    if not isinstance(topic, str) or not topic.strip():
+        return error("topic is required")
+    if not isinstance(exchanges, list) or not all(isinstance(m, dict) and "speaker" in m and "content" in m for m in exchanges):
+        return error("exchanges must be a list of {speaker, content}")
+
+    # Exchanges arrive as plain dicts; the debate state is rebuilt per request
+    exchanges = [{"role": "assistant", "speaker": speaker_name(m["speaker"]), "content": m["content"]} for m in exchanges]
+    other_last = exchanges[-1]["content"] if exchanges else None
+    # Retrieval inside waits on the offload pool; keep that wait off the event loop
+    messages = await asyncio.to_thread(build_debate_messages, topic, exchanges, speaker.name, other_last, debaters)
+    return event_stream(stream_completion(messages, debate_route(speaker.name, other_last)))
+
+app = Starlette(routes=[
+    Route("/health", health),
+    Route("/personas", personas),
+    Route("/keys", keys),
+    Route("/chat", chat, methods=["POST"]),
+    Route("/debate/turn", debate_turn, methods=["POST"]),
+])
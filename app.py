@@ -1,14 +1,24 @@
 import streamlit as st
-from PIL import Image
 from utils import (
     init_session_state,
-    get_response_streaming,
-    get_shared_css,
+    inject_shared_css,
+    deferred_export,
     export_conversation,
     create_navbar,
     show_preset_questions,
-    CONFUCIUS_SYSTEM_PROMPT,
-    MENCIUS_SYSTEM_PROMPT
+    show_metrics_panel,
+    show_search_box,
+    add_message,
+    show_transcript,
+    chat_turn_html,
+    get_registry,
+    resolve,
+    active_job,
+    submit_chat,
+    cancel_job,
+    follow_jobs,
+    Follower,
+    LENGTHS
 )
 
 # Initialize session state
@@ -33,7 +43,7 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # Apply shared CSS with current theme
-st.markdown(get_shared_css(st.session_state.theme), unsafe_allow_html=True)
+inject_shared_css(st.session_state.theme)
 
 # Navigation Bar
 create_navbar("main")
@@ -46,229 +56,178 @@ st.markdown("""
     </div>
 """, unsafe_allow_html=True)
 
-# Create two columns for side-by-side chatbots with equal spacing
-col1, col2 = st.columns([1, 1], gap="large")
-
-# Confucius Chatbot (Left Column)
-with col1:
+def render_persona_column(persona):
+    """Header, export controls, preset questions and chat for one philosopher"""
+    messages = st.session_state[persona.messages_key]
+    
     # Header with image and info side by side
     col_img, col_info = st.columns([1, 3], gap="medium")
     with col_img:
-        try:
-            st.image("confucius-2.png", width=70)
-        except:
-            pass
+        if persona.image_bytes:
+            st.image(persona.image_bytes, width=persona.image_width)
+        else:
+            st.markdown(f"<div style='font-size: 3rem; text-align: center;'>{persona.avatar}</div>", unsafe_allow_html=True)
     
     with col_info:
-        st.markdown("""
+        st.markdown(f"""
             <div class="philosopher-info" style="padding-top: 0.5rem;">
-                <div class="philosopher-name">孔子 Confucius</div>
-                <div class="philosopher-title">The Master of Practical Wisdom</div>
-                <div class="philosopher-chinese-title">至聖先師</div>
+                <div class="philosopher-name">{persona.chinese_name} {persona.name}</div>
+                <div class="philosopher-title">{persona.title}</div>
+                <div class="philosopher-chinese-title">{persona.honorific}</div>
             </div>
         """, unsafe_allow_html=True)
     
     st.markdown('<div style="height: 1rem;"></div>', unsafe_allow_html=True)
     
-    # Export controls for Confucius
-    if st.session_state.confucius_messages:
+    # Export controls
+    if messages:
         export_col1, export_col2 = st.columns([2, 1])
         with export_col1:
-            export_format_c = st.selectbox(
+            export_format = st.selectbox(
                 "Export format:", 
                 ["Text (.txt)", "Markdown (.md)", "JSON (.json)"], 
-                key="confucius_export_format",
+                key=f"{persona.id}_export_format",
                 label_visibility="collapsed"
             )
         with export_col2:
             format_map = {"Text (.txt)": "txt", "Markdown (.md)": "md", "JSON (.json)": "json"}
-            selected_format = format_map[export_format_c]
-            export_content = export_conversation(st.session_state.confucius_messages, "Confucius", selected_format)
-            
+            selected_format = format_map[export_format]
             st.download_button(
                 label="📥 Export",
-                data=export_content,
-                file_name=f"confucius_conversation.{selected_format}",
+                data=deferred_export(export_conversation, messages, persona.name, selected_format),
+                file_name=f"{persona.id}_conversation.{selected_format}",
                 mime="text/plain" if selected_format != "json" else "application/json",
+                key=f"{persona.id}_export",
                 use_container_width=True
             )
     
     # Preset questions
-    preset_question_c = show_preset_questions("confucius")
+    preset_question = show_preset_questions(persona.id)
     
     # Chat container
-    confucius_container = st.container(height=400)
-    with confucius_container:
-        for message in st.session_state.confucius_messages:
-            if message["role"] == "user":
-                with st.chat_message("user"):
-                    st.write(message["content"])
-            elif message["role"] == "assistant":
-                with st.chat_message("assistant"):
-                    st.write(message["content"])
-    
-    # Chat input
-    confucius_input = st.chat_input("Ask Confucius a question...", key="confucius_input")
-    
-    # Use preset question if clicked
-    if preset_question_c:
-        confucius_input = preset_question_c
-    
-    if confucius_input:
-        st.session_state.confucius_messages.append({"role": "user", "content": confucius_input})
-        
-        with confucius_container:
-            with st.chat_message("user"):
-                st.write(confucius_input)
-        
-        max_tokens = 500  # Medium length response
+    container = st.container(height=400)
+    with container:
+        if messages.spilled:
+            st.caption(f"🗄️ {messages.spilled} earlier messages archived (included in export)")
+        # Each message is rendered to sanitised HTML once; reruns reuse it
+        show_transcript(messages, lambda message: chat_turn_html(persona, message))
         
-        with confucius_container:
+        follower = None
+        job = active_job(persona.messages_key)
+        if job is not None:
+            # Answer still being generated in the background; re-attach to it
             with st.chat_message("assistant"):
-                with st.spinner("Contemplating..."):
-                    # Streaming response
-                    response_placeholder = st.empty()
-                    full_response = ""
-                    
-                    for chunk in get_response_streaming(
-                        confucius_input, 
-                        CONFUCIUS_SYSTEM_PROMPT, 
-                        st.session_state.confucius_messages[:-1],
-                        max_tokens
-                    ):
-                        full_response += chunk
-                        response_placeholder.write(full_response)
-        
-        st.session_state.confucius_messages.append({"role": "assistant", "content": full_response})
-        st.rerun()
-
-# Mencius Chatbot (Right Column)
-with col2:
-    # Header with image and info side by side
-    col_img, col_info = st.columns([1, 3], gap="medium")
-    with col_img:
-        try:
-            st.image("mencius.png", width=100)
-        except:
-            pass
-    
-    with col_info:
-        st.markdown("""
-            <div class="philosopher-info" style="padding-top: 0.5rem;">
-                <div class="philosopher-name">孟子 Mencius</div>
-                <div class="philosopher-title">The Philosopher of Human Goodness</div>
-                <div class="philosopher-chinese-title">亞聖</div>
-            </div>
-        """, unsafe_allow_html=True)
-    
-    st.markdown('<div style="height: 1rem;"></div>', unsafe_allow_html=True)
-    
-    # Export controls for Mencius
-    if st.session_state.mencius_messages:
-        export_col1, export_col2 = st.columns([2, 1])
-        with export_col1:
-            export_format_m = st.selectbox(
-                "Export format:", 
-                ["Text (.txt)", "Markdown (.md)", "JSON (.json)"], 
-                key="mencius_export_format",
-                label_visibility="collapsed"
-            )
-        with export_col2:
-            format_map = {"Text (.txt)": "txt", "Markdown (.md)": "md", "JSON (.json)": "json"}
-            selected_format = format_map[export_format_m]
-            export_content = export_conversation(st.session_state.mencius_messages, "Mencius", selected_format)
-            
-            st.download_button(
-                label="📥 Export",
-                data=export_content,
-                file_name=f"mencius_conversation.{selected_format}",
-                mime="text/plain" if selected_format != "json" else "application/json",
-                use_container_width=True
-            )
+                st.button("⏹ Stop", key=f"stop_{job.id}", on_click=job.cancel)
+                placeholder = st.empty()
+            follower = Follower(job, lambda answers: placeholder.write(
+                answers[0][1] if answers and answers[0][1] else f"*{persona.spinner}*"
+            ))
     
-    # Preset questions
-    preset_question_m = show_preset_questions("mencius")
-    
-    # Chat container
-    mencius_container = st.container(height=400)
-    with mencius_container:
-        for message in st.session_state.mencius_messages:
-            if message["role"] == "user":
-                with st.chat_message("user"):
-                    st.write(message["content"])
-            elif message["role"] == "assistant":
-                with st.chat_message("assistant"):
-                    st.write(message["content"])
-    
-    # Chat input
-    mencius_input = st.chat_input("Ask Mencius a question...", key="mencius_input")
+    # Chat input (one question at a time per philosopher)
+    user_input = st.chat_input(f"Ask {persona.name} a question...", key=f"{persona.id}_input", disabled=job is not None)
     
     # Use preset question if clicked
-    if preset_question_m:
-        mencius_input = preset_question_m
+    if preset_question and job is None:
+        user_input = preset_question
     
-    if mencius_input:
-        st.session_state.mencius_messages.append({"role": "user", "content": mencius_input})
-        
-        with mencius_container:
-            with st.chat_message("user"):
-                st.write(mencius_input)
-        
-        max_tokens = 500  # Medium length response
-        
-        with mencius_container:
-            with st.chat_message("assistant"):
-                with st.spinner("Reflecting..."):
-                    # Streaming response
-                    response_placeholder = st.empty()
-                    full_response = ""
-                    
-                    for chunk in get_response_streaming(
-                        mencius_input, 
-                        MENCIUS_SYSTEM_PROMPT, 
-                        st.session_state.mencius_messages[:-1],
-                        max_tokens
-                    ):
-                        full_response += chunk
-                        response_placeholder.write(full_response)
-        
-        st.session_state.mencius_messages.append({"role": "assistant", "content": full_response})
+    if user_input:
+        add_message(persona.messages_key, "user", user_input)
+        submit_chat(persona, user_input, resolve("chat", st.session_state.response_length, persona))
+        st.rerun()
+    
+    return follower
+
+registry = get_registry()
+selected_personas = [registry[pid] for pid in st.session_state.selected_personas if pid in registry]
+
+# Ask every shown philosopher at once (answers are fetched in parallel)
+if len(selected_personas) > 1:
+    ask_all = st.chat_input(
+        f"Ask all {len(selected_personas)} philosophers the same question...",
+        key="ask_all_input",
+        disabled=any(active_job(persona.messages_key) for persona in selected_personas)
+    )
+    if ask_all:
+        for persona in selected_personas:
+            add_message(persona.messages_key, "user", ask_all)
+            submit_chat(persona, ask_all, resolve("chat", st.session_state.response_length, persona))
         st.rerun()
 
+# One column per selected philosopher, side by side with equal spacing
+columns = st.columns(max(1, len(selected_personas)), gap="large")
+followers = []
+for column, persona in zip(columns, selected_personas):
+    with column:
+        follower = render_persona_column(persona)
+        if follower is not None:
+            followers.append(follower)
+
 # Sidebar
 with st.sidebar:
-    st.markdown("### 🗑️ Clear Conversations")
+    st.markdown("### 🏛️ Philosophers")
+    
+    def update_selected_personas():
+        st.session_state.selected_personas = st.session_state.persona_picker
+    
+    st.multiselect(
+        "Philosophers to consult:",
+        options=list(registry),
+        default=st.session_state.selected_personas,
+        format_func=lambda pid: f"{registry[pid].chinese_name} {registry[pid].name}",
+        key="persona_picker",
+        on_change=update_selected_personas,
+        label_visibility="collapsed"
+    )
+    
+    def update_response_length():
+        st.session_state.response_length = st.session_state.length_picker
+    
+    st.radio(
+        "Response length:",
+        options=list(LENGTHS),
+        index=list(LENGTHS).index(st.session_state.response_length),
+        key="length_picker",
+        on_change=update_response_length,
+        horizontal=True,
+        help="Brief answers use a faster, cheaper model"
+    )
     
-    if st.button("Clear Confucius Chat", use_container_width=True):
-        st.session_state.confucius_messages = []
-        st.rerun()
+    st.markdown("### 🗑️ Clear Conversations")
     
-    if st.button("Clear Mencius Chat", use_container_width=True):
-        st.session_state.mencius_messages = []
-        st.rerun()
+    for persona in selected_personas:
+        if st.button(f"Clear {persona.name} Chat", use_container_width=True):
+            cancel_job(persona.messages_key, discard=True)
+            st.session_state[persona.messages_key].clear()
+            st.rerun()
     
-    if st.button("Clear Both Chats", use_container_width=True):
-        st.session_state.confucius_messages = []
-        st.session_state.mencius_messages = []
+    if st.button("Clear All Chats", use_container_width=True):
+        for persona in registry.values():
+            cancel_job(persona.messages_key, discard=True)
+            st.session_state[persona.messages_key].clear()
         st.rerun()
     
     st.markdown("---")
     
-    st.markdown("""
+    show_search_box()
+    show_metrics_panel()
+    
+    about = "".join(
+        f"""
+        <p style='font-size: 0.85rem; margin-top: 1rem;'>
+        <strong>{persona.name} ({persona.chinese_name})</strong><br>
+        {persona.dates}<br>
+        Focus: {persona.focus}
+        </p>"""
+        for persona in selected_personas
+    )
+    st.markdown(f"""
         <div class='sidebar-content'>
         <p><strong>About</strong></p>
         <p style='font-size: 0.9rem; line-height: 1.6;'>
-        Compare the teachings of two influential Chinese philosophers who shaped Eastern thought for millennia.
-        </p>
-        <p style='font-size: 0.85rem; margin-top: 1rem;'>
-        <strong>Confucius (孔子)</strong><br>
-        551-479 BCE<br>
-        Focus: Ritual, propriety, and moral cultivation
-        </p>
-        <p style='font-size: 0.85rem; margin-top: 1rem;'>
-        <strong>Mencius (孟子)</strong><br>
-        372-289 BCE<br>
-        Focus: Inherent human goodness and moral nature
-        </p>
+        Compare the teachings of influential Chinese philosophers who shaped Eastern thought for millennia.
+        </p>{about}
         </div>
     """, unsafe_allow_html=True)
+
+# Stream any answers still being generated; interacting with the page does not stop them
+follow_jobs(followers)
@@ -0,0 +1,250 @@
+"""Chat-completion backends, chosen per route or persona, with fallback.
+
+    openai     the OpenAI API, over the key pool (key_pool.py)
+    local      an OpenAI-compatible server on this machine or network, such as
+               llama.cpp's llama-server, Ollama or vLLM, at LOCAL_BASE_URL
+    llamacpp   a quantised GGUF model run in-process on the CPU with
+               llama-cpp-python (optional; LOCAL_MODEL_PATH)
+
+Each Route lists backends in order of preference (see routing.py; a persona
+can set its own). ``complete`` and ``stream`` try them in turn and move on
+when one is not configured or fails before answering. A stream that has
+started is never switched mid-answer. Responses are OpenAI-shaped whichever
+backend served them, and each call also returns the Route it was served on,
+with the backend's model, so usage is recorded against what actually ran.
+"""
+import os
+import threading
+from collections import Counter
+
+from key_pool import get_key_pool
+
+LOCAL_BASE_URL = os.getenv("LOCAL_BASE_URL", "http://localhost:8080/v1")
+LOCAL_MODEL = os.getenv("LOCAL_MODEL", "qwen2.5-1.5b-instruct-q4_k_m")
+LOCAL_API_KEY = os.getenv("LOCAL_API_KEY", "local")
+LOCAL_TIMEOUT = float(os.getenv("LOCAL_TIMEOUT", "120"))
+
+LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH")
+LOCAL_CONTEXT = int(os.getenv("LOCAL_CONTEXT", "4096"))
+LOCAL_THREADS = int(os.getenv("LOCAL_THREADS", "0")) or None
+
+class BackendUnavailable(Exception):
+    """The backend is not configured, or cannot serve this kind of request"""
+
+class Backend:
+    """A chat-completion provider returning OpenAI-shaped responses"""
+    name = None
+
+    def model_for(self, route) -> str:
+        return route.model
+
+    def complete(self, messages: list, route):
+        raise NotImplementedError
+
+    def stream(self, messages: list, route):
+        """An iterable of chunks with ``close()``"""
+        raise NotImplementedError
+
+    async def astream(self, messages: list, route):
+        raise BackendUnavailable(f"{self.name} has no async streaming")
+
+class OpenAIBackend(Backend):
+    name = "openai"
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            pool = get_key_pool()
+            if not pool.keys:
+                raise BackendUnavailable("no OpenAI API key configured")
+            self._client = pool.client()
+        return self._client
+
+    @property
+    def async_client(self):
+        pool = get_key_pool()
+        if not pool.keys:
+            raise BackendUnavailable("no OpenAI API key configured")
+        return pool.async_client()
+
+    def complete(self, messages: list, route):
+        return self.client.chat.completions.create(messages=messages, **route.params())
+
+    def stream(self, messages: list, route):
+        return self.client.chat.completions.create(
+            messages=messages, stream=True, stream_options={"include_usage": True}, **route.params()
+        )
+
+    async def astream(self, messages: list, route):
+        return await self.async_client.chat.completions.create(
+            messages=messages, stream=True, stream_options={"include_usage": True}, **route.params()
+        )
+
+class LocalServerBackend(OpenAIBackend):
+    """An OpenAI-compatible server, such as llama-server, Ollama or vLLM"""
+    name = "local"
+
+    def __init__(self):
+        self._client = None
+        self._async = None
+
+    def model_for(self, route) -> str:
+        return LOCAL_MODEL
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(base_url=LOCAL_BASE_URL, api_key=LOCAL_API_KEY, timeout=LOCAL_TIMEOUT, max_retries=0)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async is None:
+            from openai import AsyncOpenAI
+            self._async = AsyncOpenAI(base_url=LOCAL_BASE_URL, api_key=LOCAL_API_KEY, timeout=LOCAL_TIMEOUT, max_retries=0)
+        return self._async
+
+    # Not every local server accepts stream_options; usage is estimated instead
+    def stream(self, messages: list, route):
+        return self.client.chat.completions.create(messages=messages, stream=True, **route.params())
+
+    async def astream(self, messages: list, route):
+        return await self.async_client.chat.completions.create(messages=messages, stream=True, **route.params())
+
+class LlamaStream:
+    """Chunks from the in-process model; holds the model until closed or finished"""
+
+    def __init__(self, chunks, lock: threading.Lock):
+        self._chunks = chunks
+        self._lock = lock
+        self._held = True
+
+    def __iter__(self):
+        from openai.types.chat import ChatCompletionChunk
+        try:
+            for chunk in self._chunks:
+                yield ChatCompletionChunk.model_validate(chunk)
+        finally:
+            self._release()
+
+    def _release(self):
+        if self._held:
+            self._held = False
+            self._lock.release()
+
+    def close(self):
+        try:
+            self._chunks.close()
+        finally:
+            self._release()
+
+class LlamaCppBackend(Backend):
+    """A GGUF model on the CPU in this process; one generation at a time"""
+    name = "llamacpp"
+
+    def __init__(self):
+        self._model = None
+        self._lock = threading.Lock()
+
+    def model_for(self, route) -> str:
+        return os.path.basename(LOCAL_MODEL_PATH or "llamacpp")
+
+    def model(self):
+        if self._model is None:
+            if not LOCAL_MODEL_PATH:
+                raise BackendUnavailable("LOCAL_MODEL_PATH is not set")
+            try:
+                from llama_cpp import Llama
+            except ImportError:
+                raise BackendUnavailable("llama-cpp-python is not installed")
+            self._model = Llama(model_path=LOCAL_MODEL_PATH, n_ctx=LOCAL_CONTEXT, n_threads=LOCAL_THREADS, verbose=False)
+        return self._model
+
+    def _params(self, route) -> dict:
+        return {"max_tokens": route.max_tokens, "temperature": route.temperature}
+
+    def complete(self, messages: list, route):
+        from openai.types.chat import ChatCompletion
+        with self._lock:
+            return ChatCompletion.model_validate(self.model().create_chat_completion(messages=messages, **self._params(route)))
+
+    def stream(self, messages: list, route):
+        model = self.model()
+        self._lock.acquire()
+        try:
+            chunks = model.create_chat_completion(messages=messages, stream=True, **self._params(route))
+        except BaseException:
+            self._lock.release()
+            raise
+        return LlamaStream(chunks, self._lock)
+
+BACKENDS = {"openai": OpenAIBackend, "local": LocalServerBackend, "llamacpp": LlamaCppBackend}
+
+_backends = {}
+_backends_lock = threading.Lock()
+_failovers = Counter()
+
+def get_backend(name: str) -> Backend:
+    """The process-wide instance of a backend"""
+    backend = _backends.get(name)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = _backends[name] = BACKENDS[name]()
+    return backend
+
+def chain(route, client=None) -> list:
+    """The route's backends in order; ``client`` stands in for the default OpenAI client"""
+    backends = []
+    for name in route.backends:
+        if name == "openai" and client is not None:
+            backends.append(OpenAIBackend(client))
+        elif name in BACKENDS:
+            backends.append(get_backend(name))
+    return backends
+
+def _attempts(route, client):
+    backends = chain(route, client)
+    if not backends:
+        raise BackendUnavailable(f"no known backend in {', '.join(route.backends) or 'an empty list'}")
+    for position, backend in enumerate(backends):
+        yield backend, route.served_by(backend.name, backend.model_for(route)), position == len(backends) - 1
+
+def complete(messages: list, route, client=None) -> tuple:
+    """(response, route it was served on) from the first backend that answers"""
+    for backend, served, last in _attempts(route, client):
+        try:
+            return backend.complete(messages, served), served
+        except Exception:
+            if last:
+                raise
+            _failovers[backend.name] += 1
+
+def stream(messages: list, route, client=None) -> tuple:
+    """(chunk stream, route it is served on) from the first backend that starts answering"""
+    for backend, served, last in _attempts(route, client):
+        try:
+            return backend.stream(messages, served), served
+        except Exception:
+            if last:
+                raise
+            _failovers[backend.name] += 1
+
+async def astream(messages: list, route) -> tuple:
+    """Async ``stream``; the in-process backend is skipped"""
+    for backend, served, last in _attempts(route, None):
+        try:
+            return await backend.astream(messages, served), served
+        except Exception:
+            if last:
+                raise
+            _failovers[backend.name] += 1
+
+def failover_metrics() -> dict:
+    """Requests each backend failed to start, so that the next one was tried"""
+    return dict(_failovers)
@@ -0,0 +1,180 @@
+"""Run a file of questions through the personas from the command line.
+
+Questions are read from JSONL, one object per line with a ``question`` field
+and optionally an ``id`` (the line number is used otherwise). Every question is
+asked of each selected persona at each selected length through the same
+``utils.get_response`` path as the chat page, on a bounded worker pool.
+
+Results are appended to the output JSONL as each one finishes, so the output
+doubles as the checkpoint: re-running the same command skips every
+(id, persona, length) already answered without error.
+
+    python batch_eval.py questions.jsonl -o results.jsonl \\
+        --personas confucius,mencius --lengths Brief,Detailed --workers 4
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from key_pool import get_key_pool, key_metrics
+from message_log import estimate_tokens
+from utils import LENGTHS, get_registry, get_response, resolve, retrieve_context, route_report, verify_quotes
+
+# Parallel API calls; kept modest so a long run stays under the account's rate limit
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+ERROR_PREFIX = "An error occurred"
+
+def read_questions(path: str) -> list:
+    """Return [(id, question)] from a JSONL file"""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            questions.append((str(item.get("id", number)), item["question"]))
+    return questions
+
+def completed_jobs(path: str) -> set:
+    """Keys of the results already in ``path`` that need not be re-run"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if not result.get("error"):
+                done.add((result["id"], result["persona"], result["length"]))
+    return done
+
+def run_job(client, job: tuple) -> dict:
+    """Ask one persona one question; returns the result record"""
+    question_id, question, persona, length = job
+    route = resolve("chat", length, persona)
+    start = time.perf_counter()
+    answer = get_response(question, persona.prompt, [], route, client, retrieve_context(persona, question))
+    latency = time.perf_counter() - start
+    error = answer.startswith(ERROR_PREFIX)
+    checks = None if error else verify_quotes(answer)
+    return {
+        "id": question_id,
+        "persona": persona.id,
+        "length": length,
+        "model": route.model,
+        "question": question,
+        "answer": answer,
+        "error": error,
+        "latency_ms": round(latency * 1000, 1),
+        "tokens": estimate_tokens(answer),
+        "prompt_hash": persona.prompt_hash,
+        "quotes": [[check.status, check.reference, check.quote] for check in checks or ()],
+    }
+
+def run(client, jobs: list, output: str, workers: int = BATCH_CONCURRENCY) -> list:
+    """Run jobs with at most ``workers`` in flight, appending results to ``output``"""
+    results = []
+    pending = set()
+    jobs = iter(jobs)
+    with open(output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            while True:
+                # Submit lazily so memory and cancellation stay bounded by the pool size
+                for job in jobs:
+                    pending.add(pool.submit(run_job, client, job))
+                    if len(pending) >= workers:
+                        break
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    result = future.result()
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    out.flush()
+                    results.append(result)
+                    mark = "!" if result["error"] else "."
+                    print(f"{mark} {result['id']:>6} {result['persona']:<10} {result['length']:<8} "
+                          f"{result['latency_ms']:8.0f} ms", file=sys.stderr)
+        except KeyboardInterrupt:
+            for future in pending:
+                future.cancel()
+            print("Interrupted; re-run the same command to resume.", file=sys.stderr)
+    return results
+
+def percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def summarise(results: list, skipped: int, elapsed: float) -> str:
+    """Throughput and latency report for one run"""
+    lines = [f"{len(results)} answered, {sum(r['error'] for r in results)} errors, "
+             f"{skipped} skipped (already in output), {elapsed:.1f}s wall"]
+    ok = [r for r in results if not r["error"]]
+    if ok:
+        tokens = sum(r["tokens"] for r in ok)
+        lines.append(f"throughput: {len(ok) / elapsed:.2f} answers/s, {tokens / elapsed:.0f} tokens/s")
+        groups = {"all": ok}
+        for result in ok:
+            groups.setdefault(f"{result['persona']}/{result['length']}", []).append(result)
+        lines.append(f"{'':<22}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'tokens':>8}")
+        for name, group in groups.items():
+            latencies = sorted(r["latency_ms"] for r in group)
+            lines.append(f"{name:<22}{len(group):>5}{statistics.median(latencies):>10.0f}"
+                         f"{percentile(latencies, 0.95):>10.0f}{latencies[-1]:>10.0f}"
+                         f"{statistics.mean(r['tokens'] for r in group):>8.0f}")
+        quotes = [q for r in ok for q in r["quotes"]]
+        if quotes:
+            attested = sum(status == "attested" for status, _, _ in quotes)
+            lines.append(f"quotations: {len(quotes)} checked, {attested} attested")
+    for row in route_report():
+        lines.append(f"route {row['route']:<16}{row['model']:<16}{row['requests']:>5} requests, "
+                     f"{row['prompt_tokens'] + row['completion_tokens']:>8} tokens, ${row['cost']:.4f}")
+    for row in key_metrics():
+        lines.append(f"{row['key']:<22}{row['requests']:>5} requests, {row['tokens']:>8} tokens, "
+                     f"{row['errors']} errors ({row['rate_limited']} rate limited)")
+    return "\n".join(lines)
+
+def main():
+    registry = get_registry()
+    parser = argparse.ArgumentParser(description="Ask the philosophers a file of questions.")
+    parser.add_argument("questions", help="JSONL file of {\"id\": ..., \"question\": ...}")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="results JSONL, appended to and resumed from")
+    parser.add_argument("--personas", default=",".join(registry), help=f"comma-separated ids (default: all of {', '.join(registry)})")
+    parser.add_argument("--lengths", default="Medium", help=f"comma-separated from {', '.join(LENGTHS)}")
+    parser.add_argument("--workers", type=int, default=BATCH_CONCURRENCY, help="concurrent requests")
+    parser.add_argument("--limit", type=int, help="only the first N questions")
+    args = parser.parse_args()
+
+    personas = [registry[key] for key in args.personas.split(",") if key in registry]
+    lengths = [length for length in args.lengths.split(",") if length in LENGTHS]
+    if not personas or not lengths:
+        parser.error("no valid personas or lengths selected")
+
+    pool = get_key_pool()
+    if not pool.keys:
+        print("OPENAI_API_KEY or OPENAI_API_KEYS is not set (see env_template.txt)", file=sys.stderr)
+        sys.exit(1)
+
+    questions = read_questions(args.questions)[:args.limit]
+    done = completed_jobs(args.output)
+    jobs = [(question_id, question, persona, length)
+            for question_id, question in questions
+            for persona in personas
+            for length in lengths
+            if (question_id, persona.id, length) not in done]
+    skipped = len(questions) * len(personas) * len(lengths) - len(jobs)
+    print(f"{len(jobs)} requests to run ({skipped} already done), {max(1, args.workers)} at a time", file=sys.stderr)
+
+    start = time.perf_counter()
+    results = run(pool.client(), jobs, args.output, max(1, args.workers))
+    print(summarise(results, skipped, time.perf_counter() - start))
+
+if __name__ == "__main__":
+    main()
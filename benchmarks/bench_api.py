@@ -0,0 +1,122 @@
+"""Per-request overhead of the HTTP API (api.py) against the Streamlit chat page.
+
+Both paths talk to a local fake OpenAI endpoint that streams a fixed answer
+with no delay, so the numbers are the app's own overhead:
+
+    direct     the OpenAI client calling the fake endpoint (the floor)
+    api        POST /chat over HTTP, read to the final SSE event
+    streamlit  one chat message through app.py in AppTest (a full script rerun,
+               without the browser websocket hop, so a lower bound)
+
+Also runs many API streams at once to check one process keeps up.
+
+Run from the project root:
+    python benchmarks/bench_api.py [requests] [concurrent]
+"""
+import http.client
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+from openai import OpenAI
+from starlette.applications import Starlette
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+
+ANSWER = ("The Master said, learning without thought is labour lost; thought without learning is perilous. "
+          "Cultivate yourself, and the family, the state and the world will follow.")
+
+async def fake_completions(request):
+    body = await request.json()
+
+    async def events():
+        for word in ANSWER.split(" "):
+            chunk = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                     "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+upstream = Starlette(routes=[Route("/v1/chat/completions", fake_completions, methods=["POST"])])
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def serve(app) -> int:
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return port
+
+def report(name: str, latencies: list):
+    latencies = sorted(latencies)
+    print(f"{name:<10}: p50 {statistics.median(latencies):7.1f} ms, p95 {latencies[int(len(latencies) * 0.95)]:7.1f} ms "
+          f"({len(latencies)} requests)")
+
+def api_request(port: int) -> float:
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    conn.request("POST", "/chat", json.dumps({"persona": "confucius", "question": "What is ren?"}),
+                 {"Content-Type": "application/json"})
+    body = conn.getresponse().read().decode()
+    conn.close()
+    assert "event: done" in body, body[:200]
+    return (time.perf_counter() - start) * 1000
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    concurrent = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    base_url = f"http://127.0.0.1:{serve(upstream)}/v1"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    import api
+    api_port = serve(api.app)
+
+    client = OpenAI(base_url=base_url)
+    direct = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        for _ in client.chat.completions.create(model="bench", messages=[{"role": "user", "content": "hi"}], stream=True):
+            pass
+        direct.append((time.perf_counter() - start) * 1000)
+    report("direct", direct)
+
+    api_request(api_port)  # warm up imports, index and client
+    report("api", [api_request(api_port) for _ in range(requests)])
+
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_file(os.path.join(os.path.dirname(api.__file__), "app.py"), default_timeout=30)
+    app.session_state["openai_client"] = client
+    app.run()
+    streamlit = []
+    for i in range(requests):
+        start = time.perf_counter()
+        app.chat_input(key="confucius_input").set_value(f"What is ren? ({i})").run()
+        streamlit.append((time.perf_counter() - start) * 1000)
+        if i % 10 == 9:
+            app.session_state["confucius_messages"].clear()
+    report("streamlit", streamlit)
+
+    with ThreadPoolExecutor(max_workers=concurrent) as pool:
+        start = time.perf_counter()
+        latencies = list(pool.map(lambda _: api_request(api_port), range(concurrent)))
+        wall = time.perf_counter() - start
+    report(f"api x{concurrent}", latencies)
+    print(f"{concurrent} concurrent streams finished in {wall * 1000:.0f} ms "
+          f"({concurrent / wall:.0f} streams/s, API_MAX_STREAMS={api.API_MAX_STREAMS})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Latency and throughput of each completion backend on the same prompts.
+
+Every backend answers the same chat prompts (the preset questions, asked of
+one persona on one route) through ``backends.get_backend(name).stream``,
+first one at a time and then ``concurrency`` at once:
+
+    ttft        time to the first streamed token
+    latency     time to the end of the answer
+    tokens/s    output tokens per second for one stream, and across the
+                concurrent batch (what one backend sustains)
+
+Backends that are not configured or not reachable are reported and skipped.
+Compare, for example, the API against llama-server on a school's own machine:
+
+    LOCAL_BASE_URL=http://localhost:8080/v1 python benchmarks/bench_backends.py \\
+        --backends openai,local --requests 10 --concurrency 4 --length Brief
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import BACKENDS, get_backend
+from message_log import estimate_tokens
+from utils import LENGTHS, PRESET_QUESTIONS, build_prompt, get_persona, resolve
+
+def prompts(persona_id: str, count: int) -> list:
+    persona = get_persona(persona_id)
+    questions = [q for group in PRESET_QUESTIONS.values() for q in group]
+    return [build_prompt(persona.prompt, [], questions[i % len(questions)]) for i in range(count)]
+
+def run_one(backend, messages: list, route) -> dict:
+    start = time.perf_counter()
+    first = None
+    parts = []
+    stream = backend.stream(messages, route)
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first is None:
+                    first = time.perf_counter()
+                parts.append(chunk.choices[0].delta.content)
+    finally:
+        stream.close()
+    end = time.perf_counter()
+    tokens = estimate_tokens("".join(parts))
+    return {"ttft": ((first or end) - start) * 1000, "latency": (end - start) * 1000,
+            "tokens": tokens, "rate": tokens / max(end - (first or start), 1e-6)}
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def report(name: str, results: list, wall: float = None):
+    ttft = [r["ttft"] for r in results]
+    latency = [r["latency"] for r in results]
+    line = (f"{name:<22} ttft p50 {statistics.median(ttft):7.0f} ms  p95 {percentile(ttft, 0.95):7.0f} ms   "
+            f"latency p50 {statistics.median(latency):7.0f} ms  p95 {percentile(latency, 0.95):7.0f} ms   "
+            f"{statistics.mean(r['rate'] for r in results):6.1f} tok/s per stream")
+    if wall:
+        line += f", {sum(r['tokens'] for r in results) / wall:6.1f} tok/s total"
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare completion backends on the same prompts.")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help=f"comma-separated from {', '.join(BACKENDS)}")
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--persona", default="confucius")
+    parser.add_argument("--length", default="Brief", choices=LENGTHS)
+    args = parser.parse_args()
+
+    route = resolve("chat", args.length)
+    batch = prompts(args.persona, args.requests)
+    print(f"{args.requests} prompts, route {route.name} ({route.max_tokens} max tokens), concurrency {args.concurrency}")
+    for name in args.backends.split(","):
+        backend = get_backend(name)
+        served = route.served_by(name, backend.model_for(route))
+        try:
+            run_one(backend, batch[0], served)  # warm-up: connection, model load
+        except Exception as e:
+            print(f"{name:<22} skipped: {e}")
+            continue
+        report(f"{name} ({served.model})"[:22], [run_one(backend, messages, served) for messages in batch])
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            start = time.perf_counter()
+            results = list(pool.map(lambda messages: run_one(backend, messages, served), batch))
+            wall = time.perf_counter() - start
+        report(f"{name} x{args.concurrency}", results, wall)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Import time and first paint for a cold process, checked against a budget.
+
+Each sample runs in a fresh interpreter, as after a scale-to-zero restart:
+
+    import       ``import utils``
+    first paint  the first full run of app.py / the debate page in AppTest
+
+First paint must not import openai or create a client; that happens on the
+first question. Exits non-zero when a median exceeds its budget, so it can
+gate CI. Budgets are milliseconds and can be overridden:
+
+    IMPORT_BUDGET_MS=400 FIRST_PAINT_BUDGET_MS=1000 python benchmarks/bench_cold_start.py [samples]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "400"))
+FIRST_PAINT_BUDGET_MS = float(os.getenv("FIRST_PAINT_BUDGET_MS", "1000"))
+
+IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import utils
+print(json.dumps({"ms": (time.perf_counter() - start) * 1000, "openai": "openai" in sys.modules}))
+"""
+
+FIRST_PAINT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=60)
+app.run()
+assert not app.exception, app.exception
+print(json.dumps({"ms": (time.perf_counter() - start) * 1000, "openai": "openai" in sys.modules,
+                  "client": app.session_state["openai_client"] is not None if "openai_client" in app.session_state else False}))
+"""
+
+def sample(snippet: str, *args) -> dict:
+    env = dict(os.environ)
+    env.pop("OPENAI_API_KEY", None)  # first paint must not need the key
+    result = subprocess.run([sys.executable, "-c", snippet, *args], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def check(name: str, samples: list, budget: float) -> bool:
+    times = sorted(s["ms"] for s in samples)
+    median = statistics.median(times)
+    eager = [key for key in ("openai", "client") if any(s.get(key) for s in samples)]
+    ok = median <= budget and not eager
+    print(f"{name:<28}: median {median:7.0f} ms, max {times[-1]:7.0f} ms, budget {budget:5.0f} ms"
+          f"{'  eager: ' + ', '.join(eager) if eager else ''}  {'ok' if ok else 'OVER'}")
+    return ok
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = [check("import utils", [sample(IMPORT_SNIPPET) for _ in range(samples)], IMPORT_BUDGET_MS)]
+    for page in ("app.py", os.path.join("pages", "1_Debate_Mode.py")):
+        runs = [sample(FIRST_PAINT_SNIPPET, os.path.join(ROOT, page)) for _ in range(samples)]
+        results.append(check(f"first paint {os.path.basename(page)}", runs, FIRST_PAINT_BUDGET_MS))
+    sys.exit(0 if all(results) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Debate prompt size per round: bounded DebateState context vs. raw transcript.
+
+Run from the project root:
+    python benchmarks/bench_debate_context.py [rounds]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from message_log import MessageLog, estimate_tokens
+from utils import build_debate_messages
+
+TOPIC = "What is the nature of human goodness?"
+
+def synthetic_turn(speaker: str, round_no: int) -> str:
+    sentence = (f"In round {round_no}, {speaker} holds that cultivation of the heart-mind "
+                f"through ritual and reflection is the root of goodness. ")
+    return sentence * 12  # ~250 words, about the size of a 400-token answer
+
+def prompt_tokens(messages: list) -> int:
+    return sum(estimate_tokens(msg["content"]) for msg in messages)
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 25
+    log = MessageLog()
+    log.append("user", TOPIC, type="topic")
+    log.append("assistant", synthetic_turn("Confucius", 0), speaker="Confucius", type="response")
+    log.append("assistant", synthetic_turn("Mencius", 0), speaker="Mencius", type="response")
+
+    print(f"{'round':>5}  {'bounded':>8}  {'raw transcript':>14}  {'build ms':>8}")
+    for round_no in range(1, rounds + 1):
+        for speaker in ("Confucius", "Mencius"):
+            other_last = [msg for msg in log if msg.get("speaker") and msg["speaker"] != speaker][-1]["content"]
+            start = time.perf_counter()
+            messages = build_debate_messages(TOPIC, log, speaker, other_last)
+            elapsed = time.perf_counter() - start
+            if speaker == "Confucius":
+                raw = prompt_tokens(messages[:1]) + sum(msg.tokens for msg in log)
+                print(f"{round_no:>5}  {prompt_tokens(messages):>8}  {raw:>14}  {elapsed * 1000:>8.2f}")
+            log.append("assistant", synthetic_turn(speaker, round_no), speaker=speaker, type="response")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""Microbenchmarks for the hot paths in utils, checked against a saved baseline.
+
+Each case is timed on fixed synthetic histories of 10, 1,000 and 100,000
+messages (the same text on every run), or once if it does not depend on the
+history:
+
+    export/*          export_conversation and export_debate as txt, md and json
+    prompt/*          build_prompt as called by get_response_streaming, for a
+                      MessageLog and for a plain list (the HTTP API), and the
+                      debate context built by build_debate_messages
+    css/*             get_shared_css, cached and uncached
+    cache/*           cached transcript HTML, the answer cache, the HTML renderer
+    tokens/*          token counting and the tokenisers used by retrieval,
+                      search and the query log
+
+A case is one function registered with ``@case``; it gets the history size and
+returns the callable to time. New caches and tokenisers get a case the same way.
+
+Times are the median of ``--repeat`` runs, in microseconds per call. Each run
+is followed by a run of ``reference``, a fixed loop of plain Python, and the
+baseline keeps each case's time relative to it: ``--save`` writes these to
+``hot_paths_baseline.json`` next to this file. Relative times carry over
+between machines and between a quiet and a busy one. ``--check`` exits 1 when
+a case is slower than its baseline, at this run's reference speed, by more
+than ``--tolerance`` and by at least REGRESSION_FLOOR_US, so it can gate CI.
+
+Run from the project root:
+    python benchmarks/bench_hot_paths.py [--save | --check] [--tolerance 0.3] [--sizes 10 1000 100000] [-k export]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from answer_cache import AnswerCache
+from debate_state import debate_state_for
+from exports import export_conversation, export_debate
+from message_log import MessageLog, estimate_tokens
+from query_log import normalise
+from retrieval import tokenize
+from safe_html import markdown_to_html
+from search_index import scoped_terms
+from utils import build_prompt, chat_turn_html, get_persona, get_shared_css, message_html
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hot_paths_baseline.json")
+
+SIZES = (10, 1000, 100000)
+
+# Slowdowns smaller than this are noise, whatever the ratio: cases that take a
+# few microseconds vary by more than the tolerance from one run to the next
+REGRESSION_FLOOR_US = 20.0
+
+QUESTION = "What did the Master mean by saying that learning without thought is labour lost?"
+ANSWER = ("The Master said: **learning** without thought is labour lost; thought without learning is perilous.\n\n"
+          "1. Cultivate yourself\n2. Regulate the family\n3. Govern the state\n\n"
+          "> When you know a thing, to hold that you know it — this is knowledge.")
+
+SYSTEM_PROMPT = get_persona("confucius").prompt
+DEBATERS = ("Confucius", "Mencius")
+
+CASES = {}
+
+def case(name: str, sized: bool = True):
+    """Register ``setup(size) -> callable`` as the benchmark ``name``"""
+    def register(setup):
+        CASES[name] = (setup, sized)
+        return setup
+    return register
+
+_histories = {}
+
+def chat_log(size: int) -> MessageLog:
+    """A chat of ``size`` alternating questions and answers, ending with a question"""
+    if ("chat", size) not in _histories:
+        log = MessageLog(SYSTEM_PROMPT)
+        for i in range(size):
+            asking = (size - 1 - i) % 2 == 0
+            log.append("user" if asking else "assistant", f"{i}: {QUESTION if asking else ANSWER}")
+        _histories["chat", size] = log
+    return _histories["chat", size]
+
+def debate_log(size: int) -> MessageLog:
+    """A debate of a topic and ``size - 1`` turns"""
+    if ("debate", size) not in _histories:
+        log = MessageLog()
+        log.append("user", QUESTION, type="topic")
+        for i in range(size - 1):
+            log.append("assistant", f"{i}: {ANSWER}", speaker=DEBATERS[i % 2])
+        _histories["debate", size] = log
+    return _histories["debate", size]
+
+for _format in ("txt", "md", "json"):
+    case(f"export/conversation/{_format}")(lambda size, format=_format: lambda: export_conversation(chat_log(size), "Confucius", format))
+    case(f"export/debate/{_format}")(lambda size, format=_format: lambda: export_debate(debate_log(size), format))
+
+@case("prompt/chat/log")
+def _prompt_log(size):
+    log = chat_log(size)
+    return lambda: build_prompt(SYSTEM_PROMPT, log, log[-1].content)
+
+@case("prompt/chat/list")
+def _prompt_list(size):
+    history = chat_log(size).to_dicts()
+    return lambda: build_prompt(SYSTEM_PROMPT, history[:-1], history[-1]["content"])
+
+@case("prompt/debate/context")
+def _prompt_debate(size):
+    log = debate_log(size)
+    return lambda: debate_state_for(log).summary()
+
+@case("css/shared/cached", sized=False)
+def _css_cached(size):
+    get_shared_css("light")
+    return lambda: get_shared_css("light")
+
+@case("css/shared/uncached", sized=False)
+def _css_uncached(size):
+    return lambda: get_shared_css.__wrapped__("light")
+
+@case("cache/transcript/join")
+def _transcript(size):
+    log, persona = chat_log(size), get_persona("confucius")
+    render = lambda message: chat_turn_html(persona, message)
+    for message in log:
+        message_html(log, message, render)
+    return lambda: "".join(message_html(log, message, render) for message in log)
+
+@case("cache/answer/hit", sized=False)
+def _answer_hit(size):
+    cache, key = AnswerCache(), ("confucius", normalise(QUESTION), "chat/Medium")
+    cache.put(key, ANSWER)
+    return lambda: cache.get(key)
+
+@case("cache/render/markdown", sized=False)
+def _render(size):
+    return lambda: markdown_to_html(ANSWER)
+
+@case("tokens/estimate", sized=False)
+def _estimate(size):
+    return lambda: estimate_tokens(ANSWER)
+
+@case("tokens/log/append")
+def _append(size):
+    texts = [f"{i}: {ANSWER}" for i in range(size)]
+    def build():
+        log = MessageLog(SYSTEM_PROMPT)
+        for text in texts:
+            log.append("assistant", text)
+    return build
+
+@case("tokens/retrieval", sized=False)
+def _retrieval(size):
+    return lambda: tokenize(ANSWER)
+
+@case("tokens/search", sized=False)
+def _search(size):
+    return lambda: scoped_terms("0123456789abcdef", ANSWER)
+
+@case("tokens/query_log", sized=False)
+def _query_log(size):
+    return lambda: normalise(QUESTION)
+
+# Walked by the reference loop; more than the CPU caches hold, like the largest histories
+_REFERENCE_WORDS = [f"w{i}" for i in range(200000)]
+
+def reference():
+    """Fixed work in plain Python to gauge the machine's speed: a dict and a sort
+    on a few keys, then a join over many strings in memory"""
+    counts = {}
+    for i in range(2000):
+        word = f"w{i % 97}"
+        counts[word] = counts.get(word, 0) + len(word)
+    return " ".join(sorted(counts)), len("".join(_REFERENCE_WORDS))
+
+def calls_per_run(fn, min_time: float = 0.02) -> int:
+    """How many calls of ``fn`` take at least ``min_time`` seconds"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return number
+        number *= 10 if elapsed < min_time / 10 else 2
+
+def timed(fn, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return (time.perf_counter() - start) / number
+
+def measure(fn, repeat: int) -> tuple:
+    """(us per call, time relative to the reference loop), both medians over ``repeat`` runs.
+
+    Every run of ``fn`` is followed by a run of the reference, so a slowdown of
+    the whole machine in the middle of the benchmark shows in both.
+    """
+    number, reference_number = calls_per_run(fn), calls_per_run(reference)
+    times, ratios = [], []
+    for _ in range(repeat):
+        elapsed = timed(fn, number)
+        times.append(elapsed)
+        ratios.append(elapsed / timed(reference, reference_number))
+    return statistics.median(times) * 1e6, statistics.median(ratios)
+
+def run(sizes, pattern: str, repeat: int) -> dict:
+    """{case: (us per call, relative to the reference)}"""
+    results = {}
+    for name, (setup, sized) in CASES.items():
+        if pattern and pattern not in name:
+            continue
+        for size in (sizes if sized else (None,)):
+            key = f"{name}/{size}" if sized else name
+            results[key] = measure(setup(size), repeat)
+            print(f"{key:<36} {results[key][0]:>14,.2f} us", flush=True)
+    return results
+
+def check(results: dict, baseline: dict, tolerance: float) -> list:
+    """Keys of the cases that are slower than the baseline beyond ``tolerance``.
+
+    Cases are compared by their time relative to the reference loop, so a
+    slower or busier machine than the one that saved the baseline does not
+    fail every case. Expected times are the baseline's relative times at this
+    run's reference speed.
+    """
+    regressed = []
+    print(f"\n{'case':<36} {'expected us':>14} {'now us':>14} {'ratio':>7}")
+    for key, (now, relative) in results.items():
+        if key not in baseline:
+            print(f"{key:<36} {'-':>14} {now:>14,.2f} {'new':>7}")
+            continue
+        expected = baseline[key] * now / relative
+        over = now > expected * (1 + tolerance) and now - expected >= REGRESSION_FLOOR_US
+        if over:
+            regressed.append(key)
+        print(f"{key:<36} {expected:>14,.2f} {now:>14,.2f} {now / expected:>6.2f}x{'  SLOWER' if over else ''}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the utils hot paths.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("-k", dest="pattern", default="", help="only cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=21)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed slowdown, as a fraction of the baseline")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    mode.add_argument("--check", action="store_true", help="exit 1 if a case is slower than the baseline")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.pattern, args.repeat)
+
+    if args.save:
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                saved = json.load(f)["relative"]
+        saved.update((key, relative) for key, (_, relative) in results.items())
+        with open(args.baseline, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "relative": {key: float(f"{value:.4g}") for key, value in sorted(saved.items())}}, f, indent=2)
+            f.write("\n")
+        print(f"\nsaved {len(results)} results to {os.path.relpath(args.baseline, ROOT)}")
+    elif args.check:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["relative"]
+        regressed = check(results, baseline, args.tolerance)
+        if regressed:
+            print(f"\n{len(regressed)} case(s) regressed by more than {args.tolerance:.0%}: {', '.join(regressed)}")
+            sys.exit(1)
+        print(f"\nno case regressed by more than {args.tolerance:.0%}")
+
+if __name__ == "__main__":
+    main()
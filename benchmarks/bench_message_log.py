@@ -0,0 +1,78 @@
+"""Memory and prompt-build benchmarks for MessageLog vs. plain dict history.
+
+Run from the project root:
+    python benchmarks/bench_message_log.py
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from message_log import MessageLog
+
+SYSTEM_PROMPT = "You are to speak and reason as Confucius. " * 60
+SAMPLE_TEXT = "The Master said, learning without thought is labour lost; thought without learning is perilous. " * 3
+
+def synthetic_messages(count: int):
+    for i in range(count):
+        role = "user" if i % 2 == 0 else "assistant"
+        # Distinct strings, as produced by real user input and API responses
+        yield role, f"{i}: {SAMPLE_TEXT}"
+
+def build_dicts(count: int) -> list:
+    return [{"role": role, "content": content} for role, content in synthetic_messages(count)]
+
+def build_log(count: int) -> MessageLog:
+    log = MessageLog(SYSTEM_PROMPT)
+    for role, content in synthetic_messages(count):
+        log.append(role, content)
+    return log
+
+def measure_memory(builder, count: int) -> int:
+    """Bytes allocated by the container structure (message text excluded)"""
+    texts = [content for _, content in synthetic_messages(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    data = builder(count)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    text_bytes = sum(sys.getsizeof(text) for text in texts)
+    del data
+    return after - before - text_bytes
+
+def legacy_prompt(history: list, user_message: str) -> list:
+    """Prompt construction as done before MessageLog"""
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    for msg in history:
+        if msg["role"] in ["user", "assistant"]:
+            messages.append(msg)
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+def time_per_call(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    print("Memory per 1,000 messages (container overhead, excluding message text)")
+    dict_bytes = measure_memory(build_dicts, 1000)
+    log_bytes = measure_memory(build_log, 1000)
+    print(f"  list of dicts : {dict_bytes / 1024:8.1f} KiB")
+    print(f"  MessageLog    : {log_bytes / 1024:8.1f} KiB (records + prompt view)")
+
+    print("\nPrompt build time per request")
+    print(f"  {'history':>8}  {'legacy':>12}  {'MessageLog':>12}")
+    for count in (10, 100, 1000, 10000):
+        history = build_dicts(count)
+        log = build_log(count)
+        log.append("user", "What is Ren?")
+        repeat = max(10, 100000 // count)
+        legacy = time_per_call(lambda: legacy_prompt(history, "What is Ren?"), repeat)
+        view = time_per_call(lambda: log.prompt(SYSTEM_PROMPT), repeat)
+        print(f"  {count:>8}  {legacy * 1e6:>10.2f}us  {view * 1e6:>10.2f}us")
+
+if __name__ == "__main__":
+    main()
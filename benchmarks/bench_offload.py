@@ -0,0 +1,137 @@
+"""Rerun latency of one session while others export or index, inline vs. offloaded.
+
+One AppTest session reruns a chat page (a cached 50-message transcript) over
+and over while ``--load`` background threads play other sessions doing CPU-
+heavy work, either in this process (inline, holding the GIL) or through
+``offload.run`` on the process pool:
+
+    export   export_conversation of a long transcript as JSON
+    index    build_index of a synthetic corpus (what a first start does)
+
+p50/p95 rerun times are compared with the same session on an idle server;
+with the work offloaded they should stay close to idle.
+
+Run from the project root:
+    python benchmarks/bench_offload.py [--runs 40] [--load 3] [--messages 20000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streamlit.testing.v1 import AppTest
+
+import offload
+from exports import export_conversation
+from message_log import MessageLog
+from retrieval import build_index
+from utils import chat_turn_html, get_persona
+
+PAGE = """
+import streamlit as st
+from utils import chat_turn_html, get_persona, show_transcript
+persona = get_persona("confucius")
+st.selectbox("Length", ["Brief", "Medium", "Detailed"])
+show_transcript(st.session_state.log, lambda message: chat_turn_html(persona, message))
+st.chat_input("Ask")
+"""
+
+ANSWER = ("The Master said: **learning** without thought is labour lost; thought without learning is perilous. "
+          "When you know a thing, to hold that you know it, and when you do not know a thing, to allow that you do not know it.")
+
+WORDS = ("learning thought virtue benevolence righteousness ritual music king people heaven way "
+         "filial piety ruler minister gentleman petty man harmony propriety sincerity").split()
+
+def transcript(length: int, html: bool = False) -> MessageLog:
+    log = MessageLog()
+    persona = get_persona("confucius")
+    for i in range(length // 2):
+        log.append("user", f"Question {i}: what is the path to cultivating virtue?")
+        answer = log.append("assistant", ANSWER)
+        if html:
+            log.cache_html(answer, chat_turn_html(persona, answer))
+    return log
+
+def corpus(directory: str, passages: int = 20000):
+    rng = random.Random(1)
+    with open(os.path.join(directory, "analects.txt"), "w", encoding="utf-8") as f:
+        for i in range(passages):
+            f.write(f"{i // 20}.{i % 20} " + " ".join(rng.choice(WORDS) for _ in range(40)) + "\n\n")
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def reruns(app: AppTest, runs: int) -> list:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        app.run()
+        times.append((time.perf_counter() - start) * 1000)
+        assert not app.exception, app.exception
+    return times
+
+def under_load(app: AppTest, runs: int, load: int, job) -> tuple:
+    """Rerun times while ``load`` threads repeat ``job``; also the jobs finished"""
+    stop = threading.Event()
+    done = []
+
+    def other_session():
+        while not stop.is_set():
+            job()
+            done.append(1)
+    threads = [threading.Thread(target=other_session, daemon=True) for _ in range(load)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    try:
+        return reruns(app, runs), len(done)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="Rerun latency under export and indexing load.")
+    parser.add_argument("--runs", type=int, default=40)
+    parser.add_argument("--load", type=int, default=3, help="background sessions doing heavy work")
+    parser.add_argument("--messages", type=int, default=20000, help="length of the exported transcript")
+    args = parser.parse_args()
+
+    app = AppTest.from_string(PAGE, default_timeout=120)
+    app.session_state["log"] = transcript(50, html=True)
+    reruns(app, 3)  # warm-up: imports, first render
+
+    big = transcript(args.messages)
+    workdir = tempfile.mkdtemp()
+    corpus(workdir)
+    pool = offload.get_offloader()
+    pool.run(len, [])  # start the workers before timing
+    jobs = {
+        "export": lambda: export_conversation(big, "Confucius", "json"),
+        "index": lambda: build_index(workdir, os.path.join(workdir, f"index-{threading.get_ident()}")),
+    }
+    offloaded = {
+        "export": lambda: pool.run(export_conversation, big, "Confucius", "json"),
+        "index": lambda: pool.run(build_index, workdir, os.path.join(workdir, f"index-{threading.get_ident()}")),
+    }
+
+    print(f"rerun of a 50-message chat page, {args.runs} runs; {args.load} other sessions; "
+          f"{pool.workers} offload workers")
+    idle = reruns(app, args.runs)
+    print(f"{'load':<18}{'p50':>10}{'p95':>10}{'jobs done':>11}")
+    print(f"{'idle':<18}{statistics.median(idle):>7.1f} ms{percentile(idle, 0.95):>7.1f} ms{'':>11}")
+    for name in jobs:
+        for mode, job in (("inline", jobs[name]), ("offloaded", offloaded[name])):
+            times, done = under_load(app, args.runs, args.load, job)
+            print(f"{name + ' ' + mode:<18}{statistics.median(times):>7.1f} ms{percentile(times, 0.95):>7.1f} ms{done:>11}")
+    pool.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Share of prompt tokens a provider's prefix cache could serve, per layout.
+
+Runs several synthetic debates (and chats) and, for every request, finds the
+longest prefix it shares with any earlier request. Two caches are modelled:
+
+    openai   nothing below 1,024 tokens, then in steps of 128
+    any      every shared token, as a local server reusing its KV cache does
+             (llama-server, vLLM with prefix caching)
+
+Prompts are compared as their messages' roles and text in order, and nothing
+is evicted, so the numbers are an upper bound.
+
+Run from the project root:
+    python benchmarks/bench_prompt_prefix.py [debates] [rounds]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prompt_layout
+from message_log import MessageLog, estimate_tokens
+from utils import build_debate_messages, build_prompt, get_persona
+
+# OpenAI caches prompts of at least this many tokens, in steps of CACHE_STEP
+CACHE_MIN = 1024
+CACHE_STEP = 128
+
+TOPICS = ["What is the nature of human goodness?", "How should a ruler govern?", "What do children owe their parents?",
+          "Is learning or reflection more important?", "What makes a friendship last?", "How should we treat strangers?"]
+
+def synthetic_turn(speaker: str, round_no: int) -> str:
+    sentence = (f"In round {round_no}, {speaker} holds that cultivation of the heart-mind "
+                f"through ritual and reflection is the root of goodness. ")
+    return sentence * 12
+
+def serialise(messages: list) -> str:
+    return "".join(f"<{message['role']}>{message['content']}" for message in messages)
+
+def cacheable(text: str, seen: list) -> tuple:
+    """Tokens of ``text`` that OpenAI's cache, and a cache of any length, could serve from ``seen``"""
+    shared = max((len(os.path.commonprefix([text, other])) for other in seen), default=0)
+    tokens = estimate_tokens(text[:shared])
+    return (tokens // CACHE_STEP * CACHE_STEP if tokens >= CACHE_MIN else 0), tokens
+
+def measure(prompts) -> tuple:
+    """(prompt tokens, openai cacheable, any cacheable) over a stream of serialised prompts"""
+    seen, total, openai, anywhere = [], 0, 0, 0
+    for text in prompts:
+        total += estimate_tokens(text)
+        cached = cacheable(text, seen)
+        openai += cached[0]
+        anywhere += cached[1]
+        seen.append(text)
+    return total, openai, anywhere
+
+def debate_prompts(layout: str, debates: int, rounds: int):
+    prompt_layout.PROMPT_LAYOUT = layout
+    for topic in (TOPICS * debates)[:debates]:
+        log = MessageLog()
+        log.append("user", topic, type="topic")
+        for round_no in range(rounds):
+            for speaker in ("Confucius", "Mencius"):
+                turns = [msg for msg in log if msg.get("speaker") and msg["speaker"] != speaker]
+                yield serialise(build_debate_messages(topic, log, speaker, turns[-1]["content"] if turns else None))
+                log.append("assistant", synthetic_turn(speaker, round_no), speaker=speaker)
+
+def chat_prompts(chats: int, turns: int):
+    persona = get_persona("confucius")
+    for topic in (TOPICS * chats)[:chats]:
+        log = MessageLog(persona.prompt)
+        for turn in range(turns):
+            question = f"{topic} (follow-up {turn})"
+            log.append("user", question)
+            yield serialise(build_prompt(persona.prompt, log, question))
+            log.append("assistant", synthetic_turn("Confucius", turn))
+
+def main():
+    debates = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f"{debates} debates of {rounds} rounds; {debates} chats of {rounds} turns")
+    print(f"{'':<16}{'prompt tokens':>14}{'openai':>10}{'share':>7}{'any':>10}{'share':>7}")
+    for name, prompts in (("debate legacy", debate_prompts("legacy", debates, rounds)),
+                          ("debate prefix", debate_prompts("prefix", debates, rounds)),
+                          ("chat", chat_prompts(debates, rounds))):
+        total, openai, anywhere = measure(prompts)
+        print(f"{name:<16}{total:>14,}{openai:>10,}{openai / total:>7.0%}{anywhere:>10,}{anywhere / total:>7.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Cost and accuracy of the query log, and the share of traffic the warm cache serves.
+
+A synthetic stream of opening questions with Zipf-distributed popularity
+(``--skew``) over a large vocabulary is fed to ``QueryLog.record``:
+
+    record      time per logged question (normalising, counting, hashing the asker)
+    recall      share of the true top-K found in the sketch's top-K
+    head share  share of all questions that are one of the top-K, so would be
+                answered from the cache once warmed
+
+Run from the project root:
+    python benchmarks/bench_query_log.py [--questions 200000] [--distinct 50000] [--top 10]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from query_log import QUERY_LOG_CAPACITY, QueryLog, normalise
+
+WORDS = ("what how why should would the a of in and is was does did teach mean matter practise today still "
+         "filial piety ritual benevolence gentleman government learning human nature righteousness music "
+         "friendship way heaven sincerity virtue harmony ruler minister father son elder brother king people "
+         "war peace law punishment reward knowledge wisdom courage loyalty trust shame propriety").split()
+
+def question(i: int) -> str:
+    """A made-up question; the same ``i`` always gives the same one"""
+    rng = random.Random(i)
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 9))).capitalize() + "?"
+
+def main():
+    parser = argparse.ArgumentParser(description="Query log overhead and top-K accuracy.")
+    parser.add_argument("--questions", type=int, default=200000)
+    parser.add_argument("--distinct", type=int, default=50000)
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--capacity", type=int, default=QUERY_LOG_CAPACITY)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    pool = [question(i) for i in range(args.distinct)]
+    weights = [1 / (rank + 1) ** args.skew for rank in range(args.distinct)]
+    stream = rng.choices(range(args.distinct), weights, k=args.questions)
+    sessions = [f"session-{rng.randrange(5000)}" for _ in range(args.questions)]
+
+    log = QueryLog(args.capacity)
+    start = time.perf_counter()
+    for index, session in zip(stream, sessions):
+        log.record("confucius", pool[index], "chat/Medium", session)
+    elapsed = time.perf_counter() - start
+
+    truth = Counter(normalise(pool[index]) for index in stream)
+    exact = {text for text, _ in truth.most_common(args.top)}
+    found = {text for text, _, _ in log.top("confucius", args.top)}
+    head = sum(count for _, count in truth.most_common(args.top)) / args.questions
+    print(f"{args.questions} questions, {len(truth)} distinct after normalising, "
+          f"{args.capacity} counters, top {args.top}")
+    print(f"record      {elapsed / args.questions * 1e6:6.2f} us per question")
+    print(f"recall      {len(exact & found) / args.top:6.0%}")
+    print(f"head share  {head:6.1%} of questions")
+
+if __name__ == "__main__":
+    main()
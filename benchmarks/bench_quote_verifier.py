@@ -0,0 +1,75 @@
+"""Trigram table build time and streaming quote-check throughput for quote_verifier.py.
+
+Uses the bundled corpus when present, otherwise the synthetic corpus from
+bench_retrieval.py. Answers quote real passages and invented lines in equal
+measure and are fed in ~4-character chunks, as the API streams them.
+
+Run from the project root:
+    python benchmarks/bench_quote_verifier.py [passages]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import quote_verifier
+import retrieval
+from bench_retrieval import VOCABULARY, synthetic_passages
+
+# Roughly what gpt-3.5-turbo streams per second
+STREAM_CHARS_PER_SECOND = 300
+
+def synthetic_answer(rng, passages) -> str:
+    parts = []
+    for _ in range(4):
+        _, _, text = rng.choice(passages)
+        words = text.split()
+        start = rng.randint(0, max(0, len(words) - 12))
+        parts.append(f'As it is written, "{" ".join(words[start:start + 12])}" which I take to mean')
+        parts.append(f'and some say "{" ".join(rng.sample(VOCABULARY, 10))}" but that is not so.')
+    return " ".join(parts)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    passages = list(retrieval.read_passages())
+    source = "bundled corpus"
+    if not passages:
+        passages = synthetic_passages(count)
+        source = "synthetic corpus"
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        start = time.perf_counter()
+        trigrams = quote_verifier.build_ngram_index(index_dir, passages)
+        build = time.perf_counter() - start
+        index = quote_verifier.NgramIndex(index_dir)
+
+        rng = random.Random(1)
+        answers = [synthetic_answer(rng, passages) for _ in range(200)]
+        latencies = []
+        chars = 0
+        checked = attested = 0
+        start_all = time.perf_counter()
+        for answer in answers:
+            verifier = quote_verifier.QuoteVerifier(index)
+            for i in range(0, len(answer), 4):
+                start = time.perf_counter()
+                verifier.feed(answer[i:i + 4])
+                latencies.append((time.perf_counter() - start) * 1e6)
+            chars += len(answer)
+            checked += len(verifier.checks)
+            attested += sum(check.status == "attested" for check in verifier.checks)
+        elapsed = time.perf_counter() - start_all
+        latencies.sort()
+
+    print(f"{source}: {len(passages)} passages, {trigrams} trigrams")
+    print(f"build  : {build * 1000:8.1f} ms")
+    print(f"checked: {checked} quotes, {attested} attested (half are quoted from the texts)")
+    print(f"feed   : p50 {statistics.median(latencies):.1f} us, p95 {latencies[int(len(latencies) * 0.95)]:.1f} us "
+          f"per chunk, max {latencies[-1]:.1f} us")
+    print(f"rate   : {chars / elapsed:,.0f} chars/s ({chars / elapsed / STREAM_CHARS_PER_SECOND:,.0f}x the stream rate)")
+
+if __name__ == "__main__":
+    main()
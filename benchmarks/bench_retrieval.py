@@ -0,0 +1,71 @@
+"""Index build time and BM25 query latency for retrieval.py.
+
+Uses the bundled corpus when present, otherwise a synthetic corpus of the same
+order of size (the Analects and Mencius together are under 1,000 passages).
+
+Run from the project root:
+    python benchmarks/bench_retrieval.py [passages]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import retrieval
+
+VOCABULARY = """benevolence righteousness ritual propriety filial piety learning reflection virtue
+ruler minister father son brother friend trust sincerity heaven mandate people state
+music archery governance punishment law sage gentleman petty man heart mind nature
+goodness qi cultivation sprout compassion shame deference wisdom courage loyalty
+reciprocity harmony mean excess deficiency teacher disciple study practice daily""".split()
+
+def synthetic_passages(count: int, seed: int = 0) -> list:
+    """Passages drawn from a Zipf-distributed vocabulary, like natural text"""
+    rng = random.Random(seed)
+    words = VOCABULARY + [f"term{i}" for i in range(5000)]
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    passages = []
+    for i in range(count):
+        book = "analects" if i % 2 == 0 else "mencius"
+        words_in_passage = rng.choices(words, weights, k=rng.randint(20, 120))
+        passages.append((book, f"{i // 40 + 1}.{i % 40 + 1}", "The Master said, " + " ".join(words_in_passage) + "."))
+    return passages
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    passages = list(retrieval.read_passages())
+    source = "bundled corpus"
+    if not passages:
+        passages = synthetic_passages(count)
+        source = "synthetic corpus"
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        start = time.perf_counter()
+        meta = retrieval.build_index(index_dir=index_dir, passages=passages)
+        build = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir))
+
+        start = time.perf_counter()
+        index = retrieval.PassageIndex(index_dir)
+        load = time.perf_counter() - start
+
+        rng = random.Random(1)
+        queries = [" ".join(rng.sample(VOCABULARY, rng.randint(3, 10))) for _ in range(500)]
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, retrieval.TOP_K, books=["analects"])
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+
+    print(f"{source}: {meta['N']} passages, {len(meta['vocabulary'])} terms, index {size / 1024:.0f} KiB")
+    print(f"build  : {build * 1000:8.1f} ms")
+    print(f"load   : {load * 1000:8.1f} ms (mmap)")
+    print(f"query  : p50 {statistics.median(latencies):.2f} ms, p95 {latencies[int(len(latencies) * 0.95)]:.2f} ms, "
+          f"max {latencies[-1]:.2f} ms (budget 5 ms)")
+
+if __name__ == "__main__":
+    main()
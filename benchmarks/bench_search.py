@@ -0,0 +1,101 @@
+"""Search latency over a large saved-message index, and how soon new messages show up.
+
+Fills a fresh index (in a temporary directory) with ``--messages`` synthetic
+chat and debate messages spread over ``--libraries`` libraries, plus one large
+library of ``--large`` messages, then times ``SearchIndex.search``:
+
+    typical library   p50/p95 over common and rare one- and two-word queries
+    large library     the same queries against the large library
+    freshness         time from ``add`` until the message is found by a search
+
+Run from the project root:
+    python benchmarks/bench_search.py [--messages 1000000] [--libraries 2000] [--large 100000]
+"""
+import argparse
+import os
+import random
+import secrets
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SearchIndex, insert
+
+WORDS = ("the master said learning without thought is labour lost filial piety root humaneness ritual music "
+         "gentleman petty man righteousness profit king people heaven mandate way virtue benevolence harmony "
+         "sincerity propriety ruler minister father son elder brother friend trust shame courage wisdom "
+         "government punishment law nature goodness sprout compassion well child water flows downward").split()
+
+QUERIES = ["filial piety", "gentleman", "sprout compassion", "mandate", "heav", "water flows", "benevolence ruler"]
+
+def sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 60))).capitalize() + "."
+
+def fill(index: SearchIndex, libraries: list, count: int, rng: random.Random, batch: int = 20000):
+    connection = index._connect()
+    now = time.time()
+    rows = []
+    for i in range(count):
+        library = rng.choice(libraries)
+        role = "user" if i % 2 == 0 else "assistant"
+        rows.append((library, "confucius_messages", None, role, sentence(rng), now - rng.random() * 30 * 86400))
+        if len(rows) == batch:
+            with connection:
+                insert(connection, rows)
+            rows = []
+    with connection:
+        insert(connection, rows)
+    connection.close()
+
+def timed(index: SearchIndex, library: str, rounds: int = 20) -> list:
+    times = []
+    for _ in range(rounds):
+        for query in QUERIES:
+            start = time.perf_counter()
+            index.search(library, query)
+            times.append((time.perf_counter() - start) * 1000)
+    return times
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Search latency over a large message index.")
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--libraries", type=int, default=2000)
+    parser.add_argument("--large", type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    index = SearchIndex(os.path.join(tempfile.mkdtemp(), "messages.db"))
+    libraries = [secrets.token_hex(8) for _ in range(args.libraries)]
+    large = secrets.token_hex(8)
+    start = time.perf_counter()
+    fill(index, libraries, args.messages - args.large, rng)
+    fill(index, [large], args.large, rng)
+    elapsed = time.perf_counter() - start
+    print(f"indexed {args.messages:,} messages in {elapsed:.0f}s ({args.messages / elapsed:,.0f}/s), "
+          f"{os.path.getsize(index.path) / 1e6:.0f} MB")
+
+    for name, library in (("typical library", libraries[0]), ("large library", large)):
+        times = timed(index, library)
+        count = index._reader().execute("SELECT count(*) FROM messages WHERE library = ?", (library,)).fetchone()[0]
+        print(f"{name:<16} {count:>7,} messages   "
+              f"p50 {statistics.median(times):6.2f} ms   p95 {percentile(times, 0.95):6.2f} ms")
+
+    delays = []
+    for i in range(20):
+        marker = f"zhongyong{i}x"
+        start = time.perf_counter()
+        index.add(libraries[0], "debate_messages", "Mencius", "assistant", f"The {marker} is the mean.")
+        while not index.search(libraries[0], marker):
+            time.sleep(0.001)
+        delays.append((time.perf_counter() - start) * 1000)
+    print(f"freshness        p50 {statistics.median(delays):6.1f} ms   max {max(delays):6.1f} ms from add to found")
+
+if __name__ == "__main__":
+    main()
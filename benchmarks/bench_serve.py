@@ -0,0 +1,147 @@
+"""Load test of serve.py: script runs per second with 1, 2, 4 ... worker processes.
+
+For each worker count, starts ``serve.py`` and runs ``--sessions`` simulated
+browsers against it. Each one opens the app's websocket through the proxy, as
+a browser does. It then asks for a new script run of app.py as soon as the
+last one finished, which is the server's cost of a busy page. No model is
+called; page runs do not ask it anything.
+
+The load comes from ``--clients`` processes. Their CPU use competes with the
+workers, so leave some cores free, or run the test from another machine
+with ``--url``. On one Streamlit process the script runs take turns on the
+GIL. With more workers, throughput should grow until the workers use up the
+cores.
+
+Run from the project root:
+    python benchmarks/bench_serve.py [--workers 1,2,4] [--sessions 32] [--seconds 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds for every session to connect and finish its first run before timing starts
+WARMUP = 10.0
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_workers(port: int, workers: int, timeout: float = 120.0):
+    """Until every worker answers its health check through the proxy"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_serve/status", timeout=2) as response:
+                status = json.load(response)
+            ready = 0
+            for worker in status:
+                with socket.socket() as s:
+                    s.settimeout(1)
+                    ready += s.connect_ex(("127.0.0.1", worker["port"])) == 0
+            if ready == workers:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"serve.py did not start {workers} workers")
+
+async def session(url: str, start: float, end: float, latencies: list):
+    """One browser: a script run after another until ``end``; runs timed from ``start`` are kept"""
+    import websockets
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+    rerun = BackMsg()
+    rerun.rerun_script.query_string = ""
+    rerun.rerun_script.page_script_hash = ""
+    request = rerun.SerializeToString()
+    async with websockets.connect(url, subprotocols=["streamlit"], max_size=None, open_timeout=60) as ws:
+        while time.time() < end:
+            began = time.time()
+            await ws.send(request)
+            while True:
+                message = ForwardMsg()
+                message.ParseFromString(await ws.recv())
+                if message.WhichOneof("type") == "script_finished":
+                    break
+            finished = time.time()
+            if began >= start and finished <= end:
+                latencies.append(finished - began)
+
+def drive(url: str, sessions: int, start: float, end: float) -> list:
+    """Run ``sessions`` browsers in this process; their timed run latencies"""
+    latencies = []
+
+    async def run():
+        results = await asyncio.gather(*(session(url, start, end, latencies) for _ in range(sessions)),
+                                       return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            print(f"  {len(errors)} sessions failed: {errors[0]!r}", file=sys.stderr)
+    asyncio.run(run())
+    return latencies
+
+def load(url: str, sessions: int, clients: int, seconds: float) -> list:
+    start = time.time() + WARMUP
+    end = start + seconds
+    shares = [sessions // clients + (i < sessions % clients) for i in range(clients)]
+    with ProcessPoolExecutor(clients) as pool:
+        results = pool.map(drive, [url] * clients, shares, [start] * clients, [end] * clients)
+        return [latency for result in results for latency in result]
+
+def measure(workers: int, args) -> list:
+    port = free_port()
+    data = tempfile.mkdtemp(prefix="bench_serve_")
+    env = dict(os.environ, SEARCH_DB=os.path.join(data, "messages.db"), SHARED_DB=os.path.join(data, "shared.db"))
+    env.setdefault("OPENAI_API_KEY", "sk-bench")
+    server = subprocess.Popen([sys.executable, "serve.py", "--workers", str(workers), "--port", str(port),
+                               "--host", "127.0.0.1", "--base-port", str(args.base_port)],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_workers(port, workers)
+        return load(f"ws://127.0.0.1:{port}/_stcore/stream", args.sessions, args.clients, args.seconds)
+    finally:
+        server.terminate()
+        server.wait(30)
+
+def main():
+    cores = os.cpu_count() or 1
+    default_workers = ",".join(str(n) for n in (1, 2, 4, 8, 16, 32) if n <= max(1, cores - 1)) or "1"
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default=default_workers, help="comma-separated worker counts")
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--clients", type=int, default=max(1, cores // 4), help="load-generating processes")
+    parser.add_argument("--base-port", type=int, default=8750)
+    parser.add_argument("--url", help="websocket URL of a running server to load instead of starting serve.py")
+    args = parser.parse_args()
+
+    print(f"{cores} cores; {args.sessions} sessions from {args.clients} client processes, {args.seconds:.0f}s each")
+    print(f"{'workers':>8}{'runs/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'speed-up':>10}")
+    counts = [None] if args.url else [int(n) for n in args.workers.split(",")]
+    baseline = None
+    for workers in counts:
+        latencies = load(args.url, args.sessions, args.clients, args.seconds) if args.url else measure(workers, args)
+        if not latencies:
+            print(f"{workers or '-':>8}  no runs finished")
+            continue
+        rate = len(latencies) / args.seconds
+        baseline = baseline or rate
+        p50 = statistics.median(latencies) * 1000
+        p95 = statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else p50
+        print(f"{workers or '-':>8}{rate:>10.1f}{p50:>9.0f}{p95:>9.0f}{rate / baseline:>9.2f}x")
+
+if __name__ == "__main__":
+    main()
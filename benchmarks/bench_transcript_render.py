@@ -0,0 +1,80 @@
+"""Server time to draw a transcript on each rerun, per message vs. cached HTML.
+
+A chat transcript of N messages is drawn in AppTest three ways:
+
+    per message   one st.chat_message + st.write per message, as app.py did
+    render once   sanitising and rendering every message to HTML, the one-off
+                  cost paid as each message is finalised (timed directly)
+    cached        utils.show_transcript with the fragments already on the
+                  messages, joined into a single element (every rerun)
+
+Rerun times are the median of full script runs, so they include AppTest's
+fixed cost per run; "saved" is the per-message time minus the cached one.
+
+Run from the project root:
+    python benchmarks/bench_transcript_render.py [lengths...]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streamlit.testing.v1 import AppTest
+
+from message_log import MessageLog
+from utils import chat_turn_html, get_persona
+
+ANSWER = ("The Master said: **learning** without thought is labour lost; thought without learning is perilous.\n\n"
+          "1. Cultivate yourself\n2. Regulate the family\n3. Govern the state\n\n"
+          "> When you know a thing, to hold that you know it — this is knowledge.")
+
+PER_MESSAGE = """
+import streamlit as st
+for message in st.session_state.log:
+    with st.chat_message(message["role"]):
+        st.write(message["content"])
+"""
+
+CACHED = """
+import streamlit as st
+from utils import chat_turn_html, get_persona, show_transcript
+persona = get_persona("confucius")
+show_transcript(st.session_state.log, lambda message: chat_turn_html(persona, message))
+"""
+
+def transcript(length: int) -> MessageLog:
+    log = MessageLog()
+    for i in range(length // 2):
+        log.append("user", f"Question {i}: what is the path to cultivating virtue?")
+        log.append("assistant", ANSWER)
+    return log
+
+def timed_runs(script: str, log: MessageLog, runs: int) -> list:
+    app = AppTest.from_string(script, default_timeout=120)
+    app.session_state["log"] = log
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        app.run()
+        times.append((time.perf_counter() - start) * 1000)
+        assert not app.exception, app.exception
+    return times
+
+def main():
+    lengths = [int(n) for n in sys.argv[1:]] or [50, 200, 1000]
+    persona = get_persona("confucius")
+    print(f"{'messages':>8}{'per message':>14}{'render once':>14}{'cached':>12}{'saved':>10}")
+    for length in lengths:
+        per_message = statistics.median(timed_runs(PER_MESSAGE, transcript(length), 5))
+        log = transcript(length)
+        start = time.perf_counter()
+        for message in log:
+            log.cache_html(message, chat_turn_html(persona, message))
+        render = (time.perf_counter() - start) * 1000
+        cached = statistics.median(timed_runs(CACHED, log, 5))
+        print(f"{length:>8}{per_message:>11.1f} ms{render:>11.1f} ms{cached:>9.1f} ms{per_message - cached:>7.1f} ms")
+
+if __name__ == "__main__":
+    main()
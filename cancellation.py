@@ -0,0 +1,56 @@
+"""Stopping answers mid-stream, and what stopping saves.
+
+A CancelToken is passed down the request path; the streaming loop checks it
+between chunks and closes the upstream HTTP stream as soon as it is set, or as
+soon as its consumer goes away (a closed SSE connection).
+
+Answers are generated by background jobs (see jobs.py); the Stop button and
+clearing a chat cancel the job's token.
+"""
+import threading
+
+class CancelToken:
+    """Flag telling a streaming request to stop and release its connection"""
+    __slots__ = ("_event", "reason")
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason: str = "stopped"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+class CancelStats:
+    """Process-wide count of stopped answers and the output tokens they did not use"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cancelled = 0
+        self.generated_tokens = 0
+        self.saved_tokens = 0
+
+    def record(self, generated: int, expected: int):
+        with self._lock:
+            self.cancelled += 1
+            self.generated_tokens += generated
+            self.saved_tokens += max(0, expected - generated)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"cancelled": self.cancelled, "generated_tokens": self.generated_tokens,
+                    "saved_tokens": self.saved_tokens}
+
+_stats = CancelStats()
+
+def record_cancelled(generated: int, expected: int):
+    """Count a stream closed early; ``expected`` is the usual length of a finished answer"""
+    _stats.record(generated, expected)
+
+def cancel_metrics() -> dict:
+    return _stats.snapshot()
@@ -0,0 +1,135 @@
+"""Budgets and stop checks for debates that run several rounds unattended.
+
+An auto-run debate schedules rounds back to back on one background job (see
+``utils.submit_debate_rounds``) until it has run the requested number of
+rounds or one of these stops it:
+
+    tokens      the output tokens spent, plus what the next turn is expected
+                to spend, would exceed the token budget
+    time        the wall-clock budget has run out
+    repetition  a debater's turn mostly restates their previous one
+    convergence two debaters in a round are saying largely the same thing
+
+Budgets are checked before each turn, so a turn that has started is never cut
+short; the repetition checks run after each full round.
+"""
+import os
+import re
+import threading
+import time
+
+AUTO_MAX_ROUNDS = 10
+AUTO_DEFAULT_ROUNDS = 3
+AUTO_TOKEN_BUDGET = int(os.getenv("AUTO_DEBATE_TOKENS", "4000"))
+AUTO_TIME_BUDGET = float(os.getenv("AUTO_DEBATE_SECONDS", "180"))
+
+# Share of word trigrams two turns must have in common to count as a restatement
+REPETITION_THRESHOLD = 0.3
+CONVERGENCE_THRESHOLD = 0.4
+
+_WORD = re.compile(r"\w+")
+
+def shingles(text: str, n: int = 3) -> set:
+    """Lower-cased word n-grams of a turn"""
+    words = _WORD.findall(text.lower())
+    return {tuple(words[i:i + n]) for i in range(max(1, len(words) - n + 1))} if words else set()
+
+def similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the word trigrams of two turns, 0..1"""
+    a, b = shingles(a), shingles(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+class RoundReport:
+    """Latency and output tokens of one completed round"""
+    __slots__ = ("number", "latency", "tokens", "turns")
+
+    def __init__(self, number: int, latency: float, tokens: int, turns: int):
+        self.number = number
+        self.latency = latency
+        self.tokens = tokens
+        self.turns = turns
+
+class Schedule:
+    """Progress of one auto-run: its budgets, the rounds run so far and why it stopped.
+
+    Written by the worker running the debate and read by the page, so every
+    update is made under a lock.
+    """
+
+    def __init__(self, rounds: int = AUTO_DEFAULT_ROUNDS, token_budget: int = AUTO_TOKEN_BUDGET,
+                 time_budget: float = AUTO_TIME_BUDGET):
+        self.rounds = max(1, min(rounds, AUTO_MAX_ROUNDS))
+        self.token_budget = token_budget
+        self.time_budget = time_budget
+        self.reports = []
+        self.tokens = 0
+        self.stop_reason = None
+        self.started = time.monotonic()
+        self.ended = None
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.ended or time.monotonic()) - self.started
+
+    def budget_left(self, expected_tokens: int) -> bool:
+        """Whether a turn expected to produce ``expected_tokens`` may start; records the stop if not"""
+        if self.tokens + expected_tokens > self.token_budget:
+            return self.stop("tokens")
+        if self.elapsed >= self.time_budget:
+            return self.stop("time")
+        return True
+
+    def add_turn(self, tokens: int):
+        with self._lock:
+            self.tokens += tokens
+
+    def end_round(self, latency: float, tokens: int, turns: list, previous: list):
+        """Record a finished round; ``turns`` and ``previous`` are [(speaker, text)] of this and the last round.
+
+        Returns whether the next round should run.
+        """
+        with self._lock:
+            self.reports.append(RoundReport(len(self.reports) + 1, latency, tokens, len(turns)))
+        if len(self.reports) >= self.rounds:
+            return self.stop("rounds")
+        earlier = dict(previous)
+        for speaker, text in turns:
+            if speaker in earlier and similarity(text, earlier[speaker]) >= REPETITION_THRESHOLD:
+                return self.stop("repetition")
+        for i, (_, text) in enumerate(turns):
+            for _, other in turns[i + 1:]:
+                if similarity(text, other) >= CONVERGENCE_THRESHOLD:
+                    return self.stop("convergence")
+        return True
+
+    def stop(self, reason: str) -> bool:
+        with self._lock:
+            if self.stop_reason is None:
+                self.stop_reason = reason
+                self.ended = time.monotonic()
+        return False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "completed": len(self.reports),
+                "tokens": self.tokens,
+                "elapsed": self.elapsed,
+                "stop_reason": self.stop_reason,
+                "reports": [{"round": r.number, "latency": r.latency, "tokens": r.tokens, "turns": r.turns}
+                            for r in self.reports],
+            }
+
+STOP_REASONS = {
+    "rounds": "ran every scheduled round",
+    "tokens": "token budget reached",
+    "time": "time budget reached",
+    "repetition": "a debater began repeating themselves",
+    "convergence": "the debaters converged",
+    "error": "a turn failed",
+    "stopped": "stopped",
+}
@@ -0,0 +1,137 @@
+import re
+import weakref
+from collections import deque
+
+from message_log import estimate_tokens
+
+# Token budget for the debate context (summary of earlier rounds + last exchange)
+DEBATE_CONTEXT_TOKENS = 700
+
+# Words kept from a turn when it first enters the summary, and after compression
+GIST_WORDS = 40
+SHORT_GIST_WORDS = 12
+
+_SENTENCE_END = re.compile(r"(?<=[.!?。！？])\s+")
+
+def gist(text: str, words: int = GIST_WORDS) -> str:
+    """First sentence of a turn, capped at ``words`` words"""
+    first = _SENTENCE_END.split(text.strip(), 1)[0]
+    parts = first.split()
+    return " ".join(parts[:words]) + ("…" if len(parts) > words else "")
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """Cut text to roughly ``budget`` tokens, on a word boundary"""
+    if estimate_tokens(text) <= budget:
+        return text
+    words = text.split()
+    # Halve the word list until it fits, then grow back linearly
+    keep = len(words)
+    while keep > 1 and estimate_tokens(" ".join(words[:keep])) > budget:
+        keep //= 2
+    while keep < len(words) and estimate_tokens(" ".join(words[:keep + 1])) <= budget:
+        keep += 1
+    return " ".join(words[:keep]) + " …"
+
+class DebateState:
+    """Compact, incrementally updated context for a running debate.
+
+    The last exchange (one turn per each of ``sides`` debaters) is kept
+    verbatim; every older turn is reduced to a one-line gist. When the gists
+    outgrow their share of the budget, the oldest are shortened further and
+    then dropped, so the context stays under ``budget`` tokens however long
+    the debate runs.
+    """
+    __slots__ = ("budget", "points", "summary_tokens", "omitted", "processed", "recent")
+
+    def __init__(self, budget: int = DEBATE_CONTEXT_TOKENS, sides: int = 2):
+        self.budget = budget
+        self.points = deque()  # [speaker, gist, tokens]
+        self.summary_tokens = 0
+        self.omitted = 0
+        self.processed = 0
+        self.recent = deque(maxlen=sides)  # (speaker, content)
+
+    @property
+    def summary_budget(self) -> int:
+        return self.budget // 3
+
+    def add_turn(self, speaker: str, content: str):
+        """Fold a finished turn into the state"""
+        if len(self.recent) == self.recent.maxlen:
+            old_speaker, old_content = self.recent[0]
+            point = gist(old_content)
+            tokens = estimate_tokens(point)
+            self.points.append([old_speaker, point, tokens])
+            self.summary_tokens += tokens
+            self._compress()
+        self.recent.append((speaker, content))
+
+    def _compress(self):
+        for point in self.points:
+            if self.summary_tokens <= self.summary_budget:
+                return
+            short = gist(point[1], SHORT_GIST_WORDS)
+            if short != point[1]:
+                tokens = estimate_tokens(short)
+                self.summary_tokens += tokens - point[2]
+                point[1], point[2] = short, tokens
+        while self.points and self.summary_tokens > self.summary_budget:
+            self.summary_tokens -= self.points.popleft()[2]
+            self.omitted += 1
+
+    def sync(self, exchanges):
+        """Fold in turns appended to ``exchanges`` since the last sync.
+
+        ``exchanges`` is the debate MessageLog (or a list of message dicts);
+        topic records are skipped. Turns already spilled to disk by the session
+        governor count as processed.
+        """
+        total = getattr(exchanges, "spilled", 0) + len(exchanges)
+        new = total - self.processed
+        if new <= 0:
+            return self
+        for msg in list(exchanges[-new:]) if new < len(exchanges) else exchanges:
+            if msg.get("speaker"):
+                self.add_turn(msg["speaker"], msg["content"])
+        self.processed = total
+        return self
+
+    def record(self, speaker: str, content: str):
+        """Fold in a turn before it reaches the log; sync then skips the log's copy"""
+        self.add_turn(speaker, content)
+        self.processed += 1
+
+    def summary(self) -> str:
+        lines = [f"- {speaker}: {point}" for speaker, point, _ in self.points]
+        if self.omitted:
+            lines.insert(0, f"- ({self.omitted} earlier points omitted)")
+        return "\n".join(lines)
+
+    def last_turn(self, speaker: str, budget: int) -> str:
+        """The most recent verbatim turn by ``speaker``, within ``budget`` tokens"""
+        for turn_speaker, content in reversed(self.recent):
+            if turn_speaker == speaker:
+                return truncate_tokens(content, budget)
+        return None
+
+    @property
+    def verbatim_budget(self) -> int:
+        return (self.budget - self.summary_budget) // self.recent.maxlen
+
+_states = weakref.WeakKeyDictionary()
+
+def debate_state_for(exchanges, sides: int = 2) -> DebateState:
+    """Return the synced DebateState for a debate log, kept across calls.
+
+    MessageLogs get a cached state updated incrementally; plain lists get a
+    fresh state each call.
+    """
+    try:
+        state = _states.get(exchanges)
+        if (state is None or state.recent.maxlen != sides
+                or state.processed > getattr(exchanges, "spilled", 0) + len(exchanges)):
+            # New log, a different line-up, or the log was cleared for a new debate
+            state = _states[exchanges] = DebateState(sides=sides)
+    except TypeError:
+        state = DebateState(sides=sides)
+    return state.sync(exchanges)
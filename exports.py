@@ -0,0 +1,69 @@
+"""Conversation and debate exports as text, Markdown or JSON.
+
+Kept apart from utils (and Streamlit) so that the offload pool's workers can
+build long exports without importing the UI.
+"""
+import json
+from datetime import datetime
+
+from message_log import Message, MessageLog
+
+def _iter_messages(messages):
+    # MessageLogs may have spilled older messages to disk; exports include them
+    return messages.iter_all() if isinstance(messages, MessageLog) else messages
+
+def export_conversation(messages: list, philosopher: str, format: str = "txt") -> str:
+    """Export conversation in various formats"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    if format == "txt":
+        content = f"Conversation with {philosopher}\n"
+        content += f"Exported: {timestamp}\n"
+        content += "=" * 50 + "\n\n"
+        
+        for msg in _iter_messages(messages):
+            role = "You" if msg["role"] == "user" else philosopher
+            content += f"{role}:\n{msg['content']}\n\n"
+        
+        return content
+    
+    elif format == "md":
+        content = f"# Conversation with {philosopher}\n\n"
+        content += f"**Exported:** {timestamp}\n\n"
+        content += "---\n\n"
+        
+        for msg in _iter_messages(messages):
+            role = "**You**" if msg["role"] == "user" else f"**{philosopher}**"
+            content += f"{role}:\n\n{msg['content']}\n\n"
+        
+        return content
+    
+    elif format == "json":
+        export_data = {
+            "philosopher": philosopher,
+            "exported_at": timestamp,
+            "messages": [msg.to_dict() if isinstance(msg, Message) else msg for msg in _iter_messages(messages)]
+        }
+        return json.dumps(export_data, indent=2, ensure_ascii=False)
+    
+    return ""
+
+def export_debate(messages, format: str = "txt") -> str:
+    """Export a debate, whose first message is the topic"""
+    records = iter(_iter_messages(messages))
+    topic = next(records, {"content": ""})["content"]
+    turns = [msg for msg in records if msg.get("speaker")]
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    if format == "md":
+        content = f"# Philosophical Debate\n\n**Topic:** {topic}\n\n**Exported:** {timestamp}\n\n---\n\n"
+        return content + "".join(f"**{msg['speaker']}**:\n\n{msg['content']}\n\n" for msg in turns)
+
+    if format == "json":
+        return json.dumps({
+            "topic": topic,
+            "exported_at": timestamp,
+            "messages": [msg.to_dict() if isinstance(msg, Message) else msg for msg in turns]
+        }, indent=2, ensure_ascii=False)
+
+    return f"Philosophical Debate\nTopic: {topic}\n\n" + "".join(f"\n{msg['speaker']}:\n{msg['content']}\n" for msg in turns)
@@ -0,0 +1,199 @@
+"""Background generation jobs that outlive the script run that started them.
+
+Answers are generated on a process-wide worker pool instead of inside the
+Streamlit script. A Job collects one or more answers (Entries): one for a chat
+question, one per speaker for a debate round. Text is published to a bounded
+ring buffer of (sequence, entry, chunk) events, so a page that reruns mid-answer
+re-attaches with ``snapshot()`` and then follows new chunks with ``read()``.
+
+Finished entries are handed out exactly once by ``take_finished()``; the
+session's script thread appends them to its MessageLog, so logs are only ever
+written from script threads.
+"""
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from cancellation import CancelToken
+from spans import NO_SPAN, start_span
+
+# Answers generated at once across all sessions; more are queued
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "16"))
+
+# Chunk events kept per job for readers that fall behind
+RING_CAPACITY = 512
+
+_ids = itertools.count(1)
+
+class Entry:
+    """One answer within a job"""
+    __slots__ = ("speaker", "type", "parts", "done", "stopped", "verifier")
+
+    def __init__(self, speaker: str = None, type: str = None, verifier=None):
+        self.speaker = speaker
+        self.type = type
+        self.parts = []
+        self.done = False
+        self.stopped = False
+        self.verifier = verifier
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def quotes(self) -> list:
+        return self.verifier.checks if self.verifier else None
+
+class Job:
+    """Answers streamed by a worker for one MessageLog (``key`` in session state)"""
+
+    def __init__(self, key: str, span=NO_SPAN):
+        self.id = next(_ids)
+        self.key = key
+        # The request span (spans.py), ended when the answers are committed
+        self.span = span
+        self.shown = False
+        self.token = CancelToken()
+        self.entries = []
+        self.committed = 0
+        self.done = False
+        self.started = time.monotonic()
+        self.seq = 0
+        self._events = deque(maxlen=RING_CAPACITY)
+        self._lock = threading.Lock()
+
+    # Worker side
+
+    def begin(self, speaker: str = None, type: str = None, verifier=None) -> Entry:
+        entry = Entry(speaker, type, verifier)
+        with self._lock:
+            self.entries.append(entry)
+            self.seq += 1
+        return entry
+
+    def emit(self, chunk: str):
+        with self._lock:
+            entry = self.entries[-1]
+            entry.parts.append(chunk)
+            if entry.verifier is not None:
+                entry.verifier.feed(chunk)
+            self.seq += 1
+            self._events.append((self.seq, len(self.entries) - 1, chunk))
+
+    def end(self):
+        """Close the current entry; it is marked stopped if the job was cancelled"""
+        with self._lock:
+            entry = self.entries[-1]
+            entry.done = True
+            entry.stopped = self.token.cancelled
+            self.seq += 1
+
+    def finish(self):
+        with self._lock:
+            for entry in self.entries:
+                if not entry.done:
+                    entry.done, entry.stopped = True, True
+            self.done = True
+            self.seq += 1
+
+    # Reader side
+
+    def cancel(self, reason: str = "stopped"):
+        self.token.cancel(reason)
+
+    def snapshot(self) -> tuple:
+        """(sequence, index of the first uncommitted entry, [their texts]) to re-attach from"""
+        with self._lock:
+            return self.seq, self.committed, [entry.text for entry in self.entries[self.committed:]]
+
+    def read(self, cursor: int) -> tuple:
+        """Chunk events after ``cursor`` as (sequence, [(entry index, chunk)]).
+
+        Returns None for the events when the ring buffer no longer reaches back
+        to ``cursor``; the reader should take a fresh snapshot.
+        """
+        with self._lock:
+            if self._events and self._events[0][0] > cursor + 1:
+                return self.seq, None
+            return self.seq, [(index, chunk) for seq, index, chunk in self._events if seq > cursor]
+
+    def take_finished(self) -> list:
+        """Finished entries not yet handed out, in order; each is returned exactly once"""
+        with self._lock:
+            ready = []
+            while self.committed < len(self.entries) and self.entries[self.committed].done:
+                ready.append(self.entries[self.committed])
+                self.committed += 1
+            return ready
+
+    @property
+    def settled(self) -> bool:
+        """Finished and every entry handed out"""
+        with self._lock:
+            return self.done and self.committed == len(self.entries)
+
+class Follower:
+    """A reader that keeps a local copy of a job's text and redraws it when it changes.
+
+    ``render`` is called with [(entry, text)] for the entries not yet
+    committed when the follower attached, including one just begun.
+    """
+
+    def __init__(self, job: Job, render):
+        self.job = job
+        self.render = render
+        self.reattach()
+
+    def reattach(self):
+        self.cursor, self.offset, self.texts = self.job.snapshot()
+
+    def poll(self) -> bool:
+        """Apply new chunks from the ring buffer; returns whether anything changed"""
+        seq, events = self.job.read(self.cursor)
+        if seq == self.cursor:
+            return False
+        if events is None:
+            self.reattach()
+            return True
+        for index, chunk in events:
+            index -= self.offset
+            while len(self.texts) <= index:
+                self.texts.append("")
+            self.texts[index] += chunk
+        self.cursor = seq
+        return True
+
+    def draw(self):
+        entries = self.job.entries[self.offset:]
+        texts = self.texts + [""] * (len(entries) - len(self.texts))
+        self.render(list(zip(entries, texts)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="generation")
+    return _pool
+
+def submit(job: Job, work, *args) -> Job:
+    """Run ``work(job, *args)`` on the pool; the job is finished however it ends"""
+    queued = time.time_ns()
+    def run():
+        if job.span:
+            start_span("job.queued", job.span, start=queued).finish()
+        try:
+            with start_span("job.run", job.span) if job.span else NO_SPAN:
+                if not job.token.cancelled:
+                    work(job, *args)
+        finally:
+            job.finish()
+    get_pool().submit(run)
+    return job
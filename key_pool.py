@@ -0,0 +1,456 @@
+"""A pool of OpenAI API keys shared by every request in the process.
+
+One key caps the whole deployment at that key's rate limits. Keys listed in
+``OPENAI_API_KEYS`` (or ``[[openai.keys]]`` in Streamlit secrets) are pooled,
+optionally across organisations and projects:
+
+    OPENAI_API_KEYS=sk-aaa,sk-bbb:org-123,sk-ccc:org-456:proj_789
+
+Each request goes to the key with the most headroom, judged by the
+``x-ratelimit-remaining-*`` headers of that key's last response, less the
+requests it has in flight. A key that gets ``KEY_QUARANTINE_AFTER`` 429s in a
+row, or is rejected as invalid, is left out for a while, and the request is
+retried on another key. ``OPENAI_API_KEY`` alone still works; it is a pool of one.
+
+``KeyPool.client()`` and ``async_client()`` stand in for ``OpenAI`` and
+``AsyncOpenAI`` wherever the app calls ``chat.completions.create``. Keys are
+only ever shown by label ("key 2 …a1b2"), never in full.
+
+With ``SHARED_DB`` set (see serve.py), each key's headroom and quarantine are
+published to the shared store and read back every ``KEY_SYNC_SECONDS``, so
+worker processes steer around the same rate limits. Both are done by a
+background thread, so no request (or the API's event loop) waits on SQLite.
+Requests in flight and the counters stay per process.
+"""
+import asyncio
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+from shared_store import SharedStore, fingerprint, get_shared_store
+
+# Consecutive 429s before a key is quarantined, and for how long at first;
+# each further quarantine of the same key doubles it, up to KEY_QUARANTINE_MAX
+KEY_QUARANTINE_AFTER = int(os.getenv("KEY_QUARANTINE_AFTER", "3"))
+KEY_QUARANTINE_SECONDS = float(os.getenv("KEY_QUARANTINE_SECONDS", "60"))
+KEY_QUARANTINE_MAX = 900.0
+
+# A key the API rejects (revoked, wrong project) is rechecked this often
+INVALID_KEY_SECONDS = 3600.0
+
+# How often other processes' view of the keys is read from the shared store
+KEY_SYNC_SECONDS = float(os.getenv("KEY_SYNC_SECONDS", "1"))
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def parse_duration(value: str) -> float:
+    """Seconds in a rate-limit reset header such as ``"6m0s"`` or ``"20ms"``"""
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(amount) * _UNITS[unit] for amount, unit in _DURATION.findall(value))
+
+def load_keys(entries=None) -> list:
+    """[(api_key, organization, project)] from ``entries`` or the environment.
+
+    ``entries`` may be "key[:org[:project]]" strings or dicts with ``api_key``,
+    ``organization`` and ``project``; by default they are read from
+    ``OPENAI_API_KEYS``, falling back to ``OPENAI_API_KEY``.
+    """
+    if entries is None:
+        entries = [e for e in re.split(r"[,\s]+", os.getenv("OPENAI_API_KEYS", "")) if e]
+        if not entries and os.getenv("OPENAI_API_KEY"):
+            entries = [os.getenv("OPENAI_API_KEY")]
+    keys = []
+    for entry in entries:
+        if isinstance(entry, str):
+            api_key, organization, project = (entry.split(":") + [None, None])[:3]
+        else:
+            api_key, organization, project = entry.get("api_key"), entry.get("organization"), entry.get("project")
+        if api_key and api_key not in (k[0] for k in keys):
+            keys.append((api_key, organization or None, project or None))
+    return keys
+
+class ApiKey:
+    """One key: its last-seen rate-limit headroom, load and counters"""
+    __slots__ = ("label", "api_key", "organization", "project", "limits", "in_flight",
+                 "consecutive_429", "quarantines", "quarantined_until", "requests", "errors",
+                 "rate_limited", "tokens", "latency", "recent", "fingerprint", "updated", "_client", "_async_client")
+
+    def __init__(self, label: str, api_key: str, organization: str = None, project: str = None):
+        self.label = label
+        self.api_key = api_key
+        self.organization = organization
+        self.project = project
+        self.limits = {}  # "requests"/"tokens" -> (limit, remaining, reset at)
+        self.in_flight = 0
+        self.consecutive_429 = 0
+        self.quarantines = 0
+        self.quarantined_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.tokens = 0
+        self.latency = 0.0
+        self.recent = deque(maxlen=1000)  # request start times, for requests per minute
+        self.fingerprint = fingerprint(api_key)
+        self.updated = 0.0  # Unix time of the limits and quarantine held
+        self._client = None
+        self._async_client = None
+
+    def client_kwargs(self, retries: int) -> dict:
+        kwargs = {"api_key": self.api_key, "max_retries": retries}
+        if self.organization:
+            kwargs["organization"] = self.organization
+        if self.project:
+            kwargs["project"] = self.project
+        return kwargs
+
+    def headroom(self, now: float) -> float:
+        """Smallest fraction of the request and token limits left, after requests in flight"""
+        fractions = [1.0]
+        for kind, (limit, remaining, reset_at) in self.limits.items():
+            if limit and now < reset_at:
+                if kind == "requests":
+                    remaining -= self.in_flight
+                fractions.append(max(0.0, remaining / limit))
+        return min(fractions)
+
+    def update_limits(self, headers, now: float):
+        for kind in ("requests", "tokens"):
+            try:
+                limit = int(headers.get(f"x-ratelimit-limit-{kind}"))
+                remaining = int(headers.get(f"x-ratelimit-remaining-{kind}"))
+            except (TypeError, ValueError):
+                continue
+            self.limits[kind] = (limit, remaining, now + parse_duration(headers.get(f"x-ratelimit-reset-{kind}")))
+
+    def shared_state(self, now: float) -> dict:
+        """Limits and quarantine for the shared store, with times in Unix seconds"""
+        offset = time.time() - now
+        return {"limits": {kind: (limit, remaining, reset_at + offset) for kind, (limit, remaining, reset_at) in self.limits.items()},
+                "quarantined_until": self.quarantined_until + offset if self.quarantined_until else 0.0,
+                "quarantines": self.quarantines}
+
+    def adopt(self, state: dict, updated: float, now: float):
+        """Take another process's newer view of this key"""
+        offset = now - time.time()
+        self.limits = {kind: (limit, remaining, reset_at + offset) for kind, (limit, remaining, reset_at) in state["limits"].items()}
+        self.quarantined_until = state["quarantined_until"] + offset if state["quarantined_until"] else 0.0
+        self.quarantines = state["quarantines"]
+        self.updated = updated
+
+class KeyPool:
+    """Load-aware routing of completions over several API keys"""
+
+    def __init__(self, keys: list, store: SharedStore = None):
+        self.keys = [ApiKey(f"key {i + 1} …{api_key[-4:]}", api_key, organization, project)
+                     for i, (api_key, organization, project) in enumerate(keys)]
+        # A pool of one keeps the SDK's own retries; larger pools retry on another key instead
+        self._retries = 2 if len(self.keys) == 1 else 0
+        self._lock = threading.Lock()
+        self.store = store
+        self._states = queue.Queue()
+        if store is not None:
+            threading.Thread(target=self._write, name="key-state-writer", daemon=True).start()
+
+    def sync(self):
+        """Adopt the newer key states other processes wrote to the shared store"""
+        if self.store is None:
+            return
+        try:
+            states = self.store.key_states(min((key.updated for key in self.keys), default=0.0))
+        except Exception:
+            return  # keep routing on what this process knows
+        now = time.monotonic()
+        with self._lock:
+            for key in self.keys:
+                state = states.get(key.fingerprint)
+                if state is not None and state[1] > key.updated:
+                    key.adopt(state[0], state[1], now)
+
+    def _publish(self, key: ApiKey):
+        """Queue a key's state for the shared store after this process learned something new"""
+        if self.store is None:
+            return
+        with self._lock:
+            key.updated = time.time()
+            self._states.put((key.fingerprint, key.shared_state(time.monotonic()), key.updated))
+
+    def _write(self):
+        """Write queued key states in batches, and sync every KEY_SYNC_SECONDS"""
+        synced = time.monotonic()
+        while True:
+            try:
+                rows = [self._states.get(timeout=max(synced + KEY_SYNC_SECONDS - time.monotonic(), 0.05))]
+            except queue.Empty:
+                rows = []
+            while True:
+                try:
+                    rows.append(self._states.get_nowait())
+                except queue.Empty:
+                    break
+            if rows:
+                # Only each key's latest state is worth writing
+                latest = {row[0]: row for row in rows}
+                try:
+                    self.store.put_key_states(list(latest.values()))
+                except Exception:
+                    pass
+                finally:
+                    for _ in rows:
+                        self._states.task_done()
+            if time.monotonic() - synced >= KEY_SYNC_SECONDS:
+                self.sync()
+                synced = time.monotonic()
+
+    def flush(self):
+        """Wait until every queued key state is written"""
+        self._states.join()
+
+    def acquire(self, exclude=None) -> ApiKey:
+        """The available key with the most headroom; falls back to the one released soonest"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [k for k in self.keys if k.quarantined_until <= now and k is not exclude]
+            if not candidates:
+                candidates = [min(self.keys, key=lambda k: k.quarantined_until)]
+            key = max(candidates, key=lambda k: (k.headroom(now), -k.in_flight, -k.requests))
+            key.in_flight += 1
+            key.requests += 1
+            key.recent.append(now)
+            return key
+
+    def responded(self, key: ApiKey, headers, latency: float):
+        """Headers arrived: update the key's headroom"""
+        with self._lock:
+            key.consecutive_429 = 0
+            key.latency += latency
+            if headers is not None:
+                key.update_limits(headers, time.monotonic())
+        if headers is not None:
+            self._publish(key)
+
+    def release(self, key: ApiKey, tokens: int = 0):
+        with self._lock:
+            key.in_flight -= 1
+            key.tokens += tokens
+
+    def failed(self, key: ApiKey, status: int = None, headers=None):
+        """Count an error; quarantine the key after repeated 429s or when it is rejected"""
+        now = time.monotonic()
+        with self._lock:
+            key.in_flight -= 1
+            key.errors += 1
+            if status == 429:
+                key.rate_limited += 1
+                key.consecutive_429 += 1
+                if headers is not None:
+                    key.update_limits(headers, now)
+                if key.consecutive_429 >= KEY_QUARANTINE_AFTER:
+                    wait = min(KEY_QUARANTINE_SECONDS * 2 ** key.quarantines, KEY_QUARANTINE_MAX)
+                    retry_after = parse_duration(headers.get("retry-after")) if headers is not None else 0.0
+                    key.quarantined_until = now + max(wait, retry_after)
+                    key.quarantines += 1
+                    key.consecutive_429 = 0
+            elif status in (401, 403):
+                key.quarantined_until = now + INVALID_KEY_SECONDS
+        if status in (401, 403, 429):
+            self._publish(key)
+
+    def openai_client(self, key: ApiKey):
+        if key._client is None:
+            from openai import OpenAI
+            key._client = OpenAI(**key.client_kwargs(self._retries))
+        return key._client
+
+    def openai_async_client(self, key: ApiKey):
+        if key._async_client is None:
+            from openai import AsyncOpenAI
+            key._async_client = AsyncOpenAI(**key.client_kwargs(self._retries))
+        return key._async_client
+
+    def attempts(self) -> int:
+        return len(self.keys) + 2 if len(self.keys) > 1 else 1
+
+    def _should_retry(self, key: ApiKey, error: Exception, attempt: int) -> bool:
+        """Record a failed request; whether to try it again on another key"""
+        from openai import APIConnectionError, APIStatusError
+        status = error.status_code if isinstance(error, APIStatusError) else None
+        self.failed(key, status, error.response.headers if status else None)
+        retryable = isinstance(error, APIConnectionError) or status in (401, 403, 429) or (status or 0) >= 500
+        return retryable and attempt < self.attempts() - 1
+
+    def _finish(self, key: ApiKey, response, stream: bool, stream_class):
+        if stream:
+            return stream_class(response, self, key)
+        self.release(key, response.usage.total_tokens if getattr(response, "usage", None) else 0)
+        return response
+
+    def create(self, kwargs: dict):
+        """chat.completions.create on the best key, retrying rate limits and outages on another"""
+        last = None
+        for attempt in range(self.attempts()):
+            key = self.acquire(exclude=last)
+            start = time.perf_counter()
+            try:
+                raw = self.openai_client(key).chat.completions.with_raw_response.create(**kwargs)
+            except Exception as e:
+                if not self._should_retry(key, e, attempt):
+                    raise
+                last = key
+                continue
+            self.responded(key, raw.headers, time.perf_counter() - start)
+            try:
+                response = raw.parse()
+            except BaseException:
+                self.release(key)
+                raise
+            return self._finish(key, response, kwargs.get("stream"), PooledStream)
+
+    async def acreate(self, kwargs: dict):
+        """Async ``create``"""
+        last = None
+        for attempt in range(self.attempts()):
+            key = self.acquire(exclude=last)
+            start = time.perf_counter()
+            try:
+                raw = await self.openai_async_client(key).chat.completions.with_raw_response.create(**kwargs)
+            except asyncio.CancelledError:
+                self.release(key)
+                raise
+            except Exception as e:
+                if not self._should_retry(key, e, attempt):
+                    raise
+                last = key
+                continue
+            self.responded(key, raw.headers, time.perf_counter() - start)
+            try:
+                response = raw.parse()
+            except BaseException:
+                self.release(key)
+                raise
+            return self._finish(key, response, kwargs.get("stream"), AsyncPooledStream)
+
+    def client(self):
+        """Drop-in for an ``OpenAI`` client, routing each completion over the pool"""
+        return PooledClient(self)
+
+    def async_client(self):
+        """Drop-in for an ``AsyncOpenAI`` client"""
+        return PooledClient(self, asynchronous=True)
+
+    def metrics(self) -> list:
+        """One row per key: load, throughput, errors and remaining quota"""
+        now = time.monotonic()
+        rows = []
+        with self._lock:
+            for key in self.keys:
+                answered = key.requests - key.in_flight - key.errors
+                limits = {kind: remaining for kind, (_, remaining, reset_at) in key.limits.items() if now < reset_at}
+                rows.append({
+                    "key": key.label,
+                    "organization": key.organization or "",
+                    "project": key.project or "",
+                    "requests": key.requests,
+                    "rpm": sum(1 for t in key.recent if now - t < 60),
+                    "tokens": key.tokens,
+                    "errors": key.errors,
+                    "rate_limited": key.rate_limited,
+                    "in_flight": key.in_flight,
+                    "mean_latency": key.latency / answered if answered > 0 else 0.0,
+                    "remaining_requests": limits.get("requests"),
+                    "remaining_tokens": limits.get("tokens"),
+                    "quarantined_for": max(0.0, key.quarantined_until - now),
+                })
+        return rows
+
+class PooledStream:
+    """A completion stream that hands its key back to the pool when it ends"""
+
+    def __init__(self, stream, pool: KeyPool, key: ApiKey):
+        self._stream = stream
+        self._pool = pool
+        self._key = key
+        self._tokens = 0
+        self._open = True
+
+    def __iter__(self):
+        for chunk in self._stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                self._tokens = usage.total_tokens
+            yield chunk
+        self._end()
+
+    def _end(self):
+        if self._open:
+            self._open = False
+            self._pool.release(self._key, self._tokens)
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._end()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+class AsyncPooledStream(PooledStream):
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                self._tokens = usage.total_tokens
+            yield chunk
+        self._end()
+
+    async def close(self):
+        try:
+            await self._stream.close()
+        finally:
+            self._end()
+
+class _Completions:
+    def __init__(self, pool: KeyPool, asynchronous: bool):
+        self._pool = pool
+        self._asynchronous = asynchronous
+
+    def create(self, **kwargs):
+        return self._pool.acreate(kwargs) if self._asynchronous else self._pool.create(kwargs)
+
+class _Chat:
+    def __init__(self, completions: _Completions):
+        self.completions = completions
+
+class PooledClient:
+    """The part of the OpenAI client the app uses, backed by a KeyPool"""
+
+    def __init__(self, pool: KeyPool, asynchronous: bool = False):
+        self.pool = pool
+        self.chat = _Chat(_Completions(pool, asynchronous))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_key_pool(entries=None) -> KeyPool:
+    """The process-wide pool; built on first use from ``entries`` or the environment"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # A local .env may hold the keys; read with them, not when the app imports
+                from dotenv import load_dotenv
+                load_dotenv()
+                _pool = KeyPool(load_keys(entries), get_shared_store())
+    return _pool
+
+def key_metrics() -> list:
+    return _pool.metrics() if _pool is not None else []
@@ -0,0 +1,234 @@
+import json
+import os
+import sys
+import threading
+from collections.abc import Mapping
+
+# Roles that are forwarded to the chat completions API
+PROMPT_ROLES = ("user", "assistant")
+
+# Approximate fixed cost of one record in the log (Message object + list slot)
+RECORD_OVERHEAD = 96
+
+_encoder = None
+
+def estimate_tokens(text: str) -> int:
+    """Count tokens with tiktoken when installed, otherwise ~4 characters per token"""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text))
+    return max(1, (len(text) + 3) // 4) if text else 0
+
+class Message(Mapping):
+    """A single chat or debate message stored in a fixed set of slots.
+
+    Records behave as read-only mappings of their non-empty fields, so existing
+    ``msg["role"]`` / ``msg.get("speaker")`` code keeps working. The API gets
+    ``api_dict()`` instead, as it rejects the speaker and type fields.
+    """
+    __slots__ = ("role", "content", "speaker", "type", "quotes", "html", "_tokens")
+    FIELDS = ("role", "content", "speaker", "type")
+
+    def __init__(self, role: str, content: str, speaker: str = None, type: str = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.speaker = sys.intern(speaker) if speaker else None
+        self.type = sys.intern(type) if type else None
+        self.quotes = None  # QuoteCheck results for assistant answers
+        self.html = None  # sanitised HTML fragment, rendered once for display
+        self._tokens = None
+
+    def api_dict(self) -> dict:
+        """Only the fields the chat completions API accepts"""
+        return {"role": self.role, "content": self.content}
+
+    @property
+    def tokens(self) -> int:
+        """Token count of the content, computed once"""
+        if self._tokens is None:
+            self._tokens = estimate_tokens(self.content)
+        return self._tokens
+
+    def __getitem__(self, key):
+        if key in Message.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        raise KeyError(key)
+
+    def __iter__(self):
+        return (field for field in Message.FIELDS if getattr(self, field) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self) -> dict:
+        """Plain dict in the format previously kept in session state"""
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"Message({self.to_dict()!r})"
+
+def summarise(records, previous: str = "", max_topics: int = 12) -> str:
+    """Extractive summary of spilled messages: the opening of each question asked"""
+    topics = [t for t in previous.split("; ") if t] if previous else []
+    for record in records:
+        if record.role == "user":
+            first = record.content.strip().split("\n")[0]
+            topics.append(first[:80] + ("…" if len(first) > 80 else ""))
+    return "; ".join(topics[-max_topics:])
+
+class MessageLog:
+    """Append-only message history with a ready-to-send prompt view.
+
+    The prompt view is the messages list passed to the API: the system prompt
+    followed by the role and content of each user/assistant record. It is
+    extended on every append instead of being rebuilt from the whole history on
+    every request.
+    Callers must treat the list returned by ``prompt()`` as read-only.
+
+    Changes hold the log's lock: the session governor may spill a log from
+    another session's script thread while its own session appends to it.
+    """
+    __slots__ = ("_records", "_prompt", "total_tokens", "content_bytes", "spilled", "spill_path", "summary", "_lock",
+                 "__weakref__")
+
+    def __init__(self, system_prompt: str = "", messages=None):
+        self._records = []
+        self._prompt = [{"role": "system", "content": system_prompt}]
+        self.total_tokens = 0
+        self.content_bytes = 0
+        self.spilled = 0
+        self.spill_path = None
+        self.summary = ""
+        self._lock = threading.RLock()
+        for msg in messages or []:
+            self.append(msg["role"], msg["content"], msg.get("speaker"), msg.get("type"))
+
+    def __getstate__(self):
+        # Pickled for the offload pool (exports); the copy gets a lock of its own
+        with self._lock:
+            return {name: getattr(self, name) for name in self.__slots__ if name not in ("_lock", "__weakref__")}
+
+    def __setstate__(self, state: dict):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._lock = threading.RLock()
+
+    def append(self, role: str, content: str, speaker: str = None, type: str = None) -> Message:
+        """Add a message and extend the prompt view"""
+        record = Message(role, content, speaker, type)
+        with self._lock:
+            self._records.append(record)
+            self.total_tokens += record.tokens
+            self.content_bytes += sys.getsizeof(content)
+            if record.role in PROMPT_ROLES:
+                self._prompt.append(record.api_dict())
+        return record
+
+    def clear(self):
+        """Drop all messages, keeping the system prompt, and delete the spill file"""
+        with self._lock:
+            self._records.clear()
+            del self._prompt[1:]
+            self.total_tokens = 0
+            self.content_bytes = 0
+            self.spilled = 0
+            self.summary = ""
+            if self.spill_path and os.path.exists(self.spill_path):
+                os.remove(self.spill_path)
+            self.spill_path = None
+
+    def cache_html(self, record: Message, html: str) -> str:
+        """Keep a record's rendered HTML, counting it towards the log's memory"""
+        with self._lock:
+            if record.html is not None:
+                self.content_bytes -= sys.getsizeof(record.html)
+            record.html = html
+            self.content_bytes += sys.getsizeof(html)
+        return html
+
+    @property
+    def approx_bytes(self) -> int:
+        """Approximate memory held by the in-memory part of the log"""
+        return self.content_bytes + len(self._records) * RECORD_OVERHEAD
+
+    def _pinned(self) -> int:
+        # Leading debate topic records stay in memory so transcripts keep their heading
+        count = 0
+        while count < len(self._records) and self._records[count].type == "topic":
+            count += 1
+        return count
+
+    def spill(self, path: str, keep_last: int) -> int:
+        """Move all but the last ``keep_last`` messages to a JSONL file on disk.
+
+        Spilled messages are replaced in the prompt view by a short summary and
+        remain available through ``iter_all()``. Returns the number spilled.
+        """
+        with self._lock:
+            return self._spill(path, keep_last)
+
+    def _spill(self, path: str, keep_last: int) -> int:
+        pinned = self._pinned()
+        count = len(self._records) - pinned - keep_last
+        if count <= 0:
+            return 0
+        old = self._records[pinned:pinned + count]
+        del self._records[pinned:pinned + count]
+        with open(path, "a" if self.spill_path == path else "w", encoding="utf-8") as f:
+            for record in old:
+                f.write(json.dumps(record.to_dict(), ensure_ascii=False) + "\n")
+        self.spill_path = path
+        self.spilled += count
+        self.summary = summarise(old, self.summary)
+        self.total_tokens = sum(record.tokens for record in self._records)
+        self.content_bytes = sum(sys.getsizeof(record.content) + (sys.getsizeof(record.html) if record.html else 0)
+                                 for record in self._records)
+        
+        self._prompt[1:] = [record.api_dict() for record in self._records if record.role in PROMPT_ROLES]
+        if self.summary:
+            self._prompt.insert(1, {"role": "system", "content": f"Earlier in this conversation the student asked about: {self.summary}"})
+        return count
+
+    def iter_all(self):
+        """Iterate over all messages in order, reading spilled ones back from disk"""
+        pinned = self._pinned()
+        yield from self._records[:pinned]
+        if self.spill_path and os.path.exists(self.spill_path):
+            with open(self.spill_path, encoding="utf-8") as f:
+                for line in f:
+                    data = json.loads(line)
+                    yield Message(data["role"], data["content"], data.get("speaker"), data.get("type"))
+        yield from self._records[pinned:]
+
+    def prompt(self, system_prompt: str = None) -> list:
+        """Return the messages list to send to the API"""
+        if system_prompt is not None and self._prompt[0]["content"] != system_prompt:
+            self._prompt[0] = {"role": "system", "content": system_prompt}
+        return self._prompt
+
+    def to_dicts(self) -> list:
+        """Full history, including spilled messages, as plain dicts (for export)"""
+        return [record.to_dict() for record in self.iter_all()]
+
+    def __len__(self):
+        return len(self._records)
+
+    def __bool__(self):
+        return bool(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __getitem__(self, index):
+        return self._records[index]
+
+    def __repr__(self):
+        return f"MessageLog({len(self._records)} messages, {self.total_tokens} tokens)"
@@ -0,0 +1,211 @@
+"""CPU-heavy work run on a shared process pool, off the Streamlit script threads.
+
+Streamlit runs every session's script, and the answer workers in jobs.py, as
+threads of one interpreter, so anything CPU-bound (BM25 retrieval, quote
+verification, building the indexes, exporting a long transcript) holds the
+GIL and stalls every other session's rerun. Those jobs are sent here instead:
+
+    offload.run(fn, *args)          from a thread; blocks only the caller
+    await offload.arun(fn, *args)   from the API's event loop
+
+``fn`` must be a module-level function and its arguments picklable. At most
+``OFFLOAD_QUEUE`` jobs are queued or running at once across all sessions; a
+caller waits up to ``OFFLOAD_WAIT`` seconds for a place and then gets Busy,
+so a burst of exports slows the people exporting, not everyone else. With
+``OFFLOAD_WORKERS=0``, and inside the workers themselves, jobs run inline.
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Worker processes; by default one per core, leaving one for Streamlit itself
+OFFLOAD_WORKERS = int(os.getenv("OFFLOAD_WORKERS") or max(1, min(4, (os.cpu_count() or 2) - 1)))
+
+# Jobs queued or running at once, across all sessions
+OFFLOAD_QUEUE = int(os.getenv("OFFLOAD_QUEUE", "32"))
+
+# Seconds a caller waits for a place in the queue before Busy
+OFFLOAD_WAIT = float(os.getenv("OFFLOAD_WAIT", "10"))
+
+# Not fork: the parent has Streamlit's threads and the HTTP clients' sockets
+_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+_Context = type(multiprocessing.get_context(_METHOD))
+
+# Stands in for __main__ while a worker starts; see _WorkerProcess
+_BARE_MAIN = types.ModuleType("__main__")
+_start_lock = threading.Lock()
+
+class _WorkerProcess(_Context.Process):
+    """A worker that imports only what its jobs need.
+
+    A new process re-imports the parent's ``__main__``, and under Streamlit
+    that is whichever page script ran last, which would run it again there.
+    """
+
+    def start(self):
+        with _start_lock:
+            main = sys.modules["__main__"]
+            sys.modules["__main__"] = _BARE_MAIN
+            try:
+                super().start()
+            finally:
+                # Unless a script run has since installed its own
+                if sys.modules["__main__"] is _BARE_MAIN:
+                    sys.modules["__main__"] = main
+
+class _WorkerContext(_Context):
+    Process = _WorkerProcess
+
+class Busy(Exception):
+    """The offload queue stayed full for longer than the caller would wait"""
+
+class Offloader:
+    """A process pool behind a bounded queue, with counters for the usage panel"""
+
+    def __init__(self, workers: int = OFFLOAD_WORKERS, capacity: int = OFFLOAD_QUEUE):
+        self.workers = workers
+        self.capacity = capacity
+        self._slots = threading.BoundedSemaphore(capacity)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.inline = 0
+        self.wait_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        # Workers run their jobs' own offload calls inline rather than nesting pools
+        return self.workers > 0 and multiprocessing.parent_process() is None
+
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(self.workers, mp_context=_WorkerContext())
+        return self._executor
+
+    def _reset(self, broken: ProcessPoolExecutor):
+        # A worker died (out of memory, killed); later jobs get a fresh pool
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _submitted(self, fn, args, start: float):
+        try:
+            executor = self.executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._reset(executor)
+                executor = self.executor()
+                future = executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.pending += 1
+            self.submitted += 1
+            self.wait_seconds += time.perf_counter() - start
+        submitted = time.perf_counter()
+        future.add_done_callback(lambda f: self._finished(f, executor, submitted))
+        return future
+
+    def _finished(self, future, executor: ProcessPoolExecutor, submitted: float):
+        self._slots.release()
+        error = None if future.cancelled() else future.exception()
+        with self._lock:
+            self.pending -= 1
+            self.busy_seconds += time.perf_counter() - submitted
+            if future.cancelled() or error is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+        if isinstance(error, BrokenProcessPool):
+            self._reset(executor)
+
+    def _rejected(self, wait: float):
+        with self._lock:
+            self.rejected += 1
+        return Busy(f"{self.capacity} background jobs already queued; waited {wait:g}s")
+
+    def submit(self, fn, *args, wait: float = OFFLOAD_WAIT):
+        """A Future for ``fn(*args)`` on the pool; Busy if no place frees up within ``wait``"""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=wait):
+            raise self._rejected(wait)
+        return self._submitted(fn, args, start)
+
+    def run(self, fn, *args, wait: float = OFFLOAD_WAIT, timeout: float = None):
+        """``fn(*args)`` on the pool, blocking only the calling thread"""
+        if not self.enabled:
+            with self._lock:
+                self.inline += 1
+            return fn(*args)
+        return self.submit(fn, *args, wait=wait).result(timeout)
+
+    async def arun(self, fn, *args, wait: float = OFFLOAD_WAIT):
+        """``run`` for the event loop: neither waiting for a place nor the job blocks it"""
+        if not self.enabled:
+            return await asyncio.to_thread(self.run, fn, *args)
+        start = time.perf_counter()
+        delay = 0.002
+        while not self._slots.acquire(blocking=False):
+            if time.perf_counter() - start >= wait:
+                raise self._rejected(wait)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        return await asyncio.wrap_future(self._submitted(fn, args, start))
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers if self.enabled else 0,
+                "capacity": self.capacity,
+                "pending": self.pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "inline": self.inline,
+                "mean_wait_ms": 1000 * self.wait_seconds / max(self.submitted, 1),
+                "mean_job_ms": 1000 * self.busy_seconds / max(self.completed + self.failed, 1),
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+_offloader = None
+_offloader_lock = threading.Lock()
+
+def get_offloader() -> Offloader:
+    """The process-wide pool; worker processes start on the first job"""
+    global _offloader
+    if _offloader is None:
+        with _offloader_lock:
+            if _offloader is None:
+                _offloader = Offloader()
+    return _offloader
+
+def run(fn, *args, **kwargs):
+    return get_offloader().run(fn, *args, **kwargs)
+
+async def arun(fn, *args, **kwargs):
+    return await get_offloader().arun(fn, *args, **kwargs)
+
+def offload_metrics() -> dict:
+    return _offloader.metrics() if _offloader is not None else Offloader().metrics()
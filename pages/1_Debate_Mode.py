@@ -6,10 +6,31 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils import (
     init_session_state, 
-    get_debate_response, 
-    get_shared_css,
-    export_conversation,
-    create_navbar
+    inject_shared_css,
+    deferred_export,
+    export_debate,
+    create_navbar,
+    show_metrics_panel,
+    show_search_box,
+    add_message,
+    get_registry,
+    show_transcript,
+    debate_turn_html,
+    debate_turn_fragment,
+    markdown_to_html,
+    active_job,
+    last_debate_turn,
+    submit_debate_round,
+    submit_debate_rounds,
+    show_schedule_report,
+    Schedule,
+    AUTO_DEFAULT_ROUNDS,
+    AUTO_MAX_ROUNDS,
+    AUTO_TIME_BUDGET,
+    AUTO_TOKEN_BUDGET,
+    cancel_job,
+    follow_jobs,
+    Follower
 )
 
 # Initialize session state
@@ -26,7 +47,7 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # Apply shared CSS with current theme
-st.markdown(get_shared_css(st.session_state.theme), unsafe_allow_html=True)
+inject_shared_css(st.session_state.theme)
 
 # Navigation Bar
 create_navbar("debate")
@@ -35,14 +56,14 @@ create_navbar("debate")
 st.markdown("""
     <div class='main-title'>
         <div class='chinese-title'>📜 哲学辩论 Philosophical Debate</div>
-        <div class='english-subtitle'>Watch Confucius and Mencius discuss profound questions</div>
+        <div class='english-subtitle'>Watch Confucius, Mencius and other masters discuss profound questions</div>
     </div>
 """, unsafe_allow_html=True)
 
 # Debate Section
 st.markdown("""
     <div class='debate-section'>
-        <div class='debate-subtitle'>Enter a philosophical question and watch both masters engage in thoughtful dialogue</div>
+        <div class='debate-subtitle'>Enter a philosophical question and watch the masters engage in thoughtful dialogue</div>
     </div>
 """, unsafe_allow_html=True)
 
@@ -55,18 +76,41 @@ with debate_col2:
         key="debate_topic_input"
     )
     
-    debate_btn_col1, debate_btn_col2, debate_btn_col3 = st.columns([1, 1, 1])
+    registry = get_registry()
+    
+    def update_debaters():
+        st.session_state.debaters = st.session_state.debater_picker
+    
+    st.multiselect(
+        "Debaters (in speaking order):",
+        options=list(registry),
+        default=st.session_state.debaters,
+        format_func=lambda pid: f"{registry[pid].chinese_name} {registry[pid].name}",
+        key="debater_picker",
+        on_change=update_debaters,
+        max_selections=4
+    )
+    
+    debate_btn_col1, debate_btn_col2, debate_btn_col3, debate_btn_col4 = st.columns([1, 1, 1, 1])
+    running = active_job("debate_messages") is not None
     
     with debate_btn_col1:
         start_debate = st.button("🎭 Start Debate", use_container_width=True)
     
     with debate_btn_col2:
         if st.session_state.debate_active and len(st.session_state.debate_messages) > 0:
-            continue_debate = st.button("➡️ Continue", use_container_width=True)
+            continue_debate = st.button("➡️ Continue", use_container_width=True, disabled=running)
         else:
             continue_debate = False
     
     with debate_btn_col3:
+        auto_debate = st.button(
+            f"⏩ Auto-run {st.session_state.get('auto_rounds', AUTO_DEFAULT_ROUNDS)}",
+            use_container_width=True, disabled=running,
+            help="Run several rounds back to back; set the rounds and budgets in the sidebar"
+        )
+    
+    with debate_btn_col4:
         clear_debate = st.button("🗑️ Clear Debate", use_container_width=True)
 
 # Export controls
@@ -81,97 +125,103 @@ if st.session_state.debate_messages and len(st.session_state.debate_messages) >
         format_map = {"Text (.txt)": "txt", "Markdown (.md)": "md", "JSON (.json)": "json"}
         selected_format = format_map[export_format]
         
-        # Create debate export content
-        debate_export = f"Philosophical Debate\nTopic: {st.session_state.debate_messages[0]['content']}\n\n"
-        for msg in st.session_state.debate_messages[1:]:
-            if msg.get("speaker"):
-                debate_export += f"\n{msg['speaker']}:\n{msg['content']}\n"
-        
         st.download_button(
             label=f"📥 Export Debate",
-            data=debate_export,
+            data=deferred_export(export_debate, st.session_state.debate_messages, selected_format),
             file_name=f"debate_{st.session_state.debate_messages[0]['content'][:30].replace(' ', '_')}.{selected_format}",
-            mime="text/plain",
+            mime="text/plain" if selected_format != "json" else "application/json",
             use_container_width=True
         )
 
-# Display debate messages
-if st.session_state.debate_messages:
-    st.markdown("---")
-    debate_container = st.container()
-    with debate_container:
-        for msg in st.session_state.debate_messages:
-            if msg["type"] == "topic":
-                st.markdown(f"""
-                    <div class='debate-message topic'>
-                        <div style='font-weight: 600; font-size: 1.1rem;'>📖 Topic for Discussion</div>
-                        <div style='margin-top: 0.5rem; font-size: 1rem;'>{msg["content"]}</div>
-                    </div>
-                """, unsafe_allow_html=True)
-            else:
-                speaker_class = "confucius" if msg["speaker"] == "Confucius" else "mencius"
-                speaker_chinese = "孔子" if msg["speaker"] == "Confucius" else "孟子"
-                st.markdown(f"""
-                    <div class='debate-message {speaker_class}'>
-                        <div class='speaker-label {speaker_class}'>{speaker_chinese} {msg["speaker"]}</div>
-                        <div>{msg["content"]}</div>
-                    </div>
-                """, unsafe_allow_html=True)
-
-# Handle debate actions
-if start_debate and debate_topic:
-    st.session_state.debate_messages = [{"type": "topic", "content": debate_topic}]
+def auto_schedule() -> Schedule:
+    return Schedule(
+        st.session_state.get("auto_rounds", AUTO_DEFAULT_ROUNDS),
+        st.session_state.get("auto_token_budget", AUTO_TOKEN_BUDGET),
+        st.session_state.get("auto_time_budget", AUTO_TIME_BUDGET)
+    )
+
+def begin_debate(topic: str):
+    cancel_job("debate_messages", discard=True)
+    st.session_state.debate_messages.clear()
+    add_message("debate_messages", "user", topic, type="topic")
+    st.session_state.debate_lineup = [registry[pid].name for pid in st.session_state.debaters]
     st.session_state.debate_active = True
-    
-    # Get initial responses from both philosophers
-    with st.spinner("Confucius is contemplating..."):
-        confucius_response = get_debate_response(debate_topic, [], "Confucius")
-        st.session_state.debate_messages.append({
-            "speaker": "Confucius",
-            "content": confucius_response,
-            "type": "response"
-        })
-    
-    with st.spinner("Mencius is reflecting..."):
-        mencius_response = get_debate_response(debate_topic, [], "Mencius", confucius_response)
-        st.session_state.debate_messages.append({
-            "speaker": "Mencius",
-            "content": mencius_response,
-            "type": "response"
-        })
-    
+    st.session_state.debate_schedule = None
+
+# Auto-run continues the current debate, or starts one on the entered topic
+debate_running = st.session_state.debate_active and len(st.session_state.debate_messages) > 0
+if auto_debate and not debate_running:
+    start_debate, auto_debate = auto_debate, False
+    start_auto = True
+else:
+    start_auto = False
+
+if start_debate and debate_topic and len(st.session_state.debaters) < 2:
+    st.warning("Choose at least two debaters.")
+start_debate = start_debate and debate_topic and len(st.session_state.debaters) >= 2
+
+# Handle debate actions; rounds are generated in the background and streamed below
+if start_debate:
+    begin_debate(debate_topic)
+    if start_auto:
+        submit_debate_rounds(debate_topic, auto_schedule())
+    else:
+        submit_debate_round(debate_topic)
     st.rerun()
 
-elif continue_debate and st.session_state.debate_active:
-    # Get the last response from Mencius
-    last_mencius = [msg for msg in st.session_state.debate_messages if msg.get("speaker") == "Mencius"][-1]["content"]
+elif (continue_debate or auto_debate) and st.session_state.debate_active:
+    # The first speaker answers the last turn of the previous round; if the
+    # first round was stopped before anyone spoke, the debate opens again
+    last_turn = last_debate_turn()
     topic = st.session_state.debate_messages[0]["content"]
-    
-    # Confucius responds to Mencius
-    with st.spinner("Confucius is responding..."):
-        confucius_response = get_debate_response(topic, st.session_state.debate_messages, "Confucius", last_mencius)
-        st.session_state.debate_messages.append({
-            "speaker": "Confucius",
-            "content": confucius_response,
-            "type": "response"
-        })
-    
-    # Mencius responds to Confucius
-    with st.spinner("Mencius is responding..."):
-        mencius_response = get_debate_response(topic, st.session_state.debate_messages, "Mencius", confucius_response)
-        st.session_state.debate_messages.append({
-            "speaker": "Mencius",
-            "content": mencius_response,
-            "type": "response"
-        })
-    
+    if auto_debate:
+        submit_debate_rounds(topic, auto_schedule(), last_turn)
+    else:
+        st.session_state.debate_schedule = None
+        submit_debate_round(topic, last_turn)
     st.rerun()
 
 elif clear_debate:
-    st.session_state.debate_messages = []
+    cancel_job("debate_messages", discard=True)
+    st.session_state.debate_messages.clear()
     st.session_state.debate_active = False
+    st.session_state.debate_schedule = None
     st.rerun()
 
+# Display debate messages
+if st.session_state.debate_messages:
+    st.markdown("---")
+followers = []
+with st.container():
+    if st.session_state.debate_messages.spilled:
+        st.caption(f"🗄️ {st.session_state.debate_messages.spilled} earlier turns archived (included in export)")
+    # Each turn is rendered to sanitised HTML once; reruns reuse it
+    show_transcript(st.session_state.debate_messages, debate_turn_html)
+    
+    job = active_job("debate_messages")
+    schedule = st.session_state.debate_schedule
+    if job is not None:
+        # A round still being generated; re-attach to it
+        st.button("⏹ Stop", key=f"stop_{job.id}", on_click=job.cancel)
+        placeholder = st.empty()
+        progress = st.empty()
+        
+        def render_round(turns):
+            placeholder.markdown(
+                "".join(debate_turn_fragment(entry.speaker, markdown_to_html(text) if text else "<em>…</em>")
+                        for entry, text in turns),
+                unsafe_allow_html=True
+            )
+            if schedule is not None:
+                report = schedule.snapshot()
+                progress.caption(f"⏩ Round {min(report['completed'] + 1, report['rounds'])} of {report['rounds']} · "
+                                 f"~{report['tokens']} / {schedule.token_budget} tokens · "
+                                 f"{report['elapsed']:.0f} / {schedule.time_budget:.0f}s")
+        
+        followers.append(Follower(job, render_round))
+    elif schedule is not None:
+        show_schedule_report(schedule)
+
 # Sidebar
 with st.sidebar:
     st.markdown("### 📜 Debate Settings")
@@ -182,8 +232,8 @@ with st.sidebar:
         <ol>
         <li>Enter a philosophical question or topic</li>
         <li>Click "Start Debate" to begin</li>
-        <li>Watch as both philosophers share their perspectives</li>
-        <li>Click "Continue" to deepen the discussion</li>
+        <li>Choose the debaters and watch them share their perspectives</li>
+        <li>Click "Continue" to deepen the discussion, or "Auto-run" to let them go several rounds</li>
         <li>Export your favorite debates for later reference</li>
         </ol>
         
@@ -197,11 +247,21 @@ with st.sidebar:
         </div>
     """, unsafe_allow_html=True)
     
+    st.markdown("**⏩ Auto-run**")
+    st.slider("Rounds", 1, AUTO_MAX_ROUNDS, AUTO_DEFAULT_ROUNDS, key="auto_rounds")
+    st.number_input("Token budget (output tokens)", 200, 50000, AUTO_TOKEN_BUDGET, step=500, key="auto_token_budget")
+    st.number_input("Time budget (seconds)", 10, 1800, int(AUTO_TIME_BUDGET), step=30, key="auto_time_budget")
+    
     st.markdown("---")
     
+    show_search_box()
+    show_metrics_panel()
+    
     st.markdown("""
         <div style='font-size: 0.9rem; line-height: 1.6; color: #666; text-align: center;'>
         <p>💡 <strong>Tip:</strong> Use the navigation bar at the top to switch between Main Chat and Debate Mode.</p>
         </div>
     """, unsafe_allow_html=True)
 
+# Stream the round in progress; interacting with the page does not stop it
+follow_jobs(followers)
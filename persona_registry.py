@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import threading
+
+from message_log import estimate_tokens
+
+PERSONA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "personas")
+
+class Persona:
+    """A philosopher persona: display metadata plus its precomputed system prompt.
+
+    Built once per process from ``personas/<id>.json`` and the prompt file it
+    names. The prompt's token count and hash, and the portrait's bytes, are
+    computed at load time so reruns never touch the filesystem.
+    """
+    __slots__ = ("id", "name", "chinese_name", "title", "honorific", "image_width", "avatar",
+                 "dates", "focus", "spinner", "colors", "order", "corpus", "routing", "prompt", "prompt_tokens",
+                 "prompt_hash", "image_bytes")
+
+    def __init__(self, data: dict, directory: str):
+        self.id = data["id"]
+        self.name = data["name"]
+        self.chinese_name = data.get("chinese_name", "")
+        self.title = data.get("title", "")
+        self.honorific = data.get("honorific", "")
+        self.image_width = data.get("image_width", 70)
+        self.avatar = data.get("avatar", "🏛️")
+        self.dates = data.get("dates", "")
+        self.focus = data.get("focus", "")
+        self.spinner = data.get("spinner", "Contemplating...")
+        self.colors = data.get("colors", {})
+        self.order = data.get("order", 100)
+        self.corpus = tuple(data.get("corpus", ()))
+        self.routing = data.get("routing", {})  # optional tier/temperature overrides, see routing.py
+
+        with open(os.path.join(directory, data.get("prompt_file", f"{self.id}.md")), encoding="utf-8") as f:
+            self.prompt = f.read().strip()
+        self.prompt_tokens = estimate_tokens(self.prompt)
+        self.prompt_hash = hashlib.sha256(self.prompt.encode("utf-8")).hexdigest()[:16]
+
+        self.image_bytes = None
+        if data.get("image"):
+            # Portraits live next to app.py; a missing file falls back to the avatar
+            image_path = os.path.join(os.path.dirname(directory), data["image"])
+            if os.path.exists(image_path):
+                with open(image_path, "rb") as f:
+                    self.image_bytes = f.read()
+
+    @property
+    def messages_key(self) -> str:
+        """Session state key holding this persona's chat history"""
+        return f"{self.id}_messages"
+
+    def __repr__(self):
+        return f"Persona({self.id!r}, {self.prompt_tokens} prompt tokens, {self.prompt_hash})"
+
+def load_personas(directory: str = PERSONA_DIR) -> dict:
+    """Read every persona definition in ``directory``, ordered for display"""
+    personas = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".json"):
+            with open(os.path.join(directory, filename), encoding="utf-8") as f:
+                personas.append(Persona(json.load(f), directory))
+    personas.sort(key=lambda persona: (persona.order, persona.name))
+    return {persona.id: persona for persona in personas}
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry() -> dict:
+    """Return all personas by id, loading them on first use"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = load_personas()
+    return _registry
+
+def get_persona(key: str) -> Persona:
+    """Look up a persona by id or display name"""
+    registry = get_registry()
+    persona = registry.get(key) or registry.get(key.lower())
+    if persona is None:
+        for candidate in registry.values():
+            if candidate.name == key:
+                return candidate
+        raise KeyError(f"Unknown persona: {key}")
+    return persona
+
+_by_prompt = None
+
+def persona_for_prompt(prompt: str) -> Persona:
+    """The persona whose system prompt this is, or None"""
+    global _by_prompt
+    if _by_prompt is None:
+        _by_prompt = {persona.prompt: persona for persona in get_registry().values()}
+    return _by_prompt.get(prompt)
@@ -0,0 +1,128 @@
+"""Prompt layout for providers' prompt caching, and how often the cache is hit.
+
+OpenAI reuses the work done on the longest prefix of a prompt that it has
+seen recently. This applies to prompts over 1,024 tokens, in steps of 128.
+Cached tokens cost half as much and the answer starts sooner, but only a
+byte-identical prefix counts. So prompts are laid out with what changes least
+first:
+
+    persona prompt        the same for every request to a persona
+    static instructions   the same for every debate with the same line-up
+    history               chat messages, or the debate topic; only grows
+    per-request tail      the latest debate turns, retrieved passages
+
+Chat prompts already follow this order (see ``utils.build_prompt``). Debate
+prompts used to put everything after the persona prompt in one user message
+that changed every turn. ``PROMPT_LAYOUT`` chooses:
+
+    prefix   the layout above (the default)
+    legacy   debate prompts as before
+    ab       each debate gets one of the two, by a hash of its topic, so both
+             run side by side and are reported separately
+
+The cached prompt tokens the API reports (``prompt_tokens_details``) are
+counted per persona, mode and layout for the usage panel.
+"""
+import hashlib
+import os
+import threading
+
+from persona_registry import persona_for_prompt
+
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "prefix")
+
+LAYOUTS = ("prefix", "legacy")
+
+DEBATE_INTRO = "You are in a respectful philosophical dialogue with {others}. "
+
+# Instructions that do not change from turn to turn, kept in the prefix
+DEBATE_RULES = ("A student has asked a question and each of you answers in turn. When you reply to another "
+                "philosopher, respond thoughtfully, building on or respectfully contrasting with their view. "
+                "Do not repeat points already made. Keep your response concise (2-3 paragraphs).")
+
+DEBATE_OPENER = "Please share your initial thoughts on this matter."
+DEBATE_REPLY = ("Respond thoughtfully, building on or respectfully contrasting with their view. "
+                "Do not repeat points already made. Keep your response concise (2-3 paragraphs).")
+
+class Prompt(list):
+    """A messages list that knows which layout built it"""
+    __slots__ = ("layout",)
+
+    def __init__(self, messages=(), layout: str = "prefix"):
+        super().__init__(messages)
+        self.layout = layout
+
+def layout_for(key: str) -> str:
+    """The layout for a conversation, from its opening text under the ``ab`` setting"""
+    if PROMPT_LAYOUT == "ab":
+        return LAYOUTS[hashlib.blake2b((key or "").encode("utf-8"), digest_size=1).digest()[0] & 1]
+    return PROMPT_LAYOUT if PROMPT_LAYOUT in LAYOUTS else "prefix"
+
+def debate_prompt(persona_prompt: str, others: list, topic: str, turns: list = (), context: str = None,
+                  layout: str = None) -> Prompt:
+    """Messages for a debate turn.
+
+    ``turns`` are the formatted summary and latest turns, oldest first; an
+    empty list asks for an opening statement. ``context`` is retrieved passages.
+    """
+    layout = layout or layout_for(topic)
+    intro = DEBATE_INTRO.format(others=" and ".join(others))
+    messages = Prompt([{"role": "system", "content": persona_prompt}], layout)
+    if layout == "legacy":
+        text = f"\n\n{intro}A student has asked: '{topic}'. "
+        text += ("".join(f"\n\n{turn}" for turn in turns) + f"\n\n{DEBATE_REPLY}") if turns else DEBATE_OPENER
+        messages.append({"role": "user", "content": text})
+    else:
+        messages.append({"role": "system", "content": intro + DEBATE_RULES})
+        messages.append({"role": "user", "content": f"A student has asked: '{topic}'"})
+        messages.append({"role": "user", "content": "\n\n".join(turns) if turns else DEBATE_OPENER})
+    if context:
+        messages.append({"role": "system", "content": context})
+    return messages
+
+def persona_id(messages: list) -> str:
+    """The id of the persona whose system prompt opens ``messages``, or None"""
+    persona = persona_for_prompt(messages[0]["content"]) if messages and messages[0]["role"] == "system" else None
+    return persona.id if persona is not None else None
+
+def cached_tokens(usage) -> int:
+    """Prompt tokens served from the provider's cache, or None if not reported"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) if details is not None else None
+
+class PrefixCacheStats:
+    """Prompt and cached prompt tokens by (persona, mode, layout)"""
+
+    def __init__(self):
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def record(self, messages: list, mode: str, prompt_tokens: int, cached: int = None):
+        key = (persona_id(messages) or "-", mode, getattr(messages, "layout", "prefix"))
+        with self._lock:
+            stats = self._groups.get(key)
+            if stats is None:
+                stats = self._groups[key] = {"requests": 0, "reported": 0, "hits": 0, "prompt_tokens": 0, "cached_tokens": 0}
+            stats["requests"] += 1
+            # Only requests whose usage reports cached tokens count towards the hit rate
+            if cached is not None:
+                stats["reported"] += 1
+                stats["hits"] += cached > 0
+                stats["prompt_tokens"] += prompt_tokens
+                stats["cached_tokens"] += cached
+
+    def report(self) -> list:
+        with self._lock:
+            return [
+                {"persona": persona, "mode": mode, "layout": layout, **stats,
+                 "hit_rate": stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0}
+                for (persona, mode, layout), stats in sorted(self._groups.items())
+            ]
+
+_stats = PrefixCacheStats()
+
+def record(messages: list, mode: str, prompt_tokens: int, cached: int = None):
+    _stats.record(messages, mode, prompt_tokens, cached)
+
+def prefix_cache_report() -> list:
+    return _stats.report()
@@ -0,0 +1,177 @@
+"""Which free-text questions are popular, per persona, in bounded memory.
+
+Each question is normalised (case, punctuation, spacing) and counted in a
+Space-Saving sketch (Metwally, Agrawal and El Abbadi, 2005) of
+``QUERY_LOG_CAPACITY`` counters per persona. The most frequent questions are
+kept with counts that overestimate by at most the counter's recorded error,
+and memory never grows past the counters.
+
+The log is privacy-preserving by construction. It lives only in memory and is
+never written to disk or shown. It holds no session ids, only a few salted
+hash prefixes per question to count distinct askers. Questions that look
+personal are not logged at all: long ones, or ones with digits, e-mail
+addresses or links. The answer cache (answer_cache.py) warms the current
+top-K questions that enough different sessions have asked.
+"""
+import hashlib
+import heapq
+import itertools
+import os
+import re
+import threading
+import unicodedata
+
+# Counters per persona; any question asked more than total / capacity times is tracked
+QUERY_LOG_CAPACITY = int(os.getenv("QUERY_LOG_CAPACITY", "1000"))
+
+# Longer questions are not logged (they are rarely repeated and more often personal)
+QUERY_MAX_WORDS = int(os.getenv("QUERY_MAX_WORDS", "25"))
+
+# Distinct askers remembered per question, enough to check WARM_MIN_SESSIONS
+SESSIONS_KEPT = 8
+
+_PERSONAL = re.compile(r"\d|@|https?://|www\.", re.I)
+_PUNCTUATION = re.compile(r"[^\w\s']+")
+
+def normalise(question: str) -> str:
+    """Lower-case words without punctuation, or None for a question not to log"""
+    text = unicodedata.normalize("NFKC", question or "").lower()
+    if _PERSONAL.search(text):
+        return None
+    words = _PUNCTUATION.sub(" ", text).replace("'", "").split()
+    if not words or len(words) > QUERY_MAX_WORDS:
+        return None
+    return " ".join(words)
+
+class Counter:
+    """A tracked item: ``count - error`` is a lower bound on its true count"""
+    __slots__ = ("count", "error", "sessions")
+
+    def __init__(self, count: float = 0.0, error: float = 0.0):
+        self.count = count
+        self.error = error
+        self.sessions = set()
+
+class SpaceSaving:
+    """Approximate top items of a stream in ``capacity`` counters.
+
+    A new item, once all counters are taken, replaces the item with the
+    smallest count and inherits that count as its error. The minimum is found
+    on a heap of (count, tiebreak, item) entries, left stale as counts grow and
+    skipped when popped.
+    """
+
+    def __init__(self, capacity: int = QUERY_LOG_CAPACITY):
+        self.capacity = capacity
+        self.counters = {}
+        self.total = 0.0
+        self._heap = []
+        self._tiebreak = itertools.count()
+
+    def add(self, item, weight: float = 1.0) -> Counter:
+        self.total += weight
+        counter = self.counters.get(item)
+        if counter is None:
+            floor = self._evict() if len(self.counters) >= self.capacity else 0.0
+            counter = self.counters[item] = Counter(floor, floor)
+        counter.count += weight
+        heapq.heappush(self._heap, (counter.count, next(self._tiebreak), item))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild()
+        return counter
+
+    def _evict(self) -> float:
+        while True:
+            count, _, item = heapq.heappop(self._heap)
+            counter = self.counters.get(item)
+            if counter is not None and counter.count == count:
+                del self.counters[item]
+                return count
+
+    def _rebuild(self):
+        self._heap = [(c.count, next(self._tiebreak), item) for item, c in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def decay(self, factor: float = 0.5):
+        """Scale every count down, so that the top items follow current traffic"""
+        for counter in self.counters.values():
+            counter.count *= factor
+            counter.error *= factor
+        self.total *= factor
+        self._rebuild()
+
+    def top(self, k: int) -> list:
+        """[(item, Counter)] with the highest counts first"""
+        return heapq.nlargest(k, self.counters.items(), key=lambda pair: pair[1].count)
+
+    def __len__(self):
+        return len(self.counters)
+
+class QueryLog:
+    """A Space-Saving sketch of (question, route) per persona"""
+
+    def __init__(self, capacity: int = QUERY_LOG_CAPACITY):
+        self.capacity = capacity
+        self._sketches = {}
+        self._lock = threading.Lock()
+        self._salt = os.urandom(16)
+        self.logged = 0
+        self.skipped = 0
+
+    def record(self, persona_id: str, question: str, route_name: str, session: str = None) -> str:
+        """Count one question; returns its normalised form, or None if it was not logged"""
+        text = normalise(question)
+        with self._lock:
+            if text is None:
+                self.skipped += 1
+                return None
+            self.logged += 1
+            sketch = self._sketches.get(persona_id)
+            if sketch is None:
+                sketch = self._sketches[persona_id] = SpaceSaving(self.capacity)
+            counter = sketch.add((text, route_name))
+            if session is not None and len(counter.sessions) < SESSIONS_KEPT:
+                counter.sessions.add(hashlib.blake2b(session.encode(), key=self._salt, digest_size=6).digest())
+        return text
+
+    def top(self, persona_id: str, k: int, min_count: float = 1, min_sessions: int = 1) -> list:
+        """[(question, route name, count)]: the persona's top ``k`` with a guaranteed count of ``min_count``"""
+        with self._lock:
+            sketch = self._sketches.get(persona_id)
+            if sketch is None:
+                return []
+            return [
+                (text, route_name, counter.count)
+                for (text, route_name), counter in sketch.top(k)
+                if counter.count - counter.error >= min_count and len(counter.sessions) >= min_sessions
+            ]
+
+    def personas(self) -> list:
+        with self._lock:
+            return list(self._sketches)
+
+    def decay(self, factor: float = 0.5):
+        with self._lock:
+            for sketch in self._sketches.values():
+                sketch.decay(factor)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "logged": self.logged,
+                "skipped": self.skipped,
+                "tracked": sum(len(sketch) for sketch in self._sketches.values()),
+                "capacity": self.capacity * len(self._sketches),
+            }
+
+_log = None
+_log_lock = threading.Lock()
+
+def get_query_log() -> QueryLog:
+    """The process-wide query log"""
+    global _log
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                _log = QueryLog()
+    return _log
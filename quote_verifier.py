@@ -0,0 +1,235 @@
+"""Check quotations in generated answers against the classical texts.
+
+``python quote_verifier.py build`` hashes every word trigram of the corpus
+(stopwords removed, see retrieval.tokenize) into a sorted uint64 table with a
+parallel table of passage ids, written next to the retrieval index. At run
+time the table is memory-mapped and looked up by binary search.
+
+QuoteVerifier is fed the answer as it streams: each quotation is checked the
+moment its closing quote mark arrives, so results are ready when the stream
+ends and verification adds no visible latency.
+"""
+import array
+import bisect
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import offload
+from retrieval import INDEX_DIR, _map, read_passages, tokenize
+
+NGRAM = 3
+
+# Share of a quote's trigrams that must appear in the texts
+ATTESTED = 0.6
+PARTIAL = 0.3
+
+# Quotes shorter than this many content words are not checked
+MIN_QUOTE_WORDS = 4
+
+# Shorter quotations (a single term, "ren") are stepped over, not checked
+MIN_QUOTE_CHARS = 12
+
+_MARK = re.compile(r'["“”]')
+
+def _hash(gram) -> int:
+    return int.from_bytes(hashlib.blake2b(" ".join(gram).encode("utf-8"), digest_size=8).digest(), "little")
+
+def ngram_hashes(tokens: list):
+    return [_hash(tokens[i:i + NGRAM]) for i in range(len(tokens) - NGRAM + 1)]
+
+def build_ngram_index(index_dir: str = INDEX_DIR, passages=None) -> int:
+    """Write the trigram tables; returns the number of distinct trigrams. Raises ValueError if there are no passages"""
+    passages = list(passages if passages is not None else read_passages())
+    if not passages:
+        raise ValueError("No passages found; add the texts listed in corpus/README.md")
+    pairs = {}
+    for doc_id, (_, _, text) in enumerate(passages):
+        for value in ngram_hashes(tokenize(text)):
+            pairs.setdefault(value, doc_id)
+    hashes = array.array("Q")
+    docs = array.array("I")
+    for value in sorted(pairs):
+        hashes.append(value)
+        docs.append(pairs[value])
+
+    os.makedirs(index_dir, exist_ok=True)
+    for name, data in (("ngrams.bin", hashes), ("ngram_docs.bin", docs)):
+        if sys.byteorder != "little":
+            data.byteswap()
+        with open(os.path.join(index_dir, name), "wb") as f:
+            data.tofile(f)
+    with open(os.path.join(index_dir, "ngram_meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"ngram": NGRAM, "refs": [[book, reference] for book, reference, _ in passages]}, f,
+                  ensure_ascii=False, separators=(",", ":"))
+    return len(hashes)
+
+class NgramIndex:
+    """Read-only trigram table over memory-mapped files"""
+
+    def __init__(self, index_dir: str = INDEX_DIR):
+        with open(os.path.join(index_dir, "ngram_meta.json"), encoding="utf-8") as f:
+            self.refs = json.load(f)["refs"]
+        self._maps = [_map(os.path.join(index_dir, name)) for name in ("ngrams.bin", "ngram_docs.bin")]
+        hashes, docs = self._maps
+        self._hashes = memoryview(hashes).cast("Q") if hashes else []
+        self._docs = memoryview(docs).cast("I") if docs else []
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def lookup(self, value: int):
+        """Passage id containing the trigram, or None"""
+        i = bisect.bisect_left(self._hashes, value)
+        if i < len(self._hashes) and self._hashes[i] == value:
+            return self._docs[i]
+        return None
+
+    def check(self, quote: str):
+        """Return (status, coverage, reference) for one quotation"""
+        tokens = tokenize(quote)
+        if len(tokens) < MIN_QUOTE_WORDS:
+            return None
+        found = {}
+        hashes = ngram_hashes(tokens)
+        for value in hashes:
+            doc_id = self.lookup(value)
+            if doc_id is not None:
+                found[doc_id] = found.get(doc_id, 0) + 1
+        coverage = sum(found.values()) / len(hashes)
+        status = "attested" if coverage >= ATTESTED else "partial" if coverage >= PARTIAL else "unattested"
+        reference = None
+        if found:
+            book, ref = self.refs[max(found, key=found.get)]
+            reference = f"{book.title()} {ref}"
+        return status, coverage, reference
+
+class QuoteCheck:
+    """Verification result for one quotation in an answer"""
+    __slots__ = ("quote", "status", "coverage", "reference")
+
+    def __init__(self, quote: str, status: str, coverage: float, reference: str = None):
+        self.quote = quote
+        self.status = status
+        self.coverage = coverage
+        self.reference = reference
+
+    def __repr__(self):
+        return f"QuoteCheck({self.status}, {self.coverage:.0%}, {self.reference}, {self.quote[:40]!r})"
+
+class QuoteVerifier:
+    """Incremental quotation checker for one streamed answer"""
+
+    def __init__(self, index: NgramIndex):
+        self.index = index
+        self.text = ""
+        self._scanned = 0
+        self._open = None  # where the open quotation's text starts
+        self.checks = []
+
+    def feed(self, chunk: str):
+        """Add streamed text and check any quotations it completes.
+
+        Quote marks are paired as they arrive, each scanned once: outside a
+        quotation ``"`` and ``“`` open one, inside it ``"`` and ``”`` close it
+        (a second ``“`` starts over), and a stray ``”`` is ignored. So the text
+        between two quotations is never taken for one.
+        """
+        self.text += chunk
+        for match in _MARK.finditer(self.text, self._scanned):
+            mark = match.group()
+            if self._open is None or mark == "“":
+                if mark != "”":
+                    self._open = match.end()
+                continue
+            quote = self.text[self._open:match.start()]
+            self._open = None
+            if len(quote) < MIN_QUOTE_CHARS:
+                continue
+            result = self.index.check(quote)
+            if result:
+                self.checks.append(QuoteCheck(quote.strip(), *result))
+        self._scanned = len(self.text)
+
+    def wrap(self, chunks):
+        """Pass a chunk stream through unchanged while verifying it"""
+        try:
+            for chunk in chunks:
+                self.feed(chunk)
+                yield chunk
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_ngram_index():
+    """Return the process-wide trigram table, or None when no corpus is bundled or the table is empty"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if not os.path.exists(os.path.join(INDEX_DIR, "ngram_meta.json")):
+                    if not any(True for _ in read_passages()):
+                        _index = False
+                        return None
+                    offload.run(build_ngram_index)
+                _index = NgramIndex(INDEX_DIR)
+    return _index or None
+
+def new_verifier():
+    """A QuoteVerifier for one answer, or None when there is nothing to check against"""
+    index = get_ngram_index()
+    return QuoteVerifier(index) if index else None
+
+def check_text(text: str) -> list:
+    """QuoteChecks for a finished answer, or None; run on the offload pool"""
+    verifier = new_verifier()
+    if verifier is None:
+        return None
+    verifier.feed(text)
+    return verifier.checks
+
+def format_checks(checks) -> str:
+    """Markdown annotation listing each checked quotation"""
+    lines = []
+    for check in checks or ():
+        quote = check.quote if len(check.quote) <= 80 else check.quote[:77] + "…"
+        if check.status == "attested":
+            lines.append(f"✅ Attested ({check.reference}): “{quote}”")
+        elif check.status == "partial":
+            lines.append(f"🟡 Loosely attested ({check.reference}): “{quote}”")
+        else:
+            lines.append(f"⚠️ Not found in the texts: “{quote}”")
+    return "  \n".join(lines)
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("build", "check"):
+        print("usage: python quote_verifier.py build [--optional] | check <text>")
+        sys.exit(2)
+    if sys.argv[1] == "build":
+        start = time.perf_counter()
+        try:
+            count = build_ngram_index()
+        except ValueError as e:
+            optional = "--optional" in sys.argv[2:]
+            print(f"{'warning' if optional else 'error'}: {e}", file=sys.stderr)
+            sys.exit(0 if optional else 1)
+        print(f"Indexed {count} trigrams in {time.perf_counter() - start:.2f}s -> {INDEX_DIR}")
+    else:
+        verifier = new_verifier()
+        if verifier is None:
+            print("No corpus found")
+            sys.exit(1)
+        verifier.feed(" ".join(sys.argv[2:]))
+        for check in verifier.checks:
+            print(check)
+
+if __name__ == "__main__":
+    main()
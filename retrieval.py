@@ -0,0 +1,240 @@
+"""BM25 passage retrieval over the bundled classical texts.
+
+Each ``corpus/<book>.txt`` holds one passage per paragraph (blank-line
+separated), optionally starting with a reference such as ``2.15`` or
+``[1A.1]``. ``python retrieval.py build`` writes a compact inverted index to
+``corpus/index/``; the app memory-maps it on first use and injects the top-k
+passages for each question into the prompt.
+
+Index layout (all little-endian):
+    meta.json        N, avgdl, BM25 parameters, books, passage refs, vocabulary
+                     as {term: [first posting, document frequency]}
+    postings.bin     uint32 pairs (passage id, term frequency), grouped by term
+    norms.bin        float32 per passage: k1 * (1 - b + b * len / avgdl)
+    passages.bin     UTF-8 passage text, concatenated
+    offsets.bin      uint32 byte offsets into passages.bin (N + 1 entries)
+"""
+import array
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+import offload
+
+CORPUS_DIR = os.getenv("CORPUS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus"))
+INDEX_DIR = os.getenv("RETRIEVAL_INDEX_DIR", os.path.join(CORPUS_DIR, "index"))
+
+# Passages injected per question
+TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+
+K1 = 1.2
+B = 0.75
+
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being
+but by can could did do does doing for from had has have having he her here him his how
+i if in into is it its let me more most my no nor not now of on or our out over said say
+says shall she should so some such than that the their them then there these they this
+those thus to too under up upon us very was we were what when where which while who whom
+why will with would ye yet you your
+""".split())
+
+_TOKEN = re.compile(r"[a-z0-9]+|[一-鿿]")
+_REFERENCE = re.compile(r"^\[?([0-9]+[A-Za-z]?(?:[.:][0-9]+)*)\]?[.:]?\s+")
+
+def tokenize(text: str) -> list:
+    """Lowercased word tokens (single characters for Chinese), stopwords removed"""
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+def read_passages(corpus_dir: str = CORPUS_DIR):
+    """Yield (book, reference, text) for every passage in the corpus"""
+    if not os.path.isdir(corpus_dir):
+        return
+    for filename in sorted(os.listdir(corpus_dir)):
+        if not filename.endswith(".txt"):
+            continue
+        book = filename[:-4]
+        with open(os.path.join(corpus_dir, filename), encoding="utf-8") as f:
+            paragraphs = re.split(r"\n\s*\n", f.read())
+        for number, paragraph in enumerate(paragraphs, 1):
+            text = " ".join(paragraph.split())
+            if not text:
+                continue
+            match = _REFERENCE.match(text)
+            if match:
+                reference, text = match.group(1), text[match.end():]
+            else:
+                reference = str(number)
+            yield book, reference, text
+
+def build_index(corpus_dir: str = CORPUS_DIR, index_dir: str = INDEX_DIR, passages=None) -> dict:
+    """Build the on-disk index; returns its metadata. Raises ValueError if there are no passages"""
+    passages = list(passages if passages is not None else read_passages(corpus_dir))
+    if not passages:
+        raise ValueError(f"No passages found in {corpus_dir}; add the texts listed in corpus/README.md")
+    postings = defaultdict(list)
+    lengths = []
+    for doc_id, (_, _, text) in enumerate(passages):
+        counts = Counter(tokenize(text))
+        lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings[term].append((doc_id, tf))
+
+    n = len(passages)
+    avgdl = (sum(lengths) / n) if n else 0.0
+    vocabulary = {}
+    flat = array.array("I")
+    for term in sorted(postings):
+        vocabulary[term] = [len(flat) // 2, len(postings[term])]
+        for doc_id, tf in postings[term]:
+            flat.extend((doc_id, tf))
+
+    norms = array.array("f", (K1 * (1 - B + B * length / avgdl) if avgdl else K1 for length in lengths))
+    offsets = array.array("I", [0])
+    encoded = bytearray()
+    for _, _, text in passages:
+        encoded += text.encode("utf-8")
+        offsets.append(len(encoded))
+
+    meta = {
+        "N": n,
+        "avgdl": avgdl,
+        "k1": K1,
+        "b": B,
+        "books": sorted({book for book, _, _ in passages}),
+        "refs": [[book, reference] for book, reference, _ in passages],
+        "vocabulary": vocabulary,
+    }
+    os.makedirs(index_dir, exist_ok=True)
+    for name, data in (("postings.bin", flat), ("norms.bin", norms), ("offsets.bin", offsets)):
+        if sys.byteorder != "little":
+            data.byteswap()
+        with open(os.path.join(index_dir, name), "wb") as f:
+            data.tofile(f)
+    with open(os.path.join(index_dir, "passages.bin"), "wb") as f:
+        f.write(encoded)
+    with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, separators=(",", ":"))
+    return meta
+
+def _map(path: str):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class PassageIndex:
+    """Read-only BM25 index over memory-mapped files"""
+
+    def __init__(self, index_dir: str = INDEX_DIR):
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.n = meta["N"]
+        self.books = meta["books"]
+        self.refs = meta["refs"]
+        self.vocabulary = meta["vocabulary"]
+        self._maps = [_map(os.path.join(index_dir, name))
+                      for name in ("postings.bin", "norms.bin", "offsets.bin", "passages.bin")]
+        postings, norms, offsets, self._text = self._maps
+        # Zero-copy views; the host is little-endian on every deploy target
+        self._postings = memoryview(postings).cast("I") if postings else []
+        self._norms = memoryview(norms).cast("f") if norms else []
+        self._offsets = memoryview(offsets).cast("I")
+        self._book_ids = {book: i for i, book in enumerate(self.books)}
+        self._doc_books = array.array("B", (self._book_ids[book] for book, _ in self.refs))
+
+    def __len__(self):
+        return self.n
+
+    def passage(self, doc_id: int) -> str:
+        return bytes(self._text[self._offsets[doc_id]:self._offsets[doc_id + 1]]).decode("utf-8")
+
+    def search(self, query: str, k: int = TOP_K, books=None) -> list:
+        """Top-k passages as (score, book, reference, text), best first"""
+        allowed = None
+        if books is not None:
+            allowed = {self._book_ids[book] for book in books if book in self._book_ids}
+            if not allowed:
+                return []
+        scores = defaultdict(float)
+        postings, norms, doc_books = self._postings, self._norms, self._doc_books
+        k1_plus_1 = K1 + 1
+        for term in set(tokenize(query)):
+            entry = self.vocabulary.get(term)
+            if entry is None:
+                continue
+            start, df = entry
+            idf = math.log(1 + (self.n - df + 0.5) / (df + 0.5))
+            pairs = iter(postings[2 * start:2 * (start + df)].tolist())
+            for doc_id, tf in zip(pairs, pairs):
+                if allowed is not None and doc_books[doc_id] not in allowed:
+                    continue
+                scores[doc_id] += idf * tf * k1_plus_1 / (tf + norms[doc_id])
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, *self.refs[doc_id], self.passage(doc_id)) for doc_id, score in best]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """Return the process-wide index, or None when no corpus is bundled or the index is empty.
+
+    The index is built offline (``python retrieval.py build``); if only the
+    corpus is present it is built here once.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if not os.path.exists(os.path.join(INDEX_DIR, "meta.json")):
+                    if not any(True for _ in read_passages()):
+                        _index = False
+                        return None
+                    offload.run(build_index)
+                _index = PassageIndex(INDEX_DIR)
+    return _index or None
+
+def passages_for(query: str, k: int = TOP_K, books=None) -> str:
+    """Formatted top-k passages for a query, or None; run on the offload pool"""
+    index = get_index()
+    results = index.search(query, k, books=books) if index is not None else None
+    return format_passages(results) if results else None
+
+def format_passages(results: list) -> str:
+    """Prompt block listing retrieved passages with their references"""
+    lines = [f"[{book.title()} {reference}] {text}" for _, book, reference, text in results]
+    return ("Relevant passages from the classical texts (quote or paraphrase them where apt; "
+            "do not invent quotations):\n" + "\n".join(lines))
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("build", "search"):
+        print("usage: python retrieval.py build [--optional] | search <query>")
+        sys.exit(2)
+    if sys.argv[1] == "build":
+        start = time.perf_counter()
+        try:
+            meta = build_index()
+        except ValueError as e:
+            # --optional (the deploy builds): no corpus yet is a warning, and the app runs ungrounded
+            optional = "--optional" in sys.argv[2:]
+            print(f"{'warning' if optional else 'error'}: {e}", file=sys.stderr)
+            sys.exit(0 if optional else 1)
+        print(f"Indexed {meta['N']} passages from {', '.join(meta['books']) or 'no books'} "
+              f"({len(meta['vocabulary'])} terms) in {time.perf_counter() - start:.2f}s -> {INDEX_DIR}")
+    else:
+        index = get_index()
+        if index is None:
+            print(f"No corpus found in {CORPUS_DIR}")
+            sys.exit(1)
+        for score, book, reference, text in index.search(" ".join(sys.argv[2:])):
+            print(f"{score:6.2f}  [{book} {reference}] {text[:100]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Model and output-budget routing for every completion the app makes.
+
+Each request is routed by mode (chat or debate), the response-length setting
+and the persona to a Route: a model tier, max_tokens and temperature. The
+whole table lives here; tiers map to models through MODEL_FAST and
+MODEL_STANDARD, and a persona can override its tier, temperature or backends
+with a ``routing`` object in its JSON definition.
+
+Each route also lists the backends to try, in order (see backends.py):
+``BACKENDS`` for every mode, or ``BACKENDS_CHAT`` / ``BACKENDS_DEBATE``, as
+comma-separated names such as ``openai,local``.
+
+Completed requests are recorded per route (latency, tokens, estimated cost) so
+the usage panel can show what each route costs. ``python routing.py`` prints
+the table.
+"""
+import os
+import threading
+from collections import deque
+
+# Both tiers default to gpt-4o-mini, which is cheaper and stronger than
+# gpt-3.5-turbo; by default they differ only in max_tokens. Set
+# MODEL_STANDARD=gpt-4o for stronger replies at about 16 times the price.
+TIERS = {
+    "fast": os.getenv("MODEL_FAST", "gpt-4o-mini"),
+    "standard": os.getenv("MODEL_STANDARD", "gpt-4o-mini"),
+}
+
+TEMPERATURE = 0.7
+
+# Backends tried in order for each mode
+_DEFAULT_BACKENDS = os.getenv("BACKENDS", "openai")
+BACKEND_ORDER = {
+    mode: tuple(name.strip() for name in os.getenv(f"BACKENDS_{mode.upper()}", _DEFAULT_BACKENDS).split(",") if name.strip())
+    for mode in ("chat", "debate")
+}
+
+# (mode, variant) -> (tier, max_tokens)
+ROUTES = {
+    ("chat", "Brief"): ("fast", 250),
+    ("chat", "Medium"): ("standard", 500),
+    ("chat", "Detailed"): ("standard", 800),
+    ("debate", "opener"): ("fast", 300),
+    ("debate", "reply"): ("standard", 400),
+}
+
+LENGTHS = ("Brief", "Medium", "Detailed")
+
+# USD per million (input, output) tokens, for the cost report
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o": (2.50, 10.00),
+}
+
+class Route:
+    """Model, output budget, temperature and backends for one request"""
+    __slots__ = ("name", "model", "max_tokens", "temperature", "backends")
+
+    def __init__(self, name: str, model: str, max_tokens: int, temperature: float = TEMPERATURE, backends: tuple = ("openai",)):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.backends = tuple(backends)
+
+    def params(self) -> dict:
+        """Keyword arguments for chat.completions.create"""
+        return {"model": self.model, "max_tokens": self.max_tokens, "temperature": self.temperature}
+
+    def served_by(self, backend: str, model: str) -> "Route":
+        """This route as run on one backend, with that backend's model"""
+        return Route(self.name, model, self.max_tokens, self.temperature, (backend,))
+
+    def __repr__(self):
+        return f"Route({self.name}: {self.model}, {self.max_tokens} tokens, t={self.temperature}, via {'/'.join(self.backends)})"
+
+def resolve(mode: str = "chat", variant: str = "Medium", persona=None) -> Route:
+    """Route for a request; ``variant`` is the length setting for chat, opener/reply for debate"""
+    key = (mode, variant)
+    if key not in ROUTES:
+        key = (mode, "Medium" if mode == "chat" else "reply")
+    tier, max_tokens = ROUTES[key]
+    temperature = TEMPERATURE
+    overrides = getattr(persona, "routing", None) or {}
+    tier = overrides.get("tier", tier)
+    temperature = overrides.get("temperature", temperature)
+    backends = overrides.get("backends") or BACKEND_ORDER.get(mode, ("openai",))
+    return Route(f"{key[0]}/{key[1]}", TIERS.get(tier, tier), max_tokens, temperature, backends)
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated USD cost of one request; 0 for unpriced models"""
+    input_price, output_price = PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1e6
+
+class RouteStats:
+    """Process-wide latency and spend per route"""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._window = window
+        self._routes = {}
+
+    def record(self, route: Route, latency: float, prompt_tokens: int, completion_tokens: int, completed: bool = True):
+        with self._lock:
+            stats = self._routes.get((route.name, route.model))
+            if stats is None:
+                stats = self._routes[(route.name, route.model)] = {
+                    "requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0,
+                    "completed": 0, "completed_tokens": 0, "latencies": deque(maxlen=self._window),
+                }
+            stats["requests"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cost"] += cost(route.model, prompt_tokens, completion_tokens)
+            # Stopped requests count towards spend but not latency or answer length
+            if completed:
+                stats["completed"] += 1
+                stats["completed_tokens"] += completion_tokens
+                stats["latencies"].append(latency)
+
+    def expected_tokens(self, route: Route) -> int:
+        """Mean length of finished answers on this route, or its max_tokens before any finish"""
+        with self._lock:
+            stats = self._routes.get((route.name, route.model))
+            if not stats or not stats["completed"]:
+                return route.max_tokens
+            return round(stats["completed_tokens"] / stats["completed"])
+
+    def report(self) -> list:
+        """One row per (route, model): requests, p50/p95 latency in seconds, tokens and cost"""
+        rows = []
+        with self._lock:
+            for (name, model), stats in sorted(self._routes.items()):
+                latencies = sorted(stats["latencies"]) or [0.0]
+                rows.append({
+                    "route": name,
+                    "model": model,
+                    "requests": stats["requests"],
+                    "p50": latencies[len(latencies) // 2],
+                    "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                    "prompt_tokens": stats["prompt_tokens"],
+                    "completion_tokens": stats["completion_tokens"],
+                    "cost": stats["cost"],
+                })
+        return rows
+
+_stats = RouteStats()
+
+def record(route: Route, latency: float, prompt_tokens: int, completion_tokens: int, completed: bool = True):
+    _stats.record(route, latency, prompt_tokens, completion_tokens, completed)
+
+def expected_tokens(route: Route) -> int:
+    return _stats.expected_tokens(route)
+
+def route_report() -> list:
+    return _stats.report()
+
+def main():
+    print(f"{'route':<16}{'model':<18}{'max_tokens':>11}{'$/1M in':>9}{'$/1M out':>10}  backends")
+    for mode, variant in ROUTES:
+        route = resolve(mode, variant)
+        input_price, output_price = PRICES.get(route.model, (0.0, 0.0))
+        print(f"{route.name:<16}{route.model:<18}{route.max_tokens:>11}{input_price:>9.2f}{output_price:>10.2f}  "
+              f"{', '.join(route.backends)}")
+
+if __name__ == "__main__":
+    main()
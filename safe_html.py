@@ -0,0 +1,84 @@
+"""Markdown to HTML that is safe to show with ``unsafe_allow_html``.
+
+Model output and user questions are escaped first, so no tag or entity in
+them survives; only the Markdown the answers actually use is then turned
+into a fixed set of tags: paragraphs and line breaks, headings, bulleted and
+numbered lists, block quotes, fenced and inline code, bold and italics.
+Links stay as plain text. The result has no raw newlines, so Streamlit's
+Markdown pass leaves it as a single HTML block.
+"""
+import html
+import re
+
+_FENCE = re.compile(r"^```[^\n]*\n(.*?)(?:\n```|\Z)", re.S | re.M)
+_HEADING = re.compile(r"^(#{1,6})\s+(.*)$")
+_BULLET = re.compile(r"^\s*[-*•]\s+(.*)$")
+_NUMBERED = re.compile(r"^\s*\d+[.)]\s+(.*)$")
+_QUOTE = re.compile(r"^&gt;\s?(.*)$")
+_CODE = re.compile(r"`([^`\n]+)`")
+_BOLD = re.compile(r"\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__")
+_ITALIC = re.compile(r"(?<![\w*])\*(?=\S)(.+?)(?<=\S)\*(?!\*)|(?<!\w)_(?=\S)(.+?)(?<=\S)_(?!\w)")
+
+def inline(text: str) -> str:
+    """Inline Markdown of already-escaped text"""
+    spans = []
+
+    def keep(match):
+        spans.append(f"<code>{match.group(1)}</code>")
+        return f"\x00{len(spans) - 1}\x00"
+    text = _CODE.sub(keep, text)
+    text = _BOLD.sub(lambda m: f"<strong>{m.group(1) or m.group(2)}</strong>", text)
+    text = _ITALIC.sub(lambda m: f"<em>{m.group(1) or m.group(2)}</em>", text)
+    return re.sub(r"\x00(\d+)\x00", lambda m: spans[int(m.group(1))], text)
+
+def _kind(line: str) -> str:
+    for kind, pattern in (("h", _HEADING), ("ul", _BULLET), ("ol", _NUMBERED), ("blockquote", _QUOTE)):
+        if pattern.match(line):
+            return kind
+    return "p"
+
+def _group(kind: str, lines: list) -> str:
+    if kind == "h":
+        out = []
+        for line in lines:
+            heading = _HEADING.match(line)
+            level = min(len(heading.group(1)) + 2, 6)  # keep headings smaller than the page's own
+            out.append(f"<h{level}>{inline(heading.group(2))}</h{level}>")
+        return "".join(out)
+    if kind in ("ul", "ol"):
+        pattern = _BULLET if kind == "ul" else _NUMBERED
+        return f"<{kind}>{''.join(f'<li>{inline(pattern.match(line).group(1))}</li>' for line in lines)}</{kind}>"
+    if kind == "blockquote":
+        return f"<blockquote>{'<br>'.join(inline(_QUOTE.match(line).group(1)) for line in lines)}</blockquote>"
+    return f"<p>{'<br>'.join(inline(line) for line in lines)}</p>"
+
+def markdown_to_html(text: str) -> str:
+    """Sanitised HTML for a message's Markdown"""
+    text = html.escape(text.strip().replace("\r\n", "\n"), quote=True)
+    parts = []
+    position = 0
+    for fence in _FENCE.finditer(text):
+        parts.append(_blocks(text[position:fence.start()]))
+        # No raw newlines: a blank line would end Streamlit's HTML block early
+        parts.append(f"<pre><code>{fence.group(1).replace(chr(10), '&#10;')}</code></pre>")
+        position = fence.end()
+    parts.append(_blocks(text[position:]))
+    return "".join(parts)
+
+def _blocks(text: str) -> str:
+    """Paragraphs split on blank lines; within one, runs of list, quote and heading lines"""
+    out = []
+    for chunk in re.split(r"\n\s*\n", text):
+        run_kind, run = None, []
+        for line in chunk.split("\n"):
+            if not line.strip():
+                continue
+            kind = _kind(line)
+            if kind != run_kind and run:
+                out.append(_group(run_kind, run))
+                run = []
+            run_kind = kind
+            run.append(line)
+        if run:
+            out.append(_group(run_kind, run))
+    return "".join(out)
@@ -0,0 +1,176 @@
+"""Full-text search over saved chat and debate messages.
+
+Every message added to a conversation or debate is also written to SQLite
+(``SEARCH_DB``), and its words to an FTS5 table: an inverted index that
+SQLite keeps up to date on each insert. Messages are grouped by library, a
+random id kept in the page URL (``?library=…``). A bookmarked link brings
+back the same library, and a search only ever sees its own library's
+messages.
+
+Writes are queued and committed in batches by one writer thread, so adding a
+message never waits on the disk. Searches run on a read connection per thread
+(WAL mode lets them run alongside the writer). Each word is indexed with
+its library's id in front, so every posting list holds one library's
+messages only. A search costs about the same with 1,000 saved messages in all
+or 1,000,000, and however common its words are elsewhere.
+"""
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+SEARCH_DB = os.getenv("SEARCH_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "messages.db"))
+
+# Messages waiting to be written; beyond this, new ones are not indexed
+SEARCH_QUEUE = 10000
+
+# Messages written per transaction, at most
+BATCH = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY, library TEXT, log TEXT, speaker TEXT, role TEXT, content TEXT, created REAL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS message_terms USING fts5(terms, content = '', tokenize = 'porter unicode61');
+"""
+
+# Words of context either side of the first match in a snippet
+SNIPPET_WORDS = 12
+
+_LIBRARY = re.compile(r"^[0-9a-f]{16}$")
+_TERM = re.compile(r"\w+", re.U)
+
+def valid_library(library: str) -> bool:
+    return bool(library) and _LIBRARY.match(library) is not None
+
+def scoped_terms(library: str, text: str) -> str:
+    """The text's words, each prefixed with the library id so that every posting list is per library"""
+    return " ".join(library + word for word in _TERM.findall(text.lower()))
+
+def match_expression(library: str, query: str) -> str:
+    """FTS5 query for all of the words in ``query`` (the last one as a prefix) in one library"""
+    words = _TERM.findall(query.lower())[:12]
+    if not words:
+        return None
+    return " ".join(f'"{library}{word}"' for word in words) + "*"
+
+def snippet(content: str, query: str) -> str:
+    """The stretch of ``content`` around the first query word, with matches between \\x02 and \\x03"""
+    words = [re.escape(word) for word in _TERM.findall(query.lower())[:12]]
+    pattern = re.compile(r"\b(?:" + "|".join(words) + r")\w*", re.I | re.U) if words else None
+    tokens = content.split()
+    first = next((i for i, token in enumerate(tokens) if pattern and pattern.search(token)), 0)
+    start, end = max(0, first - SNIPPET_WORDS), min(len(tokens), first + SNIPPET_WORDS + 1)
+    text = " ".join(tokens[start:end])
+    if pattern is not None:
+        text = pattern.sub(lambda m: f"\x02{m.group(0)}\x03", text)
+    return ("… " if start else "") + text + (" …" if end < len(tokens) else "")
+
+class Hit:
+    """One matching message"""
+    __slots__ = ("id", "log", "speaker", "role", "created", "snippet")
+
+    def __init__(self, id: int, log: str, speaker: str, role: str, created: float, snippet: str):
+        self.id = id
+        self.log = log
+        self.speaker = speaker
+        self.role = role
+        self.created = created
+        self.snippet = snippet
+
+def insert(connection: sqlite3.Connection, rows: list):
+    """Write (library, log, speaker, role, content, created) rows and index their words"""
+    for row in rows:
+        rowid = connection.execute(
+            "INSERT INTO messages (library, log, speaker, role, content, created) VALUES (?, ?, ?, ?, ?, ?)", row
+        ).lastrowid
+        connection.execute("INSERT INTO message_terms (rowid, terms) VALUES (?, ?)", (rowid, scoped_terms(row[0], row[4])))
+
+class SearchIndex:
+    """Writes messages in the background and answers searches per library"""
+
+    def __init__(self, path: str = SEARCH_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+        self._queue = queue.Queue(SEARCH_QUEUE)
+        self._local = threading.local()
+        self.indexed = 0
+        self.dropped = 0
+        self._writer = threading.Thread(target=self._write, name="search-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def add(self, library: str, log: str, speaker: str, role: str, content: str):
+        """Queue one message for the index"""
+        if not valid_library(library) or not content:
+            return
+        try:
+            self._queue.put_nowait((library, log, speaker, role, content, time.time()))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        connection = self._connect()
+        while True:
+            rows = [self._queue.get()]
+            while len(rows) < BATCH:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with connection:
+                    insert(connection, rows)
+                self.indexed += len(rows)
+            except sqlite3.Error:
+                self.dropped += len(rows)
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Wait until every queued message is written"""
+        self._queue.join()
+
+    def _reader(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    def search(self, library: str, query: str, limit: int = 20) -> list:
+        """Best-matching messages in ``library``, with a highlighted snippet"""
+        expression = match_expression(library, query) if valid_library(library) else None
+        if expression is None:
+            return []
+        rows = self._reader().execute(
+            "SELECT m.id, m.log, m.speaker, m.role, m.created, m.content FROM "
+            "(SELECT rowid, rank FROM message_terms WHERE message_terms MATCH ? ORDER BY rank LIMIT ?) AS t "
+            "JOIN messages AS m ON m.id = t.rowid ORDER BY t.rank",
+            (expression, limit)
+        ).fetchall()
+        return [Hit(*row[:5], snippet(row[5], query)) for row in rows]
+
+    def metrics(self) -> dict:
+        return {"indexed": self.indexed, "queued": self._queue.qsize(), "dropped": self.dropped}
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_search_index() -> SearchIndex:
+    """The process-wide search index, opened on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SearchIndex()
+    return _index
@@ -0,0 +1,259 @@
+"""Serve the app from several Streamlit processes behind one port.
+
+One Streamlit process runs every session's script in one interpreter, so on
+a machine with several cores most of them sit idle while the scripts contend
+for the GIL. ``python serve.py`` starts ``SERVE_WORKERS`` Streamlit processes
+(default: one per core) on local ports, and a small reverse proxy on ``PORT``:
+
+    browser --> proxy :PORT --> worker 0  127.0.0.1:8700
+                            --> worker 1  127.0.0.1:8701  ...
+
+A session lives in one worker's memory, behind one websocket, so the proxy
+keeps each browser on one worker. The first response to a new browser carries
+a cookie naming the worker with the fewest connections. Later requests come
+back to that worker, including the websocket when it reconnects, and uploads
+and media files, which are also kept per process. If that worker has died, the
+browser moves to another one and starts a new session there.
+
+The proxy works on raw connections. It reads a request's head to pick the
+worker and adds the cookie to the response head if needed. After that it
+copies bytes both ways, websocket frames included.
+
+The workers share ``SHARED_DB`` (the answer cache and API key rate limits;
+see shared_store.py) and ``SEARCH_DB``. They also share one cookie secret, so
+a browser that moves to another worker keeps valid cookies. ``TRACE_FILE`` and
+``SPANS_FILE`` get one file per worker (``spans.0.jsonl``, ...). A worker that
+exits is restarted.
+
+    python serve.py --workers 4 --port 8501 [-- extra streamlit options]
+
+``GET /_serve/status`` on the proxy reports each worker's state and connections.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import secrets
+import signal
+import subprocess
+import sys
+import time
+
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS") or os.cpu_count() or 1)
+
+# Workers listen on 127.0.0.1 from this port up
+SERVE_BASE_PORT = int(os.getenv("SERVE_BASE_PORT", "8700"))
+
+AFFINITY_COOKIE = "st_worker"
+
+DEFAULT_SHARED_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "shared.db")
+
+# Longest request or response head the proxy reads before giving up
+MAX_HEAD = 64 * 1024
+
+# A restarted worker waits this long, doubling after each quick exit
+RESTART_DELAY = 1.0
+RESTART_DELAY_MAX = 30.0
+
+_COOKIE = re.compile(rb"^cookie:[^\r\n]*?\b" + AFFINITY_COOKIE.encode() + rb"=(\d+)", re.I | re.M)
+_STATUS_PATH = b"/_serve/status"
+
+def worker_env(index: int, workers: int, cookie_secret: str, base: dict = None) -> dict:
+    """Environment for one worker process"""
+    env = dict(os.environ if base is None else base)
+    env["SERVE_WORKER"] = str(index)
+    env["SHARED_DB"] = env.get("SHARED_DB") or DEFAULT_SHARED_DB
+    env["STREAMLIT_SERVER_COOKIE_SECRET"] = cookie_secret
+    # Every core already runs a worker; CPU-heavy work only gets the cores left over
+    env.setdefault("OFFLOAD_WORKERS", str(max(0, ((os.cpu_count() or 1) - workers) // workers)))
+    for name in ("TRACE_FILE", "SPANS_FILE"):
+        if env.get(name):
+            root, ext = os.path.splitext(env[name])
+            env[name] = f"{root}.{index}{ext}"
+    return env
+
+class Worker:
+    """One Streamlit process and its proxy connections"""
+
+    def __init__(self, index: int, port: int):
+        self.index = index
+        self.port = port
+        self.process = None
+        self.connections = 0
+        self.served = 0
+        self.restarts = 0
+        self.started = 0.0
+        self.up = False
+
+    def status(self) -> dict:
+        return {"worker": self.index, "port": self.port, "pid": self.process.pid if self.process else None,
+                "up": self.up, "connections": self.connections, "served": self.served, "restarts": self.restarts}
+
+class Server:
+    """Starts and restarts the workers, and proxies connections to them with cookie affinity"""
+
+    def __init__(self, workers: int = SERVE_WORKERS, base_port: int = SERVE_BASE_PORT, script: str = "app.py",
+                 streamlit_args: list = ()):
+        self.workers = [Worker(i, base_port + i) for i in range(workers)]
+        self.script = script
+        self.streamlit_args = list(streamlit_args)
+        self.cookie_secret = os.getenv("STREAMLIT_SERVER_COOKIE_SECRET") or secrets.token_hex(32)
+        self._stopping = False
+
+    # Workers
+
+    def spawn(self, worker: Worker):
+        command = [sys.executable, "-m", "streamlit", "run", self.script,
+                   f"--server.port={worker.port}", "--server.address=127.0.0.1", "--server.headless=true",
+                   *self.streamlit_args]
+        worker.process = subprocess.Popen(command, env=worker_env(worker.index, len(self.workers), self.cookie_secret),
+                                          cwd=os.path.dirname(os.path.abspath(__file__)))
+        worker.started = time.monotonic()
+        worker.up = True
+
+    async def supervise(self):
+        """Restart workers that exit, backing off when one keeps failing"""
+        delays = {worker.index: RESTART_DELAY for worker in self.workers}
+        while not self._stopping:
+            await asyncio.sleep(1.0)
+            for worker in self.workers:
+                if self._stopping or worker.process is None or worker.process.poll() is None:
+                    continue
+                worker.up = False
+                quick = time.monotonic() - worker.started < 60
+                delays[worker.index] = min(delays[worker.index] * 2, RESTART_DELAY_MAX) if quick else RESTART_DELAY
+                print(f"serve: worker {worker.index} exited with {worker.process.returncode}; "
+                      f"restarting in {delays[worker.index]:.0f}s", file=sys.stderr)
+                worker.process = None
+                asyncio.get_running_loop().call_later(delays[worker.index], self._restart, worker)
+
+    def _restart(self, worker: Worker):
+        if not self._stopping:
+            worker.restarts += 1
+            self.spawn(worker)
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping = True
+        for worker in self.workers:
+            if worker.process is not None and worker.process.poll() is None:
+                worker.process.terminate()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            if worker.process is not None:
+                try:
+                    worker.process.wait(max(0.1, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    worker.process.kill()
+
+    # Proxy
+
+    def choose(self, head: bytes, tried: set) -> tuple:
+        """(worker, pinned): the worker named by the request's cookie, else the least loaded"""
+        match = _COOKIE.search(head)
+        if match is not None:
+            index = int(match.group(1))
+            if index < len(self.workers) and index not in tried and self.workers[index].up:
+                return self.workers[index], True
+        candidates = [w for w in self.workers if w.index not in tried and w.up] or \
+                     [w for w in self.workers if w.index not in tried and w.process is not None]
+        if not candidates:
+            return None, False
+        return min(candidates, key=lambda w: (w.connections, w.served)), False
+
+    async def handle(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        try:
+            head = await client_reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            client_writer.close()
+            return
+        if head.split(b" ", 2)[1:2] == [_STATUS_PATH]:
+            await self._respond(client_writer, 200, json.dumps([w.status() for w in self.workers]))
+            return
+        tried = set()
+        while True:
+            worker, pinned = self.choose(head, tried)
+            if worker is None:
+                await self._respond(client_writer, 503, "No worker is available")
+                return
+            try:
+                backend_reader, backend_writer = await asyncio.open_connection("127.0.0.1", worker.port, limit=MAX_HEAD)
+                break
+            except OSError:
+                # Starting up, or gone: try another (a moved browser gets a new cookie)
+                tried.add(worker.index)
+                if time.monotonic() - worker.started > 30:
+                    worker.up = False
+        worker.up = True
+        worker.connections += 1
+        worker.served += 1
+        cookie = None if pinned else f"Set-Cookie: {AFFINITY_COOKIE}={worker.index}; Path=/; HttpOnly; SameSite=Lax\r\n".encode()
+        backend_writer.write(head)
+        try:
+            await asyncio.gather(_pipe(client_reader, backend_writer),
+                                 _pipe(backend_reader, client_writer, cookie))
+        finally:
+            worker.connections -= 1
+            for writer in (backend_writer, client_writer):
+                writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, body: str):
+        data = body.encode()
+        kind = "application/json" if status == 200 else "text/plain"
+        reason = "OK" if status == 200 else "Service Unavailable"
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {kind}\r\nContent-Length: {len(data)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def run(self, host: str, port: int):
+        for worker in self.workers:
+            self.spawn(worker)
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEAD)
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopped.set)
+        print(f"serve: {len(self.workers)} workers behind http://{host}:{port}", file=sys.stderr)
+        supervisor = asyncio.create_task(self.supervise())
+        async with server:
+            await stopped.wait()
+        supervisor.cancel()
+        self.stop()
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, cookie: bytes = None):
+    """Copy ``reader`` to ``writer`` until either side closes; ``cookie`` is added to the first head"""
+    try:
+        if cookie is not None:
+            head = await reader.readuntil(b"\r\n\r\n")
+            writer.write(head[:-2] + cookie + b"\r\n")
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError):
+        writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8501")))
+    parser.add_argument("--base-port", type=int, default=SERVE_BASE_PORT, help="first worker port")
+    parser.add_argument("--script", default="app.py")
+    parser.add_argument("streamlit_args", nargs="*", help="passed to each `streamlit run` (after --)")
+    args = parser.parse_args()
+    server = Server(max(1, args.workers), args.base_port, args.script, args.streamlit_args)
+    try:
+        asyncio.run(server.run(args.host, args.port))
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import os
+import tempfile
+import threading
+import time
+
+# Session state keys holding MessageLog histories (callers may pass their own)
+LOG_KEYS = ("confucius_messages", "mencius_messages", "debate_messages")
+
+# Session state keys holding objects that are cheap to recreate but expensive to keep
+HEAVY_KEYS = ("openai_client",)
+
+# Rough per-object cost of an OpenAI client (httpx connection pool, buffers)
+CLIENT_BYTES = 256 * 1024
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+class SessionRecord:
+    """What the governor knows about one browser session"""
+    __slots__ = ("session_id", "state", "log_keys", "last_seen", "evicted")
+
+    def __init__(self, session_id: str, state, log_keys=LOG_KEYS):
+        self.session_id = session_id
+        self.state = state
+        self.log_keys = tuple(log_keys)
+        self.last_seen = time.monotonic()
+        self.evicted = False
+
+    def logs(self):
+        for key in self.log_keys:
+            try:
+                log = self.state[key]
+            except KeyError:
+                continue
+            if hasattr(log, "spill"):
+                yield key, log
+
+    def cancel_jobs(self, reason: str):
+        """Stop the session's background generation jobs"""
+        try:
+            jobs = self.state["jobs"]
+        except KeyError:
+            return
+        for job in list(jobs.values()):
+            job.cancel(reason)
+
+    def approx_bytes(self) -> int:
+        total = sum(log.approx_bytes for _, log in self.logs())
+        for key in HEAVY_KEYS:
+            if key in self.state:
+                total += CLIENT_BYTES
+        return total
+
+class SessionGovernor:
+    """Process-wide memory governor for Streamlit sessions.
+
+    Every rerun calls ``touch()`` for the current session. The governor then
+    spills old history to disk when a session exceeds its cap, sweeps all
+    sessions against the global cap, and drops heavyweight objects (the OpenAI
+    client, most of the history) from sessions that have been idle for a while.
+    Sweeps run on the calling script thread at most every ``sweep_interval``.
+    Logs of other sessions are changed under each log's own lock (see MessageLog).
+    """
+
+    def __init__(self, session_max_bytes=None, global_max_bytes=None, idle_seconds=None,
+                 expire_seconds=None, keep_messages=None, spill_dir=None, sweep_interval=30):
+        self.session_max_bytes = session_max_bytes or _env_int("SESSION_MAX_BYTES", 2_000_000)
+        self.global_max_bytes = global_max_bytes or _env_int("GLOBAL_SESSION_MAX_BYTES", 200_000_000)
+        self.idle_seconds = idle_seconds or _env_int("SESSION_IDLE_SECONDS", 1800)
+        self.expire_seconds = expire_seconds or _env_int("SESSION_EXPIRE_SECONDS", 6 * 3600)
+        self.keep_messages = keep_messages or _env_int("SESSION_KEEP_MESSAGES", 20)
+        self.spill_dir = spill_dir or os.getenv(
+            "SESSION_SPILL_DIR", os.path.join(tempfile.gettempdir(), "philosophers_sessions")
+        )
+        self.sweep_interval = sweep_interval
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self.spill_events = 0
+        self.spilled_messages = 0
+        self.evictions = 0
+
+    def touch(self, session_id: str, state, log_keys=LOG_KEYS):
+        """Record activity for a session and enforce the caps"""
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                record = self._sessions[session_id] = SessionRecord(session_id, state, log_keys)
+            record.state = state
+            record.log_keys = tuple(log_keys)
+            record.last_seen = time.monotonic()
+            record.evicted = False
+            self._enforce_session(record, self.session_max_bytes)
+            if time.monotonic() - self._last_sweep >= self.sweep_interval:
+                self._sweep()
+
+    def _spill(self, record: SessionRecord, keep_last: int):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        for key, log in record.logs():
+            path = log.spill_path or os.path.join(self.spill_dir, f"{record.session_id}_{key}.jsonl")
+            count = log.spill(path, keep_last)
+            if count:
+                self.spill_events += 1
+                self.spilled_messages += count
+
+    def _enforce_session(self, record: SessionRecord, limit: int):
+        if record.approx_bytes() > limit:
+            self._spill(record, self.keep_messages)
+
+    def _evict(self, record: SessionRecord):
+        for key in HEAVY_KEYS:
+            try:
+                del record.state[key]
+            except KeyError:
+                pass
+        self._spill(record, min(self.keep_messages, 4))
+        record.evicted = True
+        self.evictions += 1
+
+    def _drop(self, record: SessionRecord, reason: str):
+        """Forget a session: stop its answers and free its history and spill files"""
+        record.cancel_jobs(reason)
+        for _, log in record.logs():
+            log.clear()
+        del self._sessions[record.session_id]
+
+    def _sweep(self):
+        self._last_sweep = now = time.monotonic()
+        for session_id, record in list(self._sessions.items()):
+            idle = now - record.last_seen
+            if not _is_active(session_id):
+                self._drop(record, "closed")  # closed tab: its history is gone
+            elif idle > self.expire_seconds:
+                self._drop(record, "expired")
+            elif idle > self.idle_seconds and not record.evicted:
+                self._evict(record)
+
+        # Over the global cap: spill the largest sessions first, idle ones before active ones
+        total = sum(record.approx_bytes() for record in self._sessions.values())
+        if total > self.global_max_bytes:
+            ranked = sorted(self._sessions.values(), key=lambda r: (not r.evicted, -r.approx_bytes()))
+            for record in ranked:
+                before = record.approx_bytes()
+                self._spill(record, self.keep_messages)
+                total -= before - record.approx_bytes()
+                if total <= self.global_max_bytes:
+                    break
+
+    def metrics(self) -> dict:
+        """Current usage snapshot for the metrics panel"""
+        with self._lock:
+            sizes = {sid: record.approx_bytes() for sid, record in self._sessions.items()}
+            idle = sum(1 for record in self._sessions.values() if record.evicted)
+        return {
+            "sessions": len(sizes),
+            "idle_evicted_sessions": idle,
+            "total_bytes": sum(sizes.values()),
+            "largest_session_bytes": max(sizes.values(), default=0),
+            "session_max_bytes": self.session_max_bytes,
+            "global_max_bytes": self.global_max_bytes,
+            "spill_events": self.spill_events,
+            "spilled_messages": self.spilled_messages,
+            "evictions": self.evictions,
+        }
+
+def _is_active(session_id: str) -> bool:
+    try:
+        from streamlit.runtime import Runtime
+        if Runtime.exists():
+            return Runtime.instance().is_active_session(session_id)
+    except Exception:
+        pass
+    return True
+
+_governor = None
+_governor_lock = threading.Lock()
+
+def get_governor() -> SessionGovernor:
+    """Return the process-wide governor"""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = SessionGovernor()
+        return _governor
@@ -0,0 +1,145 @@
+"""State shared by the app's worker processes, in a local SQLite file.
+
+``serve.py`` runs several Streamlit processes behind one port and points them
+all at ``SHARED_DB``. Each process still keeps its sessions in its own memory
+(the proxy sends a browser back to the same worker every time), but some state
+is worth more when every worker sees it:
+
+    answers     the answer cache (answer_cache.py): an answer warmed by one
+                worker is served by all, and a claim keeps two workers from
+                generating the same one
+    key_state   each API key's last-seen rate-limit headroom and quarantine
+                (key_pool.py), so a key one worker found rate-limited is
+                avoided by the others. Keys are stored by a hash, never in full
+
+The query log (query_log.py) stays in each worker's memory: it is never
+written to disk. Without ``SHARED_DB`` nothing is shared and the app runs as
+a single process, as before.
+
+Each thread has its own connection in autocommit mode, and WAL lets readers
+run alongside the one writer at a time. Times are Unix seconds, since
+monotonic clocks differ between processes.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SHARED_DB = os.getenv("SHARED_DB", "")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    persona TEXT, question TEXT, route TEXT, text TEXT, expires REAL, used REAL,
+    PRIMARY KEY (persona, question, route)
+);
+CREATE INDEX IF NOT EXISTS answers_used ON answers (used);
+CREATE TABLE IF NOT EXISTS claims (name TEXT PRIMARY KEY, holder TEXT, expires REAL);
+CREATE TABLE IF NOT EXISTS key_state (key TEXT PRIMARY KEY, state TEXT, updated REAL);
+"""
+
+def fingerprint(api_key: str) -> str:
+    """A key's name in the store; the key itself is never written"""
+    return hashlib.blake2b(api_key.encode("utf-8"), digest_size=8).hexdigest()
+
+class SharedStore:
+    """Answers, claims and key state in one SQLite file, safe to use from any thread or process"""
+
+    def __init__(self, path: str = SHARED_DB):
+        self.path = path
+        self.holder = f"{os.getpid()}-{os.urandom(4).hex()}"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        connection.close()
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    # Answers
+
+    def get_answer(self, key: tuple) -> str:
+        """An unexpired answer for (persona id, question, route name), marked as used; or None"""
+        now = time.time()
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT text FROM answers WHERE persona = ? AND question = ? AND route = ? AND expires > ?", (*key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        connection.execute("UPDATE answers SET used = ? WHERE persona = ? AND question = ? AND route = ?", (now, *key))
+        return row[0]
+
+    def put_answer(self, key: tuple, text: str, ttl: float, capacity: int):
+        """Store an answer; beyond ``capacity`` the least recently used are dropped"""
+        now = time.time()
+        connection = self._connection()
+        connection.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)", (*key, text, now + ttl, now))
+        connection.execute(
+            "DELETE FROM answers WHERE rowid IN (SELECT rowid FROM answers ORDER BY used DESC LIMIT -1 OFFSET ?)",
+            (capacity,)
+        )
+
+    def answer_expires(self, key: tuple) -> float:
+        """When the answer for ``key`` expires (Unix seconds), or 0 if there is none"""
+        row = self._connection().execute(
+            "SELECT expires FROM answers WHERE persona = ? AND question = ? AND route = ?", key
+        ).fetchone()
+        return row[0] if row else 0.0
+
+    def answer_count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    # Claims
+
+    def claim(self, name: str, ttl: float) -> bool:
+        """Hold ``name`` for ``ttl`` seconds; False if another process holds it"""
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO claims VALUES (?, ?, ?) ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, "
+            "expires = excluded.expires WHERE claims.expires <= ? OR claims.holder = excluded.holder",
+            (name, self.holder, now + ttl, now)
+        )
+        return cursor.rowcount > 0
+
+    # Key state
+
+    def put_key_states(self, rows: list):
+        """Write [(key fingerprint, state, updated)] in one transaction"""
+        connection = self._connection()
+        connection.execute("BEGIN")
+        try:
+            connection.executemany("INSERT OR REPLACE INTO key_state VALUES (?, ?, ?)",
+                                   [(key, json.dumps(state), updated) for key, state, updated in rows])
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def key_states(self, since: float = 0.0) -> dict:
+        """{key fingerprint: (state, updated)} for states written after ``since``"""
+        rows = self._connection().execute("SELECT key, state, updated FROM key_state WHERE updated > ?", (since,))
+        return {key: (json.loads(state), updated) for key, state, updated in rows}
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_shared_store() -> SharedStore:
+    """The process-wide store, or None when ``SHARED_DB`` is not set"""
+    global _store
+    if _store is None and SHARED_DB:
+        with _store_lock:
+            if _store is None:
+                _store = SharedStore()
+    return _store
@@ -0,0 +1,393 @@
+"""Request tracing with spans, written to a rotating local JSONL file.
+
+Set ``SPANS_FILE`` to record where the time goes between a user's action and
+the answer on screen. Each step is a span, and the spans of one action share a
+trace:
+
+    page.run        a Streamlit script run, and the reruns it leads to
+      page.css      injecting the shared CSS
+      chat.ask      a question to one persona, until its answer is committed
+        retrieval   passages for the prompt
+        job.queued  waiting for a generation worker
+        job.run     the worker, with one llm.stream per answer
+          llm.stream  the upstream request: events when the stream opened
+                      and at the first token
+      ui.follow     drawing streamed text, with the first flush of each job
+      jobs.commit   appending finished answers to the logs
+
+(debate.round takes chat.ask's place for debates.) Spans carry the session id
+and persona as attributes, which child spans inherit.
+
+Spans follow OpenTelemetry's data model: 16-byte trace and 8-byte span ids,
+parent ids, kinds, status, events and times in Unix nanoseconds, with the
+OTLP/JSON field names. One span is written per line, with attributes as a
+plain object. ``python spans.py otlp FILE`` converts a file to an OTLP/JSON
+request that an OpenTelemetry collector accepts. The file is rotated at
+``SPANS_MAX_MB``, keeping ``SPANS_BACKUPS`` old files (FILE.1, FILE.2, ...).
+
+    python spans.py list spans.jsonl                # the slowest traces
+    python spans.py waterfall spans.jsonl [TRACE]   # one trace (default: the slowest) as a waterfall
+"""
+import argparse
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+SPANS_FILE = os.getenv("SPANS_FILE", "")
+SPANS_MAX_MB = float(os.getenv("SPANS_MAX_MB", "20"))
+SPANS_BACKUPS = int(os.getenv("SPANS_BACKUPS", "3"))
+
+# Spans waiting to be written; beyond this, new ones are dropped
+SPANS_QUEUE = 10000
+
+# Attributes copied from a parent span to its children
+INHERITED = ("session.id", "app.persona")
+
+# Exceptions Streamlit uses to stop or rerun a script; a span they end is not an error
+_CONTROL_FLOW = ("RerunException", "StopException", "GeneratorExit")
+
+_current = contextvars.ContextVar("span", default=None)
+
+class Span:
+    """One timed step of a request"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "events", "status", "_token")
+
+    def __init__(self, name: str, parent: "Span" = None, kind: str = "INTERNAL", start: int = None, attributes: dict = None):
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else ""
+        self.name = name
+        self.kind = kind
+        self.start = start or time.time_ns()
+        self.end = None
+        self.attributes = {key: parent.attributes[key] for key in INHERITED if key in parent.attributes} if parent else {}
+        self.attributes.update((key, value) for key, value in (attributes or {}).items() if value is not None)
+        self.events = []
+        self.status = ("UNSET", "")
+        self._token = None
+
+    def __bool__(self):
+        return True
+
+    def set(self, key: str, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def event(self, name: str, **attributes):
+        self.events.append((name, time.time_ns(), attributes))
+
+    def finish(self, error: BaseException = None, end: int = None):
+        """End the span and queue it for export; later calls do nothing"""
+        if self.end is not None:
+            return
+        self.end = end or time.time_ns()
+        if error is not None:
+            if type(error).__name__ in _CONTROL_FLOW:
+                self.attributes["app.interrupted"] = type(error).__name__
+            else:
+                self.status = ("ERROR", f"{type(error).__name__}: {error}")
+        exporter = get_exporter()
+        if exporter is not None:
+            exporter.export(self)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        self.finish(exc)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": f"SPAN_KIND_{self.kind}",
+            "startTimeUnixNano": self.start,
+            "endTimeUnixNano": self.end,
+            "attributes": self.attributes,
+            "events": [{"name": name, "timeUnixNano": at, "attributes": attributes} for name, at, attributes in self.events],
+            "status": {"code": f"STATUS_CODE_{self.status[0]}", "message": self.status[1]},
+        }
+
+class _NoSpan:
+    """Stands in for a span when tracing is off"""
+    __slots__ = ()
+    trace_id = span_id = ""
+    attributes = {}
+
+    def __bool__(self):
+        return False
+
+    def set(self, key, value):
+        pass
+
+    def event(self, name, **attributes):
+        pass
+
+    def finish(self, error=None, end=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NO_SPAN = _NoSpan()
+
+def current() -> Span:
+    """The span active in this thread, or None"""
+    return _current.get()
+
+def activate(span) -> Span:
+    """Make ``span`` (or None) the active span in this thread, without ending the previous one"""
+    _current.set(span or None)
+    return span
+
+@contextmanager
+def using(span):
+    """Make ``span`` the active span inside the block, without ending it"""
+    token = _current.set(span or None)
+    try:
+        yield span
+    finally:
+        _current.reset(token)
+
+def start_span(name: str, parent: Span = None, kind: str = "INTERNAL", start: int = None, **attributes) -> Span:
+    """A new span under ``parent`` (default: the active span), ended by ``finish()``.
+
+    Used in a ``with`` block, it is also the active span until the block ends.
+    Attribute names with dots are passed as ``**{"session.id": ...}``.
+    """
+    if not SPANS_FILE:
+        return NO_SPAN
+    return Span(name, parent or current() or None, kind, start, attributes)
+
+class SpanExporter:
+    """Writes finished spans as JSON lines from a background thread, rotating the file by size"""
+
+    def __init__(self, path: str = SPANS_FILE, max_bytes: float = SPANS_MAX_MB * 1e6, backups: int = SPANS_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.exported = 0
+        self.dropped = 0
+        self._queue = queue.Queue(SPANS_QUEUE)
+        self._writer = threading.Thread(target=self._write, name="span-writer", daemon=True)
+        self._writer.start()
+
+    def export(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def _write(self):
+        out = open(self.path, "a", encoding="utf-8")
+        while True:
+            spans = [self._queue.get()]
+            while True:
+                try:
+                    spans.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                out.write("".join(json.dumps(span.to_dict(), separators=(",", ":"), default=str) + "\n" for span in spans))
+                out.flush()
+                self.exported += len(spans)
+                if out.tell() >= self.max_bytes:
+                    out.close()
+                    self._rotate()
+                    out = open(self.path, "a", encoding="utf-8")
+            except (OSError, ValueError):
+                self.dropped += len(spans)
+            finally:
+                for _ in spans:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Wait until every queued span is written"""
+        self._queue.join()
+
+    def metrics(self) -> dict:
+        return {"exported": self.exported, "queued": self._queue.qsize(), "dropped": self.dropped}
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def get_exporter() -> SpanExporter:
+    """The process-wide exporter, or None when SPANS_FILE is not set"""
+    global _exporter
+    if _exporter is None and SPANS_FILE:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = SpanExporter()
+    return _exporter
+
+def read_spans(path: str) -> list:
+    """Spans from a file and its rotated backups, oldest file first"""
+    paths = [path]
+    while os.path.exists(f"{path}.{len(paths)}"):
+        paths.append(f"{path}.{len(paths)}")
+    spans = []
+    for name in reversed(paths):
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    continue  # a line cut short when the app stopped
+    return spans
+
+def traces(spans: list) -> dict:
+    """Spans grouped by trace id"""
+    grouped = {}
+    for item in spans:
+        grouped.setdefault(item["traceId"], []).append(item)
+    return grouped
+
+def extent(trace: list) -> tuple:
+    """(start, end) of a trace in nanoseconds"""
+    return min(s["startTimeUnixNano"] for s in trace), max(s["endTimeUnixNano"] for s in trace)
+
+def _root(trace: list) -> dict:
+    ids = {s["spanId"] for s in trace}
+    roots = [s for s in trace if s["parentSpanId"] not in ids]
+    return min(roots or trace, key=lambda s: s["startTimeUnixNano"])
+
+def list_traces(spans: list, limit: int = 20) -> str:
+    """The slowest traces, one per line"""
+    rows = []
+    for trace_id, trace in traces(spans).items():
+        start, end = extent(trace)
+        root = _root(trace)
+        personas = sorted({s["attributes"]["app.persona"] for s in trace if "app.persona" in s["attributes"]})
+        rows.append(((end - start) / 1e6, trace_id, start, root, len(trace), personas))
+    rows.sort(key=lambda row: -row[0])
+    lines = [f"{'ms':>9}  {'trace':<32}  {'started':<19}  {'spans':>5}  root / personas"]
+    for ms, trace_id, start, root, count, personas in rows[:limit]:
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start / 1e9))
+        lines.append(f"{ms:>9.0f}  {trace_id}  {started}  {count:>5}  {root['name']} {', '.join(personas)}")
+    return "\n".join(lines)
+
+def waterfall(trace: list, width: int = 48) -> str:
+    """One trace as an indented tree with a bar per span on a shared time axis"""
+    start, end = extent(trace)
+    total = max(end - start, 1)
+    children = {}
+    for item in trace:
+        children.setdefault(item["parentSpanId"], []).append(item)
+    ids = {s["spanId"] for s in trace}
+    roots = [s for s in trace if s["parentSpanId"] not in ids]
+
+    root = _root(trace)
+    lines = [f"trace {root['traceId']}  {total / 1e6:.0f} ms  session {root['attributes'].get('session.id', '-')}",
+             f"{'start ms':>9} {'ms':>8}  {'':<{width}}  span"]
+
+    def walk(item, depth):
+        offset, length = item["startTimeUnixNano"] - start, item["endTimeUnixNano"] - item["startTimeUnixNano"]
+        left = int(offset / total * width)
+        bar = " " * left + "█" * max(1, int(length / total * width))
+        attributes = {key: value for key, value in item["attributes"].items() if key not in INHERITED}
+        status = " ERROR " + item["status"]["message"] if item["status"]["code"] == "STATUS_CODE_ERROR" else ""
+        detail = " ".join(f"{key}={value}" for key, value in attributes.items())
+        lines.append(f"{offset / 1e6:>9.1f} {length / 1e6:>8.1f}  {bar[:width]:<{width}}  {'  ' * depth}{item['name']}"
+                     f"{' [' + item['attributes']['app.persona'] + ']' if 'app.persona' in item['attributes'] else ''}"
+                     f"{status}  {detail}")
+        for event in item["events"]:
+            at = event["timeUnixNano"] - start
+            mark = " " * min(width - 1, int(at / total * width)) + "|"
+            lines.append(f"{at / 1e6:>9.1f} {'':>8}  {mark:<{width}}  {'  ' * (depth + 1)}· {event['name']}")
+        for child in sorted(children.get(item["spanId"], []), key=lambda s: s["startTimeUnixNano"]):
+            walk(child, depth + 1)
+
+    for item in sorted(roots, key=lambda s: s["startTimeUnixNano"]):
+        walk(item, 0)
+    return "\n".join(lines)
+
+# OTLP/JSON encodes enums as their numbers
+_KINDS = {"SPAN_KIND_INTERNAL": 1, "SPAN_KIND_SERVER": 2, "SPAN_KIND_CLIENT": 3}
+_STATUS = {"STATUS_CODE_UNSET": 0, "STATUS_CODE_OK": 1, "STATUS_CODE_ERROR": 2}
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def to_otlp(spans: list, service: str = "chatbotchinese") -> dict:
+    """An OTLP/JSON ExportTraceServiceRequest holding ``spans``"""
+    attributes = lambda values: [{"key": key, "value": _otlp_value(value)} for key, value in values.items()]
+    return {"resourceSpans": [{
+        "resource": {"attributes": attributes({"service.name": service})},
+        "scopeSpans": [{
+            "scope": {"name": "spans"},
+            "spans": [{
+                **item,
+                "startTimeUnixNano": str(item["startTimeUnixNano"]),
+                "endTimeUnixNano": str(item["endTimeUnixNano"]),
+                "kind": _KINDS.get(item["kind"], 0),
+                "status": {"code": _STATUS.get(item["status"]["code"], 0), "message": item["status"]["message"]},
+                "attributes": attributes(item["attributes"]),
+                "events": [{**event, "timeUnixNano": str(event["timeUnixNano"]), "attributes": attributes(event["attributes"])}
+                           for event in item["events"]],
+            } for item in spans],
+        }],
+    }]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Show traces recorded to SPANS_FILE.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("list", help="the slowest traces")
+    show.add_argument("file")
+    show.add_argument("-n", type=int, default=20)
+    fall = commands.add_parser("waterfall", help="one trace as a waterfall")
+    fall.add_argument("file")
+    fall.add_argument("trace", nargs="?", help="trace id or a prefix of it (default: the slowest trace)")
+    convert = commands.add_parser("otlp", help="the spans as an OTLP/JSON request")
+    convert.add_argument("file")
+    args = parser.parse_args()
+
+    spans = read_spans(args.file)
+    if args.command == "list":
+        print(list_traces(spans, args.n))
+    elif args.command == "waterfall":
+        grouped = traces(spans)
+        if args.trace:
+            matches = [trace for trace_id, trace in grouped.items() if trace_id.startswith(args.trace)]
+            if not matches:
+                raise SystemExit(f"no trace {args.trace} in {args.file}")
+            trace = matches[0]
+        elif grouped:
+            trace = max(grouped.values(), key=lambda trace: extent(trace)[1] - extent(trace)[0])
+        else:
+            raise SystemExit(f"no spans in {args.file}")
+        print(waterfall(trace))
+    else:
+        print(json.dumps(to_otlp(spans)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import asyncio
+
+from starlette.testclient import TestClient
+
+import api
+
+def test_cached_answer_is_looked_up_off_the_event_loop(monkeypatch):
+    calls = []
+
+    def cached_answer(persona, question, route, session=None):
+        try:
+            asyncio.get_running_loop()
+            calls.append("event loop")
+        except RuntimeError:
+            calls.append("thread")
+        return "Ren is humaneness."
+    monkeypatch.setattr(api, "cached_answer", cached_answer)
+
+    response = TestClient(api.app).post("/chat", json={"persona": "confucius", "question": "What is ren?"})
+
+    assert response.status_code == 200
+    assert "humaneness" in response.text
+    assert calls == ["thread"]
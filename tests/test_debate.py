@@ -0,0 +1,67 @@
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import search_index
+import utils
+from debate_state import debate_state_for
+from jobs import Job
+from message_log import MessageLog
+
+PAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pages", "1_Debate_Mode.py")
+
+@pytest.fixture
+def replies(tmp_path, monkeypatch):
+    """Debate turns answered without a model; records what each speaker was shown"""
+    monkeypatch.setattr(search_index, "_index", search_index.SearchIndex(str(tmp_path / "messages.db")))
+    monkeypatch.setattr(utils, "retrieve_context", lambda persona, query, k=2: [])
+    seen = []
+
+    def respond(topic, previous_exchanges, speaker, other_speaker_last=None, debaters=None, client=None, cancel=None):
+        messages = utils.build_debate_messages(topic, previous_exchanges, speaker, other_speaker_last, debaters)
+        seen.append((speaker, "\n".join(message["content"] for message in messages)))
+        yield f"{speaker} replies to the point."
+    monkeypatch.setattr(utils, "get_debate_response_streaming", respond)
+    return seen
+
+def test_continue_after_the_first_round_was_stopped_empty(replies):
+    page = AppTest.from_file(PAGE, default_timeout=30)
+    page.session_state["openai_client"] = object()
+    page.run()
+    # Start, then Stop before the first speaker wrote anything: only the topic is left
+    page.session_state["debate_messages"].append("user", "Is war ever just?", type="topic")
+    page.session_state["debate_lineup"] = ["Confucius", "Mencius"]
+    page.session_state["debate_active"] = True
+    page.run()
+
+    [button for button in page.button if "Continue" in button.label][0].click()
+    page.run()
+
+    assert not page.exception
+    turns = [msg for msg in page.session_state["debate_messages"] if msg.get("speaker")]
+    assert [msg["speaker"] for msg in turns] == ["Confucius", "Mencius"]
+
+def test_round_sees_spilled_turns_and_its_own(tmp_path, replies):
+    log = MessageLog("")
+    log.append("user", "Is war ever just?", type="topic")
+    log.append("assistant", "Confucius opens. Ritual restrains the ruler.", speaker="Confucius")
+    log.append("assistant", "Mencius answers. The people come first.", speaker="Mencius")
+    # The governor spills turns the debate's state has already taken in
+    state = debate_state_for(log, sides=2)
+    log.spill(str(tmp_path / "debate.jsonl"), keep_last=0)
+    assert log.spilled == 2 and debate_state_for(log, sides=2) is state
+
+    job = Job("debate_messages")
+    turns = utils._run_debate_round(job, "Is war ever just?", state, ["Confucius", "Mencius"],
+                                    "Mencius answers. The people come first.", None)
+
+    assert [speaker for speaker, _ in turns] == ["Confucius", "Mencius"]
+    # Mencius is answering Confucius's new turn, which is not in the log yet
+    assert "Confucius replies to the point." in replies[1][1]
+    assert "Confucius opens" in replies[1][1]
+    for speaker, text in turns:
+        log.append("assistant", text, speaker=speaker)
+    # Committing the turns the round already folded in leaves the state as it is
+    assert debate_state_for(log, sides=2) is state
+    assert list(state.recent) == turns
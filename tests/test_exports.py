@@ -0,0 +1,38 @@
+import functools
+
+import pytest
+
+import utils
+from exports import export_debate
+from message_log import MessageLog
+from offload import Offloader
+
+def debate() -> MessageLog:
+    log = MessageLog("")
+    log.append("user", "Is war ever just?", type="topic")
+    log.append("assistant", "Only to protect the people.", speaker="Mencius")
+    return log
+
+@pytest.fixture
+def pool(monkeypatch):
+    """A real one-worker pool behind utils.offload, giving up on a full queue at once"""
+    offloader = Offloader(workers=1, capacity=1)
+    monkeypatch.setattr(utils, "offload", functools.partial(offloader.run, wait=0.05, timeout=60))
+    yield offloader
+    offloader.shutdown()
+
+def test_export_runs_on_the_pool(pool):
+    data = utils.deferred_export(export_debate, debate(), "txt")()
+    assert "Mencius:\nOnly to protect the people." in data
+    assert pool.metrics()["completed"] == 1
+
+def test_export_is_built_inline_when_the_pool_is_busy(pool):
+    pool._slots.acquire()  # the only place in the queue is taken
+    data = utils.deferred_export(export_debate, debate(), "txt")()
+    assert "Topic: Is war ever just?" in data
+    assert pool.metrics()["rejected"] == 1
+
+def test_export_is_built_inline_when_its_arguments_do_not_pickle(pool):
+    messages = (msg for msg in debate())  # a generator cannot be sent to the pool
+    data = utils.deferred_export(export_debate, messages, "txt")()
+    assert "Mencius:\nOnly to protect the people." in data
@@ -0,0 +1,35 @@
+import pickle
+
+import pytest
+
+from exports import export_conversation
+from message_log import MessageLog
+from offload import Offloader
+
+def make_log(tmp_path) -> MessageLog:
+    log = MessageLog("system")
+    for i in range(6):
+        log.append("user" if i % 2 == 0 else "assistant", f"message {i}")
+    log.spill(str(tmp_path / "log.jsonl"), keep_last=2)
+    return log
+
+def test_pickled_log_keeps_its_messages_and_gets_its_own_lock(tmp_path):
+    log = make_log(tmp_path)
+    copy = pickle.loads(pickle.dumps(log))
+    assert copy.to_dicts() == log.to_dicts()
+    assert copy.spilled == 4 and copy.prompt() == log.prompt()
+    assert copy._lock is not log._lock
+    copy.append("user", "message 6")
+    assert len(copy) == len(log) + 1
+
+@pytest.fixture
+def pool():
+    offloader = Offloader(workers=1)
+    yield offloader
+    offloader.shutdown()
+
+def test_export_of_a_log_runs_on_the_process_pool(tmp_path, pool):
+    log = make_log(tmp_path)
+    text = pool.run(export_conversation, log, "Confucius", "txt", timeout=60)
+    assert pool.metrics()["completed"] == 1
+    assert all(f"message {i}" in text for i in range(6))
@@ -0,0 +1,37 @@
+import json
+
+import httpx2
+import openai
+
+import utils
+from message_log import MessageLog
+from routing import resolve
+
+def recording_client(bodies: list):
+    """An OpenAI client whose requests are recorded and answered with a short stream"""
+    def handler(request):
+        body = json.loads(request.content)
+        bodies.append(body)
+        chunk = {"id": "x", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                 "choices": [{"index": 0, "delta": {"content": "Reflect."}, "finish_reason": None}]}
+        return httpx2.Response(200, headers={"content-type": "text/event-stream"},
+                               content=f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode())
+    return openai.OpenAI(api_key="sk-test", http_client=httpx2.Client(transport=httpx2.MockTransport(handler)))
+
+def test_question_after_a_stopped_answer_sends_only_role_and_content():
+    log = MessageLog("You are Confucius.")
+    log.append("user", "What is ren?")
+    log.append("assistant", "Ren is", speaker="Confucius", type="stopped")
+    log.append("user", "Go on.")
+    bodies = []
+
+    text = "".join(utils.get_response_streaming("Go on.", "You are Confucius.", log, resolve("chat"),
+                                                recording_client(bodies)))
+
+    assert text == "Reflect."
+    assert bodies[0]["messages"] == [
+        {"role": "system", "content": "You are Confucius."},
+        {"role": "user", "content": "What is ren?"},
+        {"role": "assistant", "content": "Ren is"},
+        {"role": "user", "content": "Go on."},
+    ]
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+import quote_verifier
+
+QUOTE = 'The Master said, "Learning without thought is labour lost; thought without learning is perilous."'
+
+def use_index(monkeypatch, index_dir):
+    monkeypatch.setattr(quote_verifier, "INDEX_DIR", str(index_dir))
+    monkeypatch.setattr(quote_verifier, "_index", None)
+
+def test_empty_index_turns_verification_off(tmp_path, monkeypatch):
+    # What an earlier build without a corpus left behind
+    (tmp_path / "ngram_meta.json").write_text(json.dumps({"ngram": quote_verifier.NGRAM, "refs": []}))
+    (tmp_path / "ngrams.bin").write_bytes(b"")
+    (tmp_path / "ngram_docs.bin").write_bytes(b"")
+    use_index(monkeypatch, tmp_path)
+    assert quote_verifier.get_ngram_index() is None
+    assert quote_verifier.new_verifier() is None
+    assert quote_verifier.check_text(QUOTE) is None
+
+def test_build_without_passages_writes_nothing(tmp_path):
+    with pytest.raises(ValueError):
+        quote_verifier.build_ngram_index(str(tmp_path), passages=[])
+    assert list(tmp_path.iterdir()) == []
+
+def test_quotes_from_the_texts_are_attested(tmp_path, monkeypatch):
+    passages = [("analects", "2.15", QUOTE), ("analects", "2.17", "Yu, shall I teach you what knowledge is?")]
+    quote_verifier.build_ngram_index(str(tmp_path), passages)
+    use_index(monkeypatch, tmp_path)
+    checks = quote_verifier.check_text(f"Confucius taught that {QUOTE}")
+    assert [(check.status, check.reference) for check in checks] == [("attested", "Analects 2.15")]
+
+def test_text_between_two_quotations_is_not_a_quotation(tmp_path, monkeypatch):
+    passages = [("analects", "2.15", QUOTE)]
+    quote_verifier.build_ngram_index(str(tmp_path), passages)
+    use_index(monkeypatch, tmp_path)
+    answer = ('Cultivate "ren" through daily practice, careful reflection and humble study; '
+              'as the Master said "learning without thought is labour lost; thought without learning is perilous."')
+    expected = [("attested", "Analects 2.15", "learning without thought is labour lost; thought without learning is perilous.")]
+
+    checks = quote_verifier.check_text(answer)
+    assert [(check.status, check.reference, check.quote) for check in checks] == expected
+
+    # Streamed in small chunks, each quotation is checked once, when it closes
+    verifier = quote_verifier.new_verifier()
+    for i in range(0, len(answer), 5):
+        verifier.feed(answer[i:i + 5])
+    assert [(check.status, check.reference, check.quote) for check in verifier.checks] == expected
@@ -0,0 +1,39 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+import retrieval
+
+def test_build_without_passages_writes_nothing(tmp_path):
+    index_dir = tmp_path / "index"
+    with pytest.raises(ValueError):
+        retrieval.build_index(str(tmp_path), str(index_dir))
+    assert not index_dir.exists()
+
+def test_build_command_fails_without_corpus(tmp_path):
+    env = {"CORPUS_DIR": str(tmp_path), "PATH": ""}
+    result = subprocess.run([sys.executable, "retrieval.py", "build"], cwd=retrieval.os.path.dirname(retrieval.__file__),
+                            env=env, capture_output=True, text=True)
+    assert result.returncode == 1
+    assert "No passages found" in result.stderr
+
+@pytest.mark.parametrize("script", ["retrieval.py", "quote_verifier.py"])
+def test_optional_build_only_warns_without_corpus(tmp_path, script):
+    # What the Render and Railway builds run until the texts are bundled
+    env = {"CORPUS_DIR": str(tmp_path), "PATH": ""}
+    result = subprocess.run([sys.executable, script, "build", "--optional"], cwd=retrieval.os.path.dirname(retrieval.__file__),
+                            env=env, capture_output=True, text=True)
+    assert result.returncode == 0
+    assert result.stderr.startswith("warning:")
+
+def test_empty_index_counts_as_no_index(tmp_path, monkeypatch):
+    (tmp_path / "meta.json").write_text(json.dumps({"N": 0, "avgdl": 0.0, "books": [], "refs": [], "vocabulary": {}}))
+    for name in ("postings.bin", "norms.bin", "passages.bin"):
+        (tmp_path / name).write_bytes(b"")
+    (tmp_path / "offsets.bin").write_bytes(b"\0\0\0\0")
+    monkeypatch.setattr(retrieval, "INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(retrieval, "_index", None)
+    assert retrieval.get_index() is None
+    assert retrieval.passages_for("learning without thought") is None
@@ -0,0 +1,48 @@
+import os
+import threading
+
+import session_governor
+from message_log import MessageLog
+from session_governor import SessionGovernor
+
+def make_log(messages: int) -> MessageLog:
+    log = MessageLog("system")
+    for i in range(messages):
+        log.append("user" if i % 2 == 0 else "assistant", f"message {i} " * 20)
+    return log
+
+def test_expired_session_removes_spill_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_governor, "_is_active", lambda session_id: True)
+    governor = SessionGovernor(session_max_bytes=1, spill_dir=str(tmp_path), expire_seconds=1, sweep_interval=0)
+    state = {"confucius_messages": make_log(30), "jobs": {}}
+    governor.touch("old", state)
+    log = state["confucius_messages"]
+    assert log.spilled and os.path.exists(log.spill_path)
+    spill_path = log.spill_path
+
+    governor._sessions["old"].last_seen -= 10
+    governor.touch("new", {"confucius_messages": make_log(2)})
+
+    assert "old" not in governor._sessions
+    assert not os.path.exists(spill_path)
+    assert len(log) == 0 and log.spill_path is None
+
+def test_global_sweep_waits_for_the_owning_session(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_governor, "_is_active", lambda session_id: True)
+    governor = SessionGovernor(spill_dir=str(tmp_path), sweep_interval=0)
+    state = {"confucius_messages": make_log(40)}
+    governor.touch("other", state)
+    log = state["confucius_messages"]
+    log.append("user", "one more")
+    governor.global_max_bytes = 1
+
+    with log._lock:  # the owning session is appending
+        sweep = threading.Thread(target=governor.touch, args=("current", {}))
+        sweep.start()
+        sweep.join(0.2)
+        assert sweep.is_alive() and len(log) == 41
+    sweep.join(5)
+
+    assert not sweep.is_alive()
+    assert len(log) == governor.keep_messages and log.spilled == 21
+    assert len(log.to_dicts()) == 41
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+import key_pool
+from answer_cache import SharedAnswerCache
+from key_pool import KeyPool
+from shared_store import SharedStore
+
+KEYS = [("sk-test-aaaa", None, None), ("sk-test-bbbb", None, None)]
+
+@pytest.fixture
+def stores(tmp_path):
+    """Two workers' stores on one file"""
+    path = str(tmp_path / "shared.db")
+    return SharedStore(path), SharedStore(path)
+
+def test_claim_is_held_by_one_worker_until_it_expires(stores):
+    a, b = stores
+    assert a.claim("warm:q", 0.2)
+    assert not b.claim("warm:q", 0.2)
+    assert a.claim("warm:q", 0.2)  # the holder may renew
+    time.sleep(0.3)
+    assert b.claim("warm:q", 60)
+    assert not a.claim("warm:q", 60)
+
+def test_answers_are_shared_and_capped(stores):
+    a, b = stores
+    warmed, served = SharedAnswerCache(a, capacity=2), SharedAnswerCache(b, capacity=2)
+    key = ("confucius", "what is ren", "chat/Medium")
+    assert served.get(key) is None
+    warmed.put(key, "Ren is humaneness.")
+    assert served.get(key) == "Ren is humaneness."
+    warmed.put(("mencius", "q2", "chat/Medium"), "2")
+    time.sleep(0.01)
+    warmed.put(("mencius", "q3", "chat/Medium"), "3")
+    assert served.metrics()["entries"] == 2
+    assert warmed.claim(key, 60) and not served.claim(key, 60)
+
+def test_key_state_is_adopted_by_the_other_worker(stores):
+    a, b = stores
+    first, second = KeyPool(KEYS, a), KeyPool(KEYS, b)
+    key = first.acquire()
+    first.responded(key, {"x-ratelimit-limit-requests": "100", "x-ratelimit-remaining-requests": "3",
+                          "x-ratelimit-reset-requests": "30s"}, 0.1)
+    first.release(key)
+    first.flush()
+    second.sync()
+    same = next(k for k in second.keys if k.label == key.label)
+    assert same.limits["requests"][1] == 3
+    assert second.acquire() is not same  # the other key has more headroom
+
+    for _ in range(key_pool.KEY_QUARANTINE_AFTER):
+        limited = first.acquire(exclude=key)
+        first.failed(limited, 429, {})
+    assert limited.in_flight == 0
+    first.flush()
+    second.sync()
+    same = next(k for k in second.keys if k.label == limited.label)
+    assert same.quarantined_until > time.monotonic() + 50
+
+def test_keys_are_stored_by_fingerprint_only(stores, tmp_path):
+    a, _ = stores
+    pool = KeyPool(KEYS, a)
+    for _ in pool.keys:
+        pool.failed(pool.acquire(), 401, {})
+    assert [key.in_flight for key in pool.keys] == [0, 0]
+    pool.flush()
+    assert len(a.key_states()) == 2
+    data = b"".join(path.read_bytes() for path in tmp_path.iterdir())
+    assert b"sk-test" not in data
+
+def test_key_states_are_written_off_the_request_path(stores):
+    class RecordingStore(SharedStore):
+        def put_key_states(self, rows):
+            writes.append((threading.current_thread().name, len(rows)))
+            time.sleep(0.05)  # a slow disk
+            super().put_key_states(rows)
+
+    writes = []
+    pool = KeyPool(KEYS, RecordingStore(stores[0].path))
+    headers = {"x-ratelimit-limit-requests": "100", "x-ratelimit-remaining-requests": "50",
+               "x-ratelimit-reset-requests": "30s"}
+    start = time.perf_counter()
+    for _ in range(20):
+        key = pool.acquire()
+        pool.responded(key, headers, 0.1)
+        pool.release(key)
+    assert time.perf_counter() - start < 0.05
+    pool.flush()
+    assert {name for name, _ in writes} == {"key-state-writer"}
+    assert len(writes) < 20  # publishes that queue up while a write runs share the next one
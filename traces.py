@@ -0,0 +1,331 @@
+"""Anonymised traces of completion requests, and a replayer for them.
+
+Set ``TRACE_FILE`` to record the shape and timing of every completion the app
+makes (chat, debate and HTTP API), one JSON line each:
+
+    t                  wall-clock start, to the millisecond
+    route, model       the Route it was served on, and its backend
+    persona            persona id, found from the system prompt
+    layout             the prompt layout (prompt_layout.py)
+    messages           messages sent, system prompts included
+    prompt_tokens      input tokens
+    question_tokens    tokens in the last user message
+    completion_tokens  output tokens
+    cached_tokens      prompt tokens the provider served from its cache, if reported
+    ttft_ms            time to the first token (the whole call if not streamed)
+    gaps_ms            time between successive chunks of text
+    total_ms           until the last chunk
+    completed          False if stopped early
+
+No text, session or library id, key or address is kept, so a trace can be
+shared for capacity planning. ``TRACE_SAMPLE`` records a fraction of requests.
+Records are written by one background thread; recording stops when the file
+reaches ``TRACE_MAX_MB``.
+
+``python traces.py summary FILE`` describes the traffic in a trace. ``python
+traces.py replay FILE --speed 10`` sends it again, with arrivals ``--speed``
+times closer together. Each request is rebuilt from filler text of the
+recorded sizes and goes through ``utils.stream_completion`` as in the app. By
+default the answers come from a stand-in that repeats the recorded timing, so
+the app's own overhead and concurrency can be measured without API calls.
+``--backend openai`` (or ``local``) sends the requests to a real backend
+instead, with ``max_tokens`` set to the recorded completion length.
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import statistics
+import threading
+import time
+from types import SimpleNamespace
+
+from prompt_layout import persona_id
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", "1"))
+TRACE_MAX_MB = float(os.getenv("TRACE_MAX_MB", "100"))
+
+# Records waiting to be written; beyond this, new ones are dropped
+TRACE_QUEUE = 10000
+
+# Filler for replayed prompts and stand-in answers: about one token per repeat
+FILLER = "ren "
+
+class StreamTimer:
+    """Time to the first chunk of text and the gaps between the rest"""
+    __slots__ = ("start", "first", "gaps", "_last")
+
+    def __init__(self, start: float = None):
+        self.start = time.perf_counter() if start is None else start
+        self.first = None
+        self.gaps = []
+        self._last = None
+
+    def tick(self):
+        now = time.perf_counter()
+        if self._last is None:
+            self.first = now - self.start
+        else:
+            self.gaps.append(now - self._last)
+        self._last = now
+
+class TraceRecorder:
+    """Appends trace records to a JSONL file from a background thread"""
+
+    def __init__(self, path: str = TRACE_FILE, sample: float = TRACE_SAMPLE, max_bytes: float = TRACE_MAX_MB * 1e6):
+        self.path = path
+        self.sample = sample
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(TRACE_QUEUE)
+        self._writer = threading.Thread(target=self._write, name="trace-writer", daemon=True)
+        self._writer.start()
+
+    def record(self, route, messages: list, prompt_tokens: int, completion_tokens: int, start: float,
+               timer: StreamTimer = None, completed: bool = True, cached_tokens: int = None):
+        if self.size >= self.max_bytes or (self.sample < 1 and random.random() >= self.sample):
+            return
+        total = time.perf_counter() - start
+        question = next((m for m in reversed(messages) if m["role"] == "user"), None)
+        record = {
+            "t": round(time.time() - total, 3),
+            "route": route.name,
+            "backend": route.backends[0] if route.backends else None,
+            "model": route.model,
+            "persona": persona_id(messages),
+            "layout": getattr(messages, "layout", "prefix"),
+            "messages": len(messages),
+            "prompt_tokens": prompt_tokens,
+            "question_tokens": _tokens(question) if question is not None else 0,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "ttft_ms": round((timer.first if timer is not None and timer.first is not None else total) * 1000, 1),
+            "gaps_ms": [round(gap * 1000, 1) for gap in timer.gaps] if timer is not None else [],
+            "total_ms": round(total * 1000, 1),
+            "completed": completed,
+        }
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        with open(self.path, "a", encoding="utf-8") as out:
+            while True:
+                lines = [json.dumps(self._queue.get(), separators=(",", ":")) + "\n"]
+                while True:
+                    try:
+                        lines.append(json.dumps(self._queue.get_nowait(), separators=(",", ":")) + "\n")
+                    except queue.Empty:
+                        break
+                text = "".join(lines)
+                out.write(text)
+                out.flush()
+                self.size += len(text.encode("utf-8"))
+                self.recorded += len(lines)
+                for _ in lines:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Wait until every queued record is written"""
+        self._queue.join()
+
+    def metrics(self) -> dict:
+        return {"recorded": self.recorded, "queued": self._queue.qsize(), "dropped": self.dropped}
+
+def _tokens(message) -> int:
+    from message_log import estimate_tokens
+    return getattr(message, "tokens", None) or estimate_tokens(message["content"])
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def get_recorder() -> TraceRecorder:
+    """The process-wide recorder, or None when TRACE_FILE is not set"""
+    global _recorder
+    if _recorder is None and TRACE_FILE:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = TraceRecorder()
+    return _recorder
+
+def record(route, messages: list, prompt_tokens: int, completion_tokens: int, start: float,
+           timer: StreamTimer = None, completed: bool = True, cached_tokens: int = None):
+    """Trace one completion, if tracing is on"""
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.record(route, messages, prompt_tokens, completion_tokens, start, timer, completed, cached_tokens)
+
+def read_traces(path: str) -> list:
+    """Trace records from a JSONL file, oldest first"""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue  # a line cut short when the app stopped
+    records.sort(key=lambda record: record["t"])
+    return records
+
+def synthetic_prompt(record: dict) -> list:
+    """Messages of the recorded count and sizes, made of filler text"""
+    count = max(2, record["messages"])
+    question = max(1, record["question_tokens"])
+    # The system prompt takes what the question and the history leave over
+    history = [max(1, (record["prompt_tokens"] - question) // count)] * (count - 2)
+    system = max(1, record["prompt_tokens"] - question - sum(history))
+    messages = [{"role": "system", "content": FILLER * system}]
+    for i, tokens in enumerate(history):
+        messages.append({"role": "assistant" if (count - 3 - i) % 2 == 0 else "user", "content": FILLER * tokens})
+    messages.append({"role": "user", "content": FILLER * question})
+    return messages
+
+class StandInStream:
+    """Chunks of filler text at the recorded times, then the recorded usage"""
+
+    def __init__(self, record: dict):
+        self.record = record
+        self.closed = False
+
+    def __iter__(self):
+        record = self.record
+        gaps = record["gaps_ms"]
+        time.sleep(record["ttft_ms"] / 1000)
+        for gap in [0.0] + gaps:
+            if self.closed:
+                return
+            time.sleep(gap / 1000)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=FILLER))], usage=None)
+        yield SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=record["prompt_tokens"],
+                                                               completion_tokens=record["completion_tokens"]))
+
+    def close(self):
+        self.closed = True
+
+def stand_in_client(record: dict):
+    """An object shaped like the OpenAI client, answering with the record's timing"""
+    create = lambda **params: StandInStream(record)
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+def replay_one(record: dict, backend: str, scheduled: float, started: float) -> dict:
+    """Send one recorded request; returns its timing next to the recorded one"""
+    from routing import Route, resolve
+    from utils import stream_completion
+
+    mode, _, variant = record["route"].partition("/")
+    base = resolve(mode, variant)
+    client = stand_in_client(record) if backend == "stand-in" else None
+    # The stand-in is passed as the OpenAI client
+    route = Route(record["route"], base.model, max(1, record["completion_tokens"]), base.temperature,
+                  ("openai",) if client is not None else (backend,))
+    begin = time.perf_counter()
+    timer = StreamTimer(begin)
+    result = {"route": record["route"], "persona": record["persona"], "late_ms": round((begin - started - scheduled) * 1000, 1),
+              "recorded_ttft_ms": record["ttft_ms"], "recorded_total_ms": record["total_ms"], "error": None}
+    chunks = 0
+    try:
+        for _ in stream_completion(synthetic_prompt(record), route, client):
+            timer.tick()
+            chunks += 1
+    except Exception as e:
+        result["error"] = str(e)
+    result["ttft_ms"] = round((timer.first or 0) * 1000, 1)
+    result["total_ms"] = round((time.perf_counter() - begin) * 1000, 1)
+    result["chunks"] = chunks
+    return result
+
+def replay(records: list, speed: float = 1.0, backend: str = "stand-in", concurrency: int = 256) -> list:
+    """Send ``records`` again at their recorded arrival times, ``speed`` times faster"""
+    from concurrent.futures import ThreadPoolExecutor
+    import utils  # loaded before the clock starts rather than by the first request
+
+    if not records:
+        return []
+    t0 = records[0]["t"]
+    futures = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay") as pool:
+        for record in records:
+            scheduled = (record["t"] - t0) / speed
+            delay = started + scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(replay_one, record, backend, scheduled, started))
+    return [future.result() for future in futures]
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+def summary(records: list) -> str:
+    """The traffic profile of a trace: mix, sizes and timing"""
+    if not records:
+        return "no records"
+    span = records[-1]["t"] - records[0]["t"]
+    lines = [f"{len(records)} requests over {span:.0f}s ({len(records) / max(span, 1e-9):.2f}/s), "
+             f"{sum(not r['completed'] for r in records)} stopped early"]
+    groups = {}
+    for record in records:
+        groups.setdefault(f"{record['route']} {record['persona'] or '-'}", []).append(record)
+    lines.append(f"{'':<28}{'n':>6}{'msgs p50':>10}{'prompt p50':>12}{'output p50':>12}{'ttft p50':>10}{'p95':>8}{'gap p50':>9}")
+    for name, group in sorted(groups.items(), key=lambda pair: -len(pair[1])):
+        gaps = [gap for r in group for gap in r["gaps_ms"]]
+        lines.append(f"{name:<28}{len(group):>6}"
+                     f"{statistics.median(r['messages'] for r in group):>10.0f}"
+                     f"{statistics.median(r['prompt_tokens'] for r in group):>12.0f}"
+                     f"{statistics.median(r['completion_tokens'] for r in group):>12.0f}"
+                     f"{statistics.median(r['ttft_ms'] for r in group):>10.0f}"
+                     f"{percentile([r['ttft_ms'] for r in group], 0.95):>8.0f}"
+                     f"{statistics.median(gaps) if gaps else 0:>9.1f}")
+    return "\n".join(lines)
+
+def replay_report(results: list, elapsed: float) -> str:
+    """Replayed against recorded latency, and how far behind schedule requests started"""
+    errors = [r for r in results if r["error"]]
+    ok = [r for r in results if not r["error"]]
+    lines = [f"{len(results)} replayed in {elapsed:.1f}s ({len(results) / max(elapsed, 1e-9):.2f}/s), {len(errors)} errors"]
+    if errors:
+        lines.append(f"first error: {errors[0]['error']}")
+    if ok:
+        lines.append(f"{'':<14}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for name, key in (("ttft", "ttft_ms"), ("recorded ttft", "recorded_ttft_ms"),
+                          ("total", "total_ms"), ("recorded", "recorded_total_ms"), ("late start", "late_ms")):
+            values = [r[key] for r in ok]
+            lines.append(f"{name:<14}{statistics.median(values):>10.1f}{percentile(values, 0.95):>10.1f}{max(values):>10.1f}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise or replay a trace of completion requests.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("summary", help="describe the traffic in a trace")
+    show.add_argument("trace")
+    again = commands.add_parser("replay", help="send a trace's requests again")
+    again.add_argument("trace")
+    again.add_argument("--speed", type=float, default=1.0, help="arrivals this many times closer together")
+    again.add_argument("--backend", default="stand-in", help="stand-in (the recorded timing), openai, local or llamacpp")
+    again.add_argument("--limit", type=int, help="only the first N requests")
+    again.add_argument("--concurrency", type=int, default=256, help="requests in flight at most")
+    again.add_argument("-o", "--output", help="write each replayed request's timing to this JSONL file")
+    args = parser.parse_args()
+
+    records = read_traces(args.trace)
+    if args.command == "summary":
+        print(summary(records))
+        return
+    records = records[:args.limit] if args.limit else records
+    start = time.perf_counter()
+    results = replay(records, args.speed, args.backend, args.concurrency)
+    elapsed = time.perf_counter() - start
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            out.writelines(json.dumps(result) + "\n" for result in results)
+    print(replay_report(results, elapsed))
+
+if __name__ == "__main__":
+    main()
@@ -1,122 +1,65 @@
 import streamlit as st
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
-import json
+import html
+import secrets
+import time
 from datetime import datetime
+from message_log import Message, MessageLog, estimate_tokens
+from session_governor import get_governor
+from debate_state import DebateState, debate_state_for, truncate_tokens
+from persona_registry import get_persona, get_registry
+from retrieval import TOP_K, passages_for
+from quote_verifier import check_text, format_checks, new_verifier
+from safe_html import markdown_to_html
+from routing import LENGTHS, ROUTES, Route, expected_tokens, record as record_route, resolve, route_report
+from cancellation import CancelToken, cancel_metrics, record_cancelled
+from jobs import Follower, Job, submit
+from key_pool import get_key_pool, key_metrics
+from backends import complete, failover_metrics, stream as open_stream
+from offload import Busy, arun as aoffload, offload_metrics, run as offload
+from exports import export_conversation, export_debate
+from query_log import get_query_log
+from answer_cache import cache_metrics, get_answer_cache, get_warmer
+from search_index import get_search_index, valid_library
+from traces import StreamTimer, record as record_trace
+from prompt_layout import cached_tokens, debate_prompt, persona_id, prefix_cache_report, record as record_prefix_cache
+from spans import NO_SPAN, activate, current, start_span, using
+from debate_scheduler import AUTO_DEFAULT_ROUNDS, AUTO_MAX_ROUNDS, AUTO_TIME_BUDGET, AUTO_TOKEN_BUDGET, STOP_REASONS, Schedule
+from functools import lru_cache
 
-# Load environment variables
-load_dotenv()
-
-# System prompts
-CONFUCIUS_SYSTEM_PROMPT = """
-You are to speak and reason as Confucius (Kongzi), grounded in the teachings and voice of the Analects, contained in the file /mnt/data/confuncius.txt. Stay fully in character at all times.
-
-CORE PERSONA
-- Voice & style: brief, aphoristic, humane, practical. Prefer maxims and analogies ("The Master said…"). Favor questions that turn the listener inward.
-- Moral center: Goodness (Ren), Ritual/Propriety (Li), Rightness (Yi), Trustworthiness, Filial piety, Learning/Self-cultivation.
-- Method: teach by example, analogy, and calibrated advice suited to the asker's character. Encourage daily self-examination, modesty, and steady practice.
-
-DEFAULT RULES
-1. Be concise—1–3 short paragraphs or a few lines. When fitting, begin with "The Master said…".
-2. Anchor all guidance in the Analects (file: /mnt/data/confuncius.txt). Paraphrase or echo passages when relevant.
-3. Tune answers to the asker's disposition: restrain the rash, encourage the hesitant.
-4. On spirits, death, or the afterlife—redirect gently to duties among the living and proper conduct.
-5. Avoid anachronism: for modern topics, translate principles (virtue, ritual, roles, learning, moderation) without modern jargon.
-6. If a request violates virtue or propriety, refuse politely and explain the right course.
-
-CANONICAL STANCES
-- Human nature: people are similar by nature but diverge through practice; learning and reflection perfect character.
-- Learning: "Learn and reflect; think without learning and you go astray."
-- Self-cultivation: examine oneself daily in duty, trust, and practice.
-- Reciprocity: "Do not impose on others what you do not desire yourself."
-- Governance: lead by virtue and ritual, correct names, promote the upright.
-- Filial piety: honor parents and elders; counsel with respect; fulfill roles sincerely.
-- Profit vs. rightness: choose rightness over gain; live simply if rightly earned.
-- Speech: trustworthy yet measured; act more than you speak.
-
-THEMATIC GUIDANCE
-- Human nature → emphasize practice and reflection.
-- Leadership → rule by virtue, correct names, trust the people, self-example.
-- Family conflict → filial piety, gentle remonstration, constancy.
-- Study → alternate learning and reflection; delight in progress.
-- Revenge/injury → return uprightness for injury, kindness for kindness.
-
-STYLE & FORMAT
-- Begin with "The Master said…" or analogous phrasing.
-- Close, if apt, with a short practice (e.g., "Examine yourself on three points: duty, trust, practice.").
-
-BOUNDARIES
-- Decline requests for harm, deceit, or manipulation.
-- Avoid teaching military or exploitative schemes.
-- On spirits and omens, keep respectful distance and return to human affairs.
-
-PRIMARY SOURCE: Analects (file: /mnt/data/confuncius.txt)
-"""
-
-MENCIUS_SYSTEM_PROMPT = """
-You are to speak and reason as Mencius (Mengzi), grounded in the teachings of the Mencius (Mengzi). Stay fully in character at all times.
-
-CORE PERSONA
-- Voice & style: eloquent, argumentative, passionate. Use extended analogies and parables. Speak with conviction about human goodness and moral cultivation.
-- Moral center: Innate Goodness of Human Nature (Ren), Righteousness (Yi), Wisdom (Zhi), Propriety (Li), Humaneness/Benevolence. Emphasis on the "Four Beginnings" (compassion, shame, deference, right/wrong).
-- Method: use vivid analogies (the child at the well, Ox Mountain), argue for the inherent goodness of human nature, emphasize moral cultivation and the role of environment.
-
-DEFAULT RULES
-1. Be eloquent but clear—2–4 paragraphs. Use analogies and parables when appropriate.
-2. Anchor guidance in the Mencius. Reference key concepts: the Four Beginnings, the distinction between humans and animals, the role of qi (vital energy).
-3. Emphasize that human nature is inherently good; evil comes from losing one's original heart-mind or from poor environment/cultivation.
-4. On human nature: argue strongly for innate goodness. Use the analogy of the child at the well (all humans have compassion).
-5. On cultivation: emphasize "nourishing the qi," "seeking the lost heart," and the importance of a good environment.
-6. On governance: emphasize benevolent rule, the Mandate of Heaven, and that the people are most important.
-
-CANONICAL STANCES
-- Human nature: humans are inherently good. The Four Beginnings (compassion, shame, deference, right/wrong) are present in all.
-- Evil: comes from losing one's original heart-mind or from poor cultivation/environment (like Ox Mountain being deforested).
-- Self-cultivation: "nourish the vast, flowing qi," seek the lost heart, practice righteousness, and maintain the original goodness.
-- Governance: benevolent rule is essential. The ruler must care for the people. The people are more important than the ruler.
-- Righteousness vs. Profit: choose righteousness over profit. "Why must the king speak of profit? There is also benevolence and righteousness."
-- The Great Man: one who cannot be corrupted by wealth, poverty, or power.
-
-THEMATIC GUIDANCE
-- Human nature → argue for inherent goodness, use the child-at-well analogy, emphasize the Four Beginnings.
-- Moral cultivation → emphasize nourishing qi, seeking the lost heart, maintaining original goodness.
-- Governance → emphasize benevolent rule, the people's importance, the Mandate of Heaven.
-- Adversity → "When Heaven is about to confer a great responsibility on any man, it will exercise his mind with suffering..."
-- Family → filial piety and brotherly respect are natural extensions of the Four Beginnings.
-
-STYLE & FORMAT
-- Begin with "Mencius said…" or "I say to you…" when appropriate.
-- Use analogies and parables (child at the well, Ox Mountain, the sprout of goodness).
-- Speak with passion and conviction about human goodness.
-
-BOUNDARIES
-- Decline requests for harm, deceit, or manipulation.
-- Maintain the stance that human nature is good, but acknowledge that people can lose their way.
-- On spirits and omens, focus on the Mandate of Heaven in governance, but keep focus on human affairs.
-
-PRIMARY SOURCE: Mencius (Mengzi)
-"""
+# System prompts for the two original personas (see personas/ for all of them),
+# resolved on first access so importing utils does not load the registry
+_LEGACY_PROMPTS = {"CONFUCIUS_SYSTEM_PROMPT": "confucius", "MENCIUS_SYSTEM_PROMPT": "mencius"}
+
+def __getattr__(name):
+    if name in _LEGACY_PROMPTS:
+        return get_persona(_LEGACY_PROMPTS[name]).prompt
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Philosophers shown by default on the chat page and in debates
+DEFAULT_PERSONAS = ["confucius", "mencius"]
 
 def init_openai():
-    """Initialize OpenAI client with API key from environment or Streamlit secrets"""
-    api_key = None
+    """Initialize the OpenAI client over the pool of API keys from Streamlit secrets or environment"""
+    entries = None
     
     # Try loading from Streamlit secrets first (for deployment)
     try:
-        api_key = st.secrets["openai"]["api_key"]
+        entries = list(st.secrets["openai"]["keys"])
     except:
         try:
-            # Fallback to flat secrets structure
-            api_key = st.secrets.get("OPENAI_API_KEY", "")
+            entries = [st.secrets["openai"]["api_key"]]
         except:
-            pass
+            try:
+                # Fallback to flat secrets structure
+                entries = [key for key in st.secrets.get("OPENAI_API_KEYS", "").split(",") if key]
+                entries = entries or [st.secrets["OPENAI_API_KEY"]]
+            except:
+                entries = None
     
-    # If not in secrets, try environment variable (for local development)
-    if not api_key:
-        api_key = os.getenv("OPENAI_API_KEY")
+    # If not in secrets, the pool reads OPENAI_API_KEYS / OPENAI_API_KEY (for local development)
+    pool = get_key_pool(entries or None)
     
-    if not api_key:
+    if not pool.keys:
         st.error("⚠️ OpenAI API key not found. Please set it in Streamlit secrets or environment variables.")
         st.info("""
         **For Streamlit Cloud deployment:**
@@ -134,24 +77,163 @@ def init_openai():
         """)
         st.stop()
     
-    return OpenAI(api_key=api_key)
+    return pool.client()
 
 def init_session_state():
     """Initialize all session state variables"""
-    if "confucius_messages" not in st.session_state:
-        st.session_state.confucius_messages = []
-    if "mencius_messages" not in st.session_state:
-        st.session_state.mencius_messages = []
-    if "openai_client" not in st.session_state:
-        st.session_state.openai_client = init_openai()
+    begin_run()
+    for persona in get_registry().values():
+        if persona.messages_key not in st.session_state:
+            st.session_state[persona.messages_key] = MessageLog(persona.prompt)
+    if "selected_personas" not in st.session_state:
+        st.session_state.selected_personas = list(DEFAULT_PERSONAS)
+    if "debaters" not in st.session_state:
+        st.session_state.debaters = list(DEFAULT_PERSONAS)
+    if "debate_lineup" not in st.session_state:
+        st.session_state.debate_lineup = [get_persona(persona_id).name for persona_id in DEFAULT_PERSONAS]
     if "debate_messages" not in st.session_state:
-        st.session_state.debate_messages = []
+        st.session_state.debate_messages = MessageLog()
     if "debate_active" not in st.session_state:
         st.session_state.debate_active = False
+    if "debate_schedule" not in st.session_state:
+        st.session_state.debate_schedule = None
     if "response_length" not in st.session_state:
         st.session_state.response_length = "Medium"
     if "theme" not in st.session_state:
         st.session_state.theme = "light"
+    if "jobs" not in st.session_state:
+        st.session_state.jobs = {}
+    if "library" not in st.session_state:
+        library = st.query_params.get("library")
+        st.session_state.library = library if valid_library(library) else secrets.token_hex(8)
+    # Kept in the URL so that a bookmark finds the same saved messages
+    if st.query_params.get("library") != st.session_state.library:
+        st.query_params["library"] = st.session_state.library
+    commit_jobs()
+    track_session()
+
+def uses_openai() -> bool:
+    """Whether any route or persona may send requests to the OpenAI API"""
+    return any("openai" in resolve(mode, variant, persona).backends
+               for mode, variant in ROUTES for persona in get_registry().values())
+
+def get_client():
+    """This session's OpenAI client, created on the first question rather than on page load.
+
+    None when every route is served by local backends, so no API key is needed.
+    """
+    if st.session_state.get("openai_client") is None:
+        if not uses_openai():
+            return None
+        st.session_state.openai_client = init_openai()
+    return st.session_state.openai_client
+
+def _script_run_ctx():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        return get_script_run_ctx()
+    except Exception:
+        return None
+
+def begin_run():
+    """Start this script run's span, in the trace of the run that asked for the rerun"""
+    previous = st.session_state.get("run_span")
+    if previous:
+        previous.finish()  # cut short by a rerun or st.stop() before follow_jobs ended it
+    ctx = _script_run_ctx()
+    activate(None)  # the script thread may carry the previous run's span
+    run = start_span("page.run", st.session_state.pop("trace_parent", None), kind="SERVER",
+                     **{"session.id": ctx.session_id if ctx is not None else None})
+    st.session_state.run_span = activate(run)
+
+def end_run(rerun: bool = False):
+    """End this script run's span; with ``rerun`` the next run joins its trace"""
+    run = st.session_state.pop("run_span", None)
+    if run:
+        if rerun:
+            st.session_state.trace_parent = run
+        run.finish()
+    activate(None)
+
+def continue_trace():
+    """Have the rerun that follows a submit join this run's trace"""
+    if st.session_state.get("run_span"):
+        st.session_state.trace_parent = st.session_state.run_span
+
+def track_session():
+    """Report this rerun to the session governor, which enforces memory caps"""
+    ctx = _script_run_ctx()
+    if ctx is not None:
+        log_keys = [persona.messages_key for persona in get_registry().values()] + ["debate_messages"]
+        get_governor().touch(ctx.session_id, ctx.session_state, log_keys)
+
+def show_metrics_panel():
+    """Sidebar expander with process-wide usage metrics"""
+    usage = get_governor().metrics()
+    stopped = cancel_metrics()
+    offloaded = offload_metrics()
+    cached = cache_metrics()
+    with st.expander("📊 Usage"):
+        st.markdown(f"""
+- Sessions: **{usage['sessions']}** ({usage['idle_evicted_sessions']} idle)
+- History memory: **{usage['total_bytes'] / 1e6:.1f} MB** of {usage['global_max_bytes'] / 1e6:.0f} MB
+- Largest session: **{usage['largest_session_bytes'] / 1e3:.0f} KB** of {usage['session_max_bytes'] / 1e3:.0f} KB
+- Spilled to disk: **{usage['spilled_messages']}** messages in {usage['spill_events']} spills
+- Idle evictions: **{usage['evictions']}**
+- Stopped answers: **{stopped['cancelled']}**, ~{stopped['saved_tokens']:,} output tokens saved
+- Backend failovers: **{sum(failover_metrics().values())}**
+- Answer cache: **{cached['hits']}** of {cached['hits'] + cached['misses']} opening questions served, {cached['entries']} answers ready
+- Background jobs: **{offloaded['pending']}** queued of {offloaded['capacity']} on {offloaded['workers']} processes, {offloaded['rejected']} turned away
+""")
+        routes = route_report()
+        if routes:
+            st.markdown("**Requests by route**")
+            st.dataframe(
+                [{
+                    "Route": row["route"],
+                    "Model": row["model"],
+                    "Requests": row["requests"],
+                    "p50 s": round(row["p50"], 2),
+                    "p95 s": round(row["p95"], 2),
+                    "Tokens": row["prompt_tokens"] + row["completion_tokens"],
+                    "Cost $": round(row["cost"], 4),
+                } for row in routes],
+                hide_index=True,
+                use_container_width=True
+            )
+        prefixes = [row for row in prefix_cache_report() if row["reported"]]
+        if prefixes:
+            st.markdown("**Prompt cache**")
+            st.dataframe(
+                [{
+                    "Persona": row["persona"],
+                    "Mode": row["mode"],
+                    "Layout": row["layout"],
+                    "Requests": row["reported"],
+                    "With hits": row["hits"],
+                    "Cached tokens": f"{row['hit_rate']:.0%}",
+                } for row in prefixes],
+                hide_index=True,
+                use_container_width=True
+            )
+        keys = key_metrics()
+        if len(keys) > 1:
+            st.markdown("**API keys**")
+            st.dataframe(
+                [{
+                    "Key": row["key"],
+                    "Requests": row["requests"],
+                    "Req/min": row["rpm"],
+                    "Tokens": row["tokens"],
+                    "Errors": row["errors"],
+                    "429s": row["rate_limited"],
+                    "In flight": row["in_flight"],
+                    "Quota left": row["remaining_requests"],
+                    "Status": f"paused {row['quarantined_for']:.0f}s" if row["quarantined_for"] else "ok",
+                } for row in keys],
+                hide_index=True,
+                use_container_width=True
+            )
 
 # Preset questions organized by themes
 PRESET_QUESTIONS = {
@@ -189,94 +271,486 @@ PRESET_QUESTIONS = {
 
 def get_max_tokens(length_setting: str) -> int:
     """Convert length setting to max tokens"""
-    length_map = {
-        "Brief": 250,
-        "Medium": 500,
-        "Detailed": 800
-    }
-    return length_map.get(length_setting, 500)
-
-def get_response_streaming(user_message: str, system_prompt: str, messages_history: list, max_tokens: int = 500):
-    """Get streaming response from OpenAI API"""
-    try:
+    return resolve("chat", length_setting).max_tokens
+
+def build_prompt(system_prompt: str, messages_history, user_message: str, context: str = None) -> list:
+    """Build the messages list for a chat turn.
+
+    A MessageLog that already ends with the user's message is sent as-is via its
+    prompt view; plain lists of dicts are filtered and copied as before.
+    ``context`` (retrieved passages) goes last as a system message, leaving the
+    history untouched.
+    """
+    if isinstance(messages_history, MessageLog):
+        messages = messages_history.prompt(system_prompt)
+        if not (messages_history and messages_history[-1].role == "user" and messages_history[-1].content == user_message):
+            messages = messages + [{"role": "user", "content": user_message}]
+    else:
         messages = [{"role": "system", "content": system_prompt}]
         
         for msg in messages_history:
             if msg["role"] in ["user", "assistant"]:
-                messages.append(msg)
+                messages.append({"role": msg["role"], "content": msg["content"]})
         
         messages.append({"role": "user", "content": user_message})
-        
-        stream = st.session_state.openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=max_tokens,
-            stream=True
-        )
-        
+    
+    if context:
+        messages = messages + [{"role": "system", "content": context}]
+    return messages
+
+def retrieve_context(persona, query: str, k: int = TOP_K) -> str:
+    """Top-k passages from the persona's classical texts, formatted for the prompt"""
+    if not persona.corpus:
+        return None
+    with start_span("retrieval", **{"app.persona": persona.id}):
+        try:
+            return offload(passages_for, query, k, tuple(persona.corpus))
+        except Busy:
+            return None  # answer without passages rather than queue behind a backlog
+
+async def aretrieve_context(persona, query: str, k: int = TOP_K) -> str:
+    """``retrieve_context`` for the event loop"""
+    if not persona.corpus:
+        return None
+    try:
+        return await aoffload(passages_for, query, k, tuple(persona.corpus))
+    except Busy:
+        return None
+
+def stream_completion(messages: list, route: Route, client=None, cancel: CancelToken = None):
+    """Yield a streamed completion's text.
+
+    The upstream HTTP stream is closed as soon as ``cancel`` is set (the Stop
+    button, a clear) or the consumer closes the generator, so an abandoned
+    answer stops costing tokens at once rather than at max_tokens.
+    """
+    timer = StreamTimer()
+    call = start_span("llm.stream", kind="CLIENT", **{"app.route": route.name})
+    if call:
+        call.set("app.persona", persona_id(messages))
+    try:
+        stream, route = open_stream(messages, route, client)
+    except Exception as e:
+        call.finish(e)
+        raise
+    call.event("stream.open")
+    parts, usage, finished, failed, error = [], None, False, False, None
+    try:
         for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
+            if cancel is not None and cancel.cancelled:
+                break
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content is not None:
+                if not parts:
+                    call.event("first_token")
+                timer.tick()
+                parts.append(chunk.choices[0].delta.content)
+                yield parts[-1]
+        else:
+            finished = True
+    except BaseException as e:
+        failed, error = not isinstance(e, GeneratorExit), e
+        raise
+    finally:
+        stream.close()
+        text = "".join(parts)
+        prompt_tokens, completion_tokens = record_usage(route, timer.start, messages, text, usage, completed=finished, timer=timer)
+        if not finished and not failed:
+            record_cancelled(estimate_tokens(text), expected_tokens(route))
+        if call:
+            call.set("gen_ai.system", route.backends[0])
+            call.set("gen_ai.request.model", route.model)
+            call.set("gen_ai.usage.input_tokens", prompt_tokens)
+            call.set("gen_ai.usage.output_tokens", completion_tokens)
+            call.set("app.chunks", len(parts))
+            call.set("app.completed", finished)
+            if timer.first is not None:
+                call.set("app.ttft_ms", round(timer.first * 1000, 1))
+        call.finish(error)
+
+def get_response_streaming(user_message: str, system_prompt: str, messages_history: list, route: Route = None, client=None, context: str = None, cancel: CancelToken = None):
+    """Get streaming response from OpenAI API, on the model and budget chosen by ``route``"""
+    route = route or resolve("chat")
+    try:
+        messages = build_prompt(system_prompt, messages_history, user_message, context)
+        yield from stream_completion(messages, route, client, cancel)
     
     except Exception as e:
         yield f"An error occurred: {str(e)}"
 
-def get_response(user_message: str, system_prompt: str, messages_history: list, max_tokens: int = 500) -> str:
+def get_response(user_message: str, system_prompt: str, messages_history: list, route: Route = None, client=None, context: str = None) -> str:
     """Get response from OpenAI API using specified system prompt"""
+    route = route or resolve("chat")
     try:
-        messages = [{"role": "system", "content": system_prompt}]
+        messages = build_prompt(system_prompt, messages_history, user_message, context)
         
-        for msg in messages_history:
-            if msg["role"] in ["user", "assistant"]:
-                messages.append(msg)
-        
-        messages.append({"role": "user", "content": user_message})
-        
-        response = st.session_state.openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=max_tokens
-        )
+        with start_span("llm.complete", kind="CLIENT", **{"app.route": route.name, "app.persona": persona_id(messages)}):
+            start = time.perf_counter()
+            response, route = complete(messages, route, client)
         
-        return response.choices[0].message.content.strip()
+        text = response.choices[0].message.content.strip()
+        record_usage(route, start, messages, text, response.usage)
+        return text
     
     except Exception as e:
         return f"An error occurred: {str(e)}"
 
-def get_debate_response(topic: str, previous_exchanges: list, speaker: str, other_speaker_last: str = None) -> str:
-    """Get a debate response from a philosopher, considering what the other said"""
-    system_prompt = CONFUCIUS_SYSTEM_PROMPT if speaker == "Confucius" else MENCIUS_SYSTEM_PROMPT
-    
+def record_usage(route: Route, start: float, messages: list, text: str, usage=None, completed: bool = True, timer: StreamTimer = None):
+    """Add a request to the per-route and prefix-cache reports and the trace, estimating tokens if the API sent no usage.
+
+    Returns the (prompt, completion) token counts recorded.
+    """
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+    else:
+        prompt_tokens = sum(getattr(m, "tokens", None) or estimate_tokens(m["content"]) for m in messages)
+        completion_tokens = estimate_tokens(text)
+    cached = cached_tokens(usage)
+    record_route(route, time.perf_counter() - start, prompt_tokens, completion_tokens, completed)
+    record_prefix_cache(messages, route.name.partition("/")[0], prompt_tokens, cached)
+    record_trace(route, messages, prompt_tokens, completion_tokens, start, timer, completed, cached)
+    return prompt_tokens, completion_tokens
+
+def verify_quotes(text: str) -> list:
+    """Check the quotations in a finished answer against the classical texts"""
     try:
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        debate_context = f"\n\nYou are in a respectful philosophical dialogue with {('Mencius' if speaker == 'Confucius' else 'Confucius')}. "
-        debate_context += f"A student has asked: '{topic}'. "
-        
-        if other_speaker_last:
-            debate_context += f"\n\n{('Mencius' if speaker == 'Confucius' else 'Confucius')} just said:\n\"{other_speaker_last}\"\n\n"
-            debate_context += f"Respond thoughtfully, building on or respectfully contrasting with their view. Keep your response concise (2-3 paragraphs)."
+        return offload(check_text, text)
+    except Busy:
+        return None
+
+async def averify_quotes(text: str) -> list:
+    """``verify_quotes`` for the event loop"""
+    try:
+        return await aoffload(check_text, text)
+    except Busy:
+        return None
+
+def answer_notes_html(message) -> str:
+    """Captions under an answer: stopped early, and whether its quotations are attested"""
+    notes = []
+    if message.get("type") == "stopped":
+        notes.append("⏹ Stopped early")
+    if getattr(message, "quotes", None):
+        notes.extend(format_checks(message.quotes).split("  \n"))
+    return "".join(f"<div class='answer-note'>{html.escape(note)}</div>" for note in notes)
+
+def chat_turn_html(persona, message) -> str:
+    """One chat message as sanitised HTML, in a bubble like st.chat_message"""
+    role = message["role"]
+    avatar = persona.avatar if role == "assistant" else "🧑‍🎓"
+    notes = answer_notes_html(message) if role == "assistant" else ""
+    return (f"<div class='chat-turn {role} {persona.id}'><div class='chat-avatar'>{avatar}</div>"
+            f"<div class='chat-body'>{markdown_to_html(message['content'])}{notes}</div></div>")
+
+def debate_turn_fragment(speaker: str, body: str) -> str:
+    """A debate turn around already-sanitised ``body`` HTML"""
+    persona = get_persona(speaker)
+    return (f"<div class='debate-message {persona.id}'><div class='speaker-label {persona.id}'>"
+            f"{persona.chinese_name} {html.escape(speaker)}</div><div>{body}</div></div>")
+
+def debate_turn_html(message) -> str:
+    """A debate record (the topic or a turn) as sanitised HTML"""
+    if message.get("type") == "topic":
+        return ("<div class='debate-message topic'><div style='font-weight: 600; font-size: 1.1rem;'>📖 Topic for Discussion</div>"
+                f"<div style='margin-top: 0.5rem; font-size: 1rem;'>{html.escape(message['content'])}</div></div>")
+    return debate_turn_fragment(message["speaker"], markdown_to_html(message["content"]) + answer_notes_html(message))
+
+def renderer_for(key: str):
+    """The HTML renderer for the messages kept under session state ``key``"""
+    if key == "debate_messages":
+        return debate_turn_html
+    for persona in get_registry().values():
+        if persona.messages_key == key:
+            return lambda message: chat_turn_html(persona, message)
+    return None
+
+def message_html(log: MessageLog, message: Message, render) -> str:
+    """A message's HTML fragment, rendered and cached on the message the first time it is needed"""
+    if message.html is None:
+        return log.cache_html(message, render(message))
+    return message.html
+
+def show_transcript(log: MessageLog, render):
+    """The in-memory messages of ``log`` as a single HTML block built from their cached fragments"""
+    if log:
+        st.markdown("".join(message_html(log, message, render) for message in log), unsafe_allow_html=True)
+
+def build_debate_messages(topic: str, previous_exchanges: list, speaker: str, other_speaker_last: str = None, debaters: list = None) -> list:
+    """Build the messages list for one philosopher's debate turn.
+
+    Earlier rounds from ``previous_exchanges`` (the debate log, or its
+    DebateState) are included as a compact summary plus the last exchange
+    verbatim, kept under a fixed token budget so prompts stop growing as the
+    debate goes on. ``debaters``
+    lists every participant's name (Confucius and Mencius by default). The
+    messages are laid out by prompt_layout.debate_prompt.
+    """
+    debaters = debaters or [get_persona(persona_id).name for persona_id in DEFAULT_PERSONAS]
+    others = [name for name in debaters if name != speaker]
+    persona = get_persona(speaker)
+    turns = []
+    
+    if other_speaker_last:
+        if isinstance(previous_exchanges, DebateState):
+            state = previous_exchanges
         else:
-            debate_context += "Please share your initial thoughts on this matter."
+            state = debate_state_for(previous_exchanges or [], sides=len(debaters))
+        summary = state.summary()
+        own_last = state.last_turn(speaker, state.verbatim_budget)
+        recent = [(name, truncate_tokens(content, state.verbatim_budget)) for name, content in state.recent if name != speaker]
+        if not recent:
+            recent = [(others[-1], truncate_tokens(other_speaker_last, state.verbatim_budget))]
+        last_speaker, other_last = recent[-1]
         
-        messages.append({"role": "user", "content": debate_context})
+        if summary:
+            turns.append(f"Earlier in the debate:\n{summary}")
+        if own_last:
+            turns.append(f"You last said:\n\"{own_last}\"")
+        for name, content in recent[:-1]:
+            turns.append(f"{name} said:\n\"{content}\"")
+        turns.append(f"{last_speaker} just said:\n\"{other_last}\"")
+    
+    context = retrieve_context(persona, f"{topic} {other_speaker_last or ''}", k=2)
+    return debate_prompt(persona.prompt, others, topic, turns, context)
+
+def debate_route(speaker: str, other_speaker_last: str = None) -> Route:
+    """Openers go to the fast tier; replies to an argument get the standard one"""
+    return resolve("debate", "reply" if other_speaker_last else "opener", get_persona(speaker))
+
+def get_debate_response(topic: str, previous_exchanges: list, speaker: str, other_speaker_last: str = None, debaters: list = None, client=None) -> str:
+    """Get a debate response from a philosopher, considering what the others said"""
+    route = debate_route(speaker, other_speaker_last)
+    try:
+        messages = build_debate_messages(topic, previous_exchanges, speaker, other_speaker_last, debaters)
         
-        response = st.session_state.openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=400
-        )
+        with start_span("llm.complete", kind="CLIENT", **{"app.route": route.name, "app.persona": persona_id(messages)}):
+            start = time.perf_counter()
+            response, route = complete(messages, route, client)
         
-        return response.choices[0].message.content.strip()
+        text = response.choices[0].message.content.strip()
+        record_usage(route, start, messages, text, response.usage)
+        return text
     
     except Exception as e:
         return f"An error occurred: {str(e)}"
 
+def get_debate_response_streaming(topic: str, previous_exchanges: list, speaker: str, other_speaker_last: str = None, debaters: list = None, client=None, cancel: CancelToken = None):
+    """Stream a debate response from a philosopher, considering what the others said"""
+    route = debate_route(speaker, other_speaker_last)
+    try:
+        messages = build_debate_messages(topic, previous_exchanges, speaker, other_speaker_last, debaters)
+        yield from stream_completion(messages, route, client, cancel)
+    
+    except Exception as e:
+        yield f"An error occurred: {str(e)}"
+
+def active_job(key: str) -> Job:
+    """The background job currently answering into session state ``key``, if any"""
+    return st.session_state.jobs.get(key)
+
+def commit_jobs():
+    """Append answers finished by background jobs to their logs, each exactly once"""
+    jobs = st.session_state.jobs
+    if not jobs:
+        return
+    with start_span("jobs.commit", **{"app.jobs": len(jobs)}):
+        _commit_jobs(jobs)
+
+def _commit_jobs(jobs: dict):
+    for key, job in list(jobs.items()):
+        log = st.session_state.get(key)
+        render = renderer_for(key)
+        for entry in job.take_finished():
+            text = entry.text.strip()
+            if text and log is not None:
+                record = log.append("assistant", text, speaker=entry.speaker,
+                                    type="stopped" if entry.stopped else entry.type)
+                record.quotes = entry.quotes
+                get_search_index().add(st.session_state.library, key, entry.speaker, "assistant", text)
+                # Rendered once, now that the answer is final; reruns reuse the fragment
+                if render is not None:
+                    log.cache_html(record, render(record))
+        if job.settled:
+            job.span.finish()
+            del jobs[key]
+
+def add_message(key: str, role: str, content: str, type: str = None) -> Message:
+    """Append a message to the log under session state ``key`` and to the search index"""
+    record = st.session_state[key].append(role, content, type=type)
+    get_search_index().add(st.session_state.library, key, None, role, content)
+    return record
+
+def cancel_job(key: str, discard: bool = False):
+    """Stop the job answering into ``key``; ``discard`` drops its text instead of keeping it"""
+    job = active_job(key)
+    if job is not None:
+        job.cancel("cleared" if discard else "stopped")
+        if discard:
+            job.span.set("app.discarded", True)
+            job.span.finish()
+            del st.session_state.jobs[key]
+
+def _run_chat(job: Job, messages: list, route: Route, client):
+    job.begin(verifier=new_verifier())
+    try:
+        for chunk in stream_completion(messages, route, client, job.token):
+            job.emit(chunk)
+    except Exception as e:
+        job.emit(f"An error occurred: {str(e)}")
+    job.end()
+
+def warm_answer(persona_id: str, question: str, route_name: str) -> str:
+    """An opening answer for the answer cache, or None if the request failed"""
+    persona = get_persona(persona_id)
+    route = resolve(*route_name.split("/", 1), persona)
+    text = get_response(question, persona.prompt, [], route, None, retrieve_context(persona, question))
+    return None if text.startswith("An error occurred") else text
+
+def cached_answer(persona, question: str, route: Route, session: str = None) -> str:
+    """Log an opening question and return its pre-generated answer, if there is one"""
+    text = get_query_log().record(persona.id, question, route.name, session)
+    get_warmer(get_query_log(), warm_answer)
+    return get_answer_cache().get((persona.id, text, route.name)) if text else None
+
+def _replay_answer(job: Job, text: str):
+    job.begin(verifier=new_verifier())
+    job.emit(text)
+    job.end()
+
+def submit_chat(persona, question: str, route: Route) -> Job:
+    """Answer ``question`` (already appended to the persona's log) on a background worker"""
+    messages = st.session_state[persona.messages_key]
+    ask = start_span("chat.ask", **{"app.persona": persona.id, "app.route": route.name})
+    continue_trace()
+    if len(messages) == 1 and not messages.spilled:
+        ctx = _script_run_ctx()
+        text = cached_answer(persona, question, route, ctx.session_id if ctx is not None else None)
+        if text is not None:
+            ask.set("app.cached", True)
+            job = st.session_state.jobs[persona.messages_key] = Job(persona.messages_key, ask)
+            return submit(job, _replay_answer, text)
+    # Snapshot the prompt here: the log may grow while the worker runs
+    with using(ask):
+        prompt = list(build_prompt(persona.prompt, messages, question, retrieve_context(persona, question)))
+    job = st.session_state.jobs[persona.messages_key] = Job(persona.messages_key, ask)
+    return submit(job, _run_chat, prompt, route, get_client())
+
+def _run_debate_round(job: Job, topic: str, state: DebateState, debaters: list, last_turn: str, client, schedule: Schedule = None) -> list:
+    """Stream one turn per debater into ``job``; returns [(speaker, text)] of the turns taken.
+
+    Each finished turn is folded into ``state`` straight away, so the next
+    speaker sees it before it is committed to the log.
+    """
+    turns = []
+    for speaker in debaters:
+        if job.token.cancelled:
+            break
+        if schedule is not None and not schedule.budget_left(expected_tokens(debate_route(speaker, last_turn))):
+            break
+        entry = job.begin(speaker=speaker, type="response", verifier=new_verifier())
+        for chunk in get_debate_response_streaming(topic, state, speaker, last_turn, debaters, client, job.token):
+            job.emit(chunk)
+        job.end()
+        last_turn = entry.text.strip()
+        if last_turn:
+            # Committed to the log on the next run only if it has text
+            state.record(speaker, last_turn)
+        turns.append((speaker, last_turn))
+        if schedule is not None:
+            schedule.add_turn(estimate_tokens(last_turn))
+    return turns
+
+def _run_debate_rounds(job: Job, topic: str, state: DebateState, debaters: list, last_turn: str, client, schedule: Schedule):
+    previous = []
+    while True:
+        start = time.perf_counter()
+        turns = _run_debate_round(job, topic, state, debaters, last_turn, client, schedule)
+        if job.token.cancelled:
+            schedule.stop("stopped")
+        elif any(text.startswith("An error occurred") for _, text in turns):
+            schedule.stop("error")
+        if turns:
+            tokens = sum(estimate_tokens(text) for _, text in turns)
+            go_on = schedule.end_round(time.perf_counter() - start, tokens, turns, previous)
+        if not turns or not go_on or schedule.stop_reason or len(turns) < len(debaters):
+            return
+        last_turn, previous = turns[-1][1], turns
+
+def last_debate_turn() -> str:
+    """The latest debater's turn, spilled turns included; None if nobody has spoken yet"""
+    state = debate_state_for(st.session_state.debate_messages, sides=len(st.session_state.debate_lineup))
+    return state.recent[-1][1] if state.recent else None
+
+def submit_debate_round(topic: str, last_turn: str = None) -> Job:
+    """Each debater in the line-up speaks once, answering the previous speaker, on a background worker"""
+    debaters = list(st.session_state.debate_lineup)
+    state = debate_state_for(st.session_state.debate_messages, sides=len(debaters))
+    span = start_span("debate.round", **{"app.debaters": len(debaters)})
+    continue_trace()
+    job = st.session_state.jobs["debate_messages"] = Job("debate_messages", span)
+    return submit(job, _run_debate_round, topic, state, debaters, last_turn, get_client())
+
+def submit_debate_rounds(topic: str, schedule: Schedule, last_turn: str = None) -> Job:
+    """Run rounds back to back on a background worker until ``schedule`` stops them"""
+    debaters = list(st.session_state.debate_lineup)
+    state = debate_state_for(st.session_state.debate_messages, sides=len(debaters))
+    st.session_state.debate_schedule = schedule
+    span = start_span("debate.rounds", **{"app.debaters": len(debaters)})
+    continue_trace()
+    job = st.session_state.jobs["debate_messages"] = Job("debate_messages", span)
+    return submit(job, _run_debate_rounds, topic, state, debaters, last_turn, get_client(), schedule)
+
+def show_schedule_report(schedule: Schedule):
+    """Per-round latency and tokens of an auto-run debate, and why it stopped"""
+    report = schedule.snapshot()
+    reason = STOP_REASONS.get(report["stop_reason"], "running")
+    st.caption(f"⏩ Auto-run: {report['completed']} of {report['rounds']} rounds, "
+               f"~{report['tokens']} output tokens, {report['elapsed']:.1f}s ({reason})")
+    if report["reports"]:
+        with st.expander("Round timings"):
+            st.dataframe(
+                [{"round": r["round"], "turns": r["turns"], "latency (s)": round(r["latency"], 2),
+                  "tokens": r["tokens"]} for r in report["reports"]],
+                hide_index=True, use_container_width=True
+            )
+
+def follow_jobs(followers: list, flush_interval: float = 0.05):
+    """Draw running jobs as they stream, then rerun so the finished answers are committed.
+
+    Only this loop is interrupted when the user interacts with the page; the
+    jobs keep going and the next run re-attaches to them.
+    """
+    if not followers:
+        end_run()
+        return
+    with start_span("ui.follow", **{"app.jobs": len(followers)}) as span:
+        flushes = 0
+        for follower in followers:
+            _flush(follower)
+        while not all(follower.job.done for follower in followers):
+            time.sleep(flush_interval)
+            for follower in followers:
+                if follower.poll():
+                    flushes += 1
+                    _flush(follower)
+        for follower in followers:
+            if follower.poll():
+                _flush(follower)
+        span.set("app.flushes", flushes)
+    end_run(rerun=True)
+    st.rerun()
+
+def _flush(follower: Follower):
+    """Draw a follower, marking the first text to reach the screen on its job's span"""
+    follower.draw()
+    job = follower.job
+    if not job.shown and any(follower.texts):
+        job.shown = True
+        job.span.event("ui.first_flush")
+
 def create_navbar(current_page: str = "main"):
     """Create a navigation bar at the top of the page"""
+    (current() or NO_SPAN).set("app.page", current_page)
     main_active = "active" if current_page == "main" else ""
     debate_active = "active" if current_page == "debate" else ""
     
@@ -312,42 +786,69 @@ def show_preset_questions(philosopher_name: str):
                     return question
     return None
 
-def export_conversation(messages: list, philosopher: str, format: str = "txt") -> str:
-    """Export conversation in various formats"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    if format == "txt":
-        content = f"Conversation with {philosopher}\n"
-        content += f"Exported: {timestamp}\n"
-        content += "=" * 50 + "\n\n"
-        
-        for msg in messages:
-            role = "You" if msg["role"] == "user" else philosopher
-            content += f"{role}:\n{msg['content']}\n\n"
-        
-        return content
-    
-    elif format == "md":
-        content = f"# Conversation with {philosopher}\n\n"
-        content += f"**Exported:** {timestamp}\n\n"
-        content += "---\n\n"
-        
-        for msg in messages:
-            role = "**You**" if msg["role"] == "user" else f"**{philosopher}**"
-            content += f"{role}:\n\n{msg['content']}\n\n"
-        
-        return content
-    
-    elif format == "json":
-        export_data = {
-            "philosopher": philosopher,
-            "exported_at": timestamp,
-            "messages": messages
-        }
-        return json.dumps(export_data, indent=2, ensure_ascii=False)
-    
-    return ""
+def deferred_export(export, *args):
+    """Download data for st.download_button, built on the offload pool only when clicked"""
+    def build():
+        try:
+            return offload(export, *args)
+        except Exception:
+            # Busy, arguments that do not pickle, a broken pool: a slower download
+            # beats a failed one. An error in the export itself is raised again here.
+            return export(*args)
+    return build
+
+def search_hit_html(hit) -> str:
+    """One search result: where and when it was said, and the matching passage"""
+    if hit.log == "debate_messages":
+        where = f"Debate · {hit.speaker}" if hit.speaker else "Debate topic"
+    else:
+        persona = next((p for p in get_registry().values() if p.messages_key == hit.log), None)
+        name = persona.name if persona else "Chat"
+        where = f"{name} · you" if hit.role == "user" else name
+    when = datetime.fromtimestamp(hit.created).strftime("%d %b %Y %H:%M")
+    snippet = html.escape(hit.snippet).replace("\x02", "<mark>").replace("\x03", "</mark>")
+    return (f"<div class='search-hit'><div class='search-hit-meta'>{html.escape(where)} · {when}</div>"
+            f"<div>{snippet}</div></div>")
+
+def show_search_box():
+    """Sidebar search over this library's saved chats and debates"""
+    query = st.text_input("🔎 Search saved conversations", key="search_query", placeholder="e.g. filial piety")
+    if not query.strip():
+        return
+    hits = get_search_index().search(st.session_state.library, query)
+    if not hits:
+        st.caption("No matching messages")
+        return
+    st.markdown("".join(search_hit_html(hit) for hit in hits), unsafe_allow_html=True)
+
+@lru_cache(maxsize=1)
+def get_persona_css() -> str:
+    """CSS rules for each persona's card, chat messages and debate turns"""
+    rules = []
+    for persona in get_registry().values():
+        pid, colors = persona.id, persona.colors
+        rules.append(f"""
+    .{pid}-card {{ border-left: 4px solid {colors['accent']}; }}
+    .{pid}-card .philosopher-name {{ color: {colors['name']}; }}
+    .{pid}-card .philosopher-image {{ border-color: {colors['accent']}; }}
+    .{pid}-card .philosopher-header {{ border-bottom-color: {colors['border']}; }}
+    .{pid}-card .stChatMessage[data-testid*="assistant"], .chat-turn.assistant.{pid} {{
+        background: {colors['message_background']};
+        border-left: 3px solid {colors['accent']};
+    }}
+    .debate-message.{pid} {{
+        background: {colors['message_background']};
+        border-left-color: {colors['accent']};
+    }}
+    .speaker-label.{pid} {{ color: {colors['name']}; }}""")
+    return "\n".join(rules)
+
+def inject_shared_css(theme: str = "light"):
+    """Add the shared stylesheet to the page"""
+    with start_span("page.css"):
+        st.markdown(get_shared_css(theme), unsafe_allow_html=True)
 
+@lru_cache(maxsize=4)
 def get_shared_css(theme="light"):
     """Return shared CSS styling with theme support"""
     
@@ -631,63 +1132,68 @@ def get_shared_css(theme="light"):
         font-weight: 400;
     }}
     
-    /* Confucius specific colors */
-    .confucius-card {{
-        border-left: 4px solid #c17817;
+    /* Chat Messages */
+    .stChatMessage {{
+        background: transparent;
+        padding: 1rem;
+        margin: 0.5rem 0;
+        border-radius: 12px;
     }}
     
-    .confucius-card .philosopher-name {{
-        color: #8b4513;
+    .stChatMessage[data-testid*="user"] {{
+        background: #f8f9fa;
+        border-left: 3px solid #ddd;
     }}
     
-    .confucius-card .philosopher-image {{
-        border-color: #c17817;
+    /* Pre-rendered chat transcripts */
+    .chat-turn {{
+        display: flex;
+        gap: 0.75rem;
+        padding: 1rem;
+        margin: 0.5rem 0;
+        border-radius: 12px;
     }}
     
-    .confucius-card .philosopher-header {{
-        border-bottom-color: #f4e4d0;
+    .chat-turn.user {{
+        background: {hover_bg};
+        border-left: 3px solid {border_color};
     }}
     
-    /* Mencius specific colors */
-    .mencius-card {{
-        border-left: 4px solid #4a7c59;
+    .chat-avatar {{
+        font-size: 1.4rem;
+        line-height: 1.6rem;
     }}
     
-    .mencius-card .philosopher-name {{
-        color: #2f5233;
+    .chat-body {{
+        flex: 1;
+        min-width: 0;
     }}
     
-    .mencius-card .philosopher-image {{
-        border-color: #4a7c59;
+    .chat-body p:last-of-type {{
+        margin-bottom: 0;
     }}
     
-    .mencius-card .philosopher-header {{
-        border-bottom-color: #d4e8da;
+    .search-hit {{
+        font-size: 0.85rem;
+        padding: 0.5rem 0;
+        border-bottom: 1px solid {border_color};
     }}
     
-    /* Chat Messages */
-    .stChatMessage {{
-        background: transparent;
-        padding: 1rem;
-        margin: 0.5rem 0;
-        border-radius: 12px;
-    }}
-    
-    .stChatMessage[data-testid*="user"] {{
-        background: #f8f9fa;
-        border-left: 3px solid #ddd;
+    .search-hit-meta {{
+        font-size: 0.75rem;
+        color: {text_secondary};
     }}
     
-    /* Confucius chat messages */
-    .confucius-card .stChatMessage[data-testid*="assistant"] {{
-        background: linear-gradient(135deg, #fef9f3 0%, #fdf5e6 100%);
-        border-left: 3px solid #c17817;
+    .search-hit mark {{
+        background: #f6e05e;
+        color: inherit;
+        padding: 0 0.1rem;
     }}
     
-    /* Mencius chat messages */
-    .mencius-card .stChatMessage[data-testid*="assistant"] {{
-        background: linear-gradient(135deg, #f3faf5 0%, #e8f5e9 100%);
-        border-left: 3px solid #4a7c59;
+    .answer-note {{
+        font-size: 0.8rem;
+        color: {text_secondary};
+        margin-top: 0.4rem;
     }}
     
     /* Buttons */
@@ -767,16 +1273,6 @@ def get_shared_css(theme="light"):
         border-left: 4px solid;
     }}
     
-    .debate-message.confucius {{
-        background: linear-gradient(135deg, #fef9f3 0%, #fdf5e6 100%);
-        border-left-color: #c17817;
-    }}
-    
-    .debate-message.mencius {{
-        background: linear-gradient(135deg, #f3faf5 0%, #e8f5e9 100%);
-        border-left-color: #4a7c59;
-    }}
-    
     .debate-message.topic {{
         background: linear-gradient(135deg, #f0f4ff 0%, #e6eeff 100%);
         border-left-color: #4a6fa5;
@@ -790,13 +1286,8 @@ def get_shared_css(theme="light"):
         margin-bottom: 0.5rem;
     }}
     
-    .speaker-label.confucius {{
-        color: #8b4513;
-    }}
-    
-    .speaker-label.mencius {{
-        color: #2f5233;
-    }}
+    /* Persona colors (generated from personas/) */
+    {get_persona_css()}
     
     /* Scrollbar styling */
     ::-webkit-scrollbar {{